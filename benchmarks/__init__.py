@@ -0,0 +1,34 @@
+# benchmarks
+#
+# Performance benchmarks for the firmware hot paths.
+#
+# On the host, against the simulated hardware in sim/ (stage benchmarks plus end to end scenarios):
+#
+#   python -m benchmarks
+#
+# On the device, from the REPL (stage benchmarks with heap allocation checks):
+#
+#   import benchmarks.bench_hx711 as b
+#   b.run()
+#   import benchmarks.bench_pipeline as b
+#   b.run()
+#   import benchmarks.bench_feedback as b
+#   b.run()
+#   import benchmarks.bench_delta as b
+#   b.run()
+#   import benchmarks.bench_fixedpoint as b
+#   b.run()
+#   import benchmarks.bench_calibration as b
+#   b.run()
+#   import benchmarks.bench_reps as b
+#   b.run()
+#   import benchmarks.bench_recorder as b
+#   b.run()
+#   import benchmarks.bench_txscheduler as b
+#   b.run()
+#   import benchmarks.bench_multichannel as b
+#   b.run()
+#   import benchmarks.bench_patterns as b
+#   b.run()
+#   import benchmarks.bench_boot as b
+#   b.run()
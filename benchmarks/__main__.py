@@ -0,0 +1,76 @@
+# __main__.py
+#
+# Run the whole benchmark suite on the host against the simulated hardware:
+#
+#   python -m benchmarks
+
+import os
+import sys
+
+
+def main():
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sim_dir = os.path.join(repo, 'sim')
+    sys.path.insert(0, sim_dir)
+
+    import simhw
+    simhw.clock = simhw.SimClock(speed=1.0)
+    simhw.clock.install()
+    simhw.attach_hx711(noise=20.0)
+    simhw.central.connect()
+
+    import board
+    import digitalio
+    from hx711 import HX711
+    from adafruit_ble.services.nordic import UARTService
+
+    power = digitalio.DigitalInOut(board.D5)
+    power.switch_to_output()
+    power.value = True
+    hx = HX711(digitalio.DigitalInOut(board.D9), digitalio.DigitalInOut(board.D10))
+    uart = UARTService()
+
+    from benchmarks import bench_hx711, bench_pipeline, bench_commands, bench_feedback, bench_delta, bench_fixedpoint, bench_calibration, bench_reps, bench_recorder, bench_txscheduler, bench_multichannel, bench_patterns, bench_boot, scenarios
+
+    print('=== HX711 read path ===')
+    bench_hx711.run(hx)
+    print('=== Sample pipeline stages ===')
+    bench_pipeline.run(hx, uart)
+    print('=== Command parsing ===')
+    bench_commands.run()
+    print('=== Motor feedback engine ===')
+    bench_feedback.run()
+    print('=== Delta stream encoding ===')
+    bench_delta.run()
+    print('=== Fixed point filter ===')
+    bench_fixedpoint.run()
+    print('=== Multi point calibration ===')
+    bench_calibration.run()
+    print('=== Rep analyser ===')
+    bench_reps.run()
+    print('=== Offline recorder ===')
+    bench_recorder.run()
+    print('=== TX scheduler ===')
+    bench_txscheduler.run()
+    print('=== Multi channel HX711 ===')
+    bench_multichannel.run()
+    print('=== Pattern sequencer ===')
+    bench_patterns.run()
+    print('=== Start up ===')
+    bench_boot.run()
+
+    simhw.clock.uninstall()
+
+    print('=== Firmware boot ===')
+    bench_boot.firmware()
+    print('=== Firmware pattern upload ===')
+    bench_patterns.firmware()
+    print('=== Firmware motor pulse ===')
+    bench_feedback.firmware()
+
+    print('=== End to end scenarios ===')
+    scenarios.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# bench_boot.py
+#
+# Start up time. run() power cycles the amplifier and times HX711 construction and the wait for
+# its first conversion, which used to be a fixed 1s sleep. firmware() boots the unmodified
+# firmware on the host simulation and checks the BOOT breakdown against the advertising target.
+
+import time
+
+from ticks import ticks_ms, ticks_diff
+
+
+ADVERTISING_TARGET_MS = 300
+CONSTRUCT_LIMIT_MS = 20         # No fixed delay left in HX711.__init__
+
+
+def run():
+    import board
+    import digitalio
+    from hx711 import HX711
+
+    power = digitalio.DigitalInOut(board.D5)
+    power.switch_to_output()
+    power.value = False
+    time.sleep(0.01)
+
+    start = ticks_ms()
+    power.value = True
+    hx = HX711(digitalio.DigitalInOut(board.D9), digitalio.DigitalInOut(board.D10))
+    constructed = ticks_diff(ticks_ms(), start)
+    hx.read_long()
+    first = ticks_diff(ticks_ms(), start)
+
+    print(f'HX711 construct: {constructed}ms, first conversion: {first}ms (settling allowance {hx.settle_ms}ms)')
+    assert constructed <= CONSTRUCT_LIMIT_MS, 'HX711 construction blocked'
+    assert first <= hx.settle_ms + hx.timeout_ms, 'first conversion outside the settling allowance'
+    assert not hx.fault
+
+
+# Host only: boot the firmware, connect and fetch the breakdown with the BOOT command
+def firmware():
+    from benchmarks.scenarios import _run_firmware, steady, SPEED, HX711_MODEL
+    run_firmware = _run_firmware()
+    result = run_firmware(1.5, setup=steady, speed=SPEED, commands=((1.0, 'BOOT'),), hx711=HX711_MODEL)
+
+    lines = [line for line in result.lines if line.startswith('B:')]
+    assert lines, 'no boot breakdown'
+    times = {}
+    for part in lines[0][2:].split(','):
+        name, ms = part.split(':')
+        times[name] = int(ms)
+    print('boot (ms): ' + ', '.join(f'{name} {ms}' for name, ms in times.items()))
+
+    for name in ('advertising', 'imports', 'subsystems', 'main_loop', 'connected', 'first_sample'):
+        assert name in times, f'no {name} milestone'
+    assert times['advertising'] <= ADVERTISING_TARGET_MS, 'advertising later than the target'
+    assert times['advertising'] <= times['imports'], 'advertising waited for the imports'
+
+
+if __name__ == '__main__':
+    run()
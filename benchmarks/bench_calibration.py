@@ -0,0 +1,104 @@
+# bench_calibration.py
+#
+# Multi point calibration table: load error on a non-linear cell with a single scale factor
+# against 3 to 8 table points, windowed statistics through the table, and a check that the per
+# sample lookup cost stays flat as the table grows.
+
+from benchmarks.benchutil import measure, report, quiet
+from calibration import CalibrationTable, Q_BITS
+
+
+FULL_SCALE = 100.0
+LOOKUP_TOLERANCE = 2.5      # A full table costs up to 3 more search steps than one point, about 2x on the host
+LOOKUP_RUNS = 5             # Best of this many timings per table size, to ride out host scheduling noise
+
+
+# Tared counts for a load on a cell that gets stiffer (fewer counts per unit) towards full scale
+def cell_counts(load):
+    return 1000.0*load - 2.0*load*load
+
+
+def worst_error(evaluate, steps=200):
+    worst = 0.0
+    for i in range(steps + 1):
+        load = FULL_SCALE*i/steps
+        error = abs(evaluate(cell_counts(load)) - load)
+        if error > worst:
+            worst = error
+    return worst
+
+
+def make_table(points):
+    table = CalibrationTable()
+    for i in range(1, points):
+        load = FULL_SCALE*i/(points - 1)
+        table.add_point(cell_counts(load), load)
+    return table
+
+
+# A manager on the table, its window filled with a load alternating SPREAD_LOAD either side of CENTRE_LOAD
+CENTRE_LOAD = 0.75*FULL_SCALE
+SPREAD_LOAD = 0.5
+
+def make_manager(table):
+    from datastreammanager import DataStreamManager
+    dsm = DataStreamManager(lambda: None, 1.0, outlier_window=0)
+    dsm.tare_val = 0.0
+    dsm.calibration_table = table       # Not saved, so the settings store keeps its table
+    for i in range(dsm.history.capacity):
+        dsm.add_sample(round(cell_counts(CENTRE_LOAD + (SPREAD_LOAD if i & 1 else -SPREAD_LOAD))))
+    return dsm
+
+
+def run(count=1000):
+    # --- Accuracy: single scale factor calibrated at full scale, then table points ---
+    scale = FULL_SCALE/cell_counts(FULL_SCALE)
+    single = worst_error(lambda counts: counts*scale)
+    print(f'single point: worst error {single:.3f} ({100*single/FULL_SCALE:.2f}% of full scale)')
+
+    previous = single
+    for points in (3, 4, 6, 8):
+        table = make_table(points)
+        error = worst_error(table.evaluate)
+        error_q = worst_error(lambda counts: table.evaluate_q(round(counts*(1 << Q_BITS))))
+        print(f'{points} points: worst error {error:.3f}, fixed point {error_q:.3f}')
+        assert error < previous, 'more calibration points did not reduce the error'
+        previous = error
+
+    # --- Windowed statistics and the stability check use the table like the stream does ---
+    table = make_table(CalibrationTable.MAX_POINTS)
+    dsm = quiet(make_manager, table)
+    limit = worst_error(table.evaluate)
+    mean = dsm.get_window_mean()
+    assert abs(mean - CENTRE_LOAD) <= limit, f'window mean {mean:.3f}, load {CENTRE_LOAD}'
+    assert abs(dsm.get_window_range() - 2*SPREAD_LOAD) <= 0.05*SPREAD_LOAD, 'window range not through the table'
+    assert dsm.is_stable(SPREAD_LOAD*1.05) and not dsm.is_stable(SPREAD_LOAD*0.95), 'stability not judged in table units'
+    print(f'window mean {mean:.3f}, range {dsm.get_window_range():.3f}, stddev {dsm.get_window_stddev():.3f} at load {CENTRE_LOAD} +/- {SPREAD_LOAD}')
+
+    # --- Lookup cost against table size ---
+    inputs = [round(cell_counts(FULL_SCALE*i/count)*(1 << Q_BITS)) for i in range(count)]
+    costs = {}
+    for points in (2, 4, CalibrationTable.MAX_POINTS):
+        table = make_table(points)
+        index = [0]
+
+        def lookup():
+            i = index[0]
+            table.evaluate_q(inputs[i])
+            index[0] = (i + 1) % count
+
+        best = None
+        for attempt in range(LOOKUP_RUNS):
+            us, allocated = measure(lookup, 10*count)
+            if best is None or us < best:
+                best = us
+        report(f'{points} point lookup', best, allocated)
+        costs[points] = best
+
+    ratio = costs[CalibrationTable.MAX_POINTS]/costs[2]
+    print(f'{CalibrationTable.MAX_POINTS} point lookup is {ratio:.2f}x the 2 point lookup')
+    assert ratio <= LOOKUP_TOLERANCE, 'lookup cost grows with the number of calibration points'
+
+
+if __name__ == '__main__':
+    run()
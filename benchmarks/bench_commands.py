@@ -0,0 +1,110 @@
+# bench_commands.py
+#
+# Command RX framing and dispatch throughput
+
+from benchmarks.benchutil import now_us, measure, report
+from commandparser import LineFramer, CommandDispatcher
+from responses import OK, BAD_ARGUMENT
+
+
+# Byte source with the parts of the UARTService interface the framer uses
+class BurstSource:
+
+    def __init__(self, data, chunk=20):
+        self.data = data
+        self.chunk = chunk      # Bytes per BLE write
+        self.pos = 0
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.pos)
+
+    def readinto(self, buf):
+        count = min(len(buf), self.in_waiting)
+        buf[:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+
+BURST = b'TARE\nCAL12.5\nMP0.5:1.0\nMRP3.0\nMR2.5\nmpow0.8\nSETCI30\nC1.02.03.04.05.0\n12.0014.0015.00\nTH0.5;'
+
+
+def run(repeats=50):
+    handled = [0]
+
+    def handler(args):
+        handled[0] += 1
+
+    dispatcher = CommandDispatcher()
+    for name in ('TARE', 'CAL', 'MP', 'MRP', 'MR', 'MPOW', 'SETCI', 'C', 'TH', ''):
+        dispatcher.register(name, handler)
+
+    # Whole pipeline: chunked reads, framing and dispatch of a burst of commands
+    framer = LineFramer()
+    source = BurstSource(BURST*repeats)
+    start = now_us()
+    while source.in_waiting:
+        framer.poll(source)
+        line = framer.next_line()
+        while line is not None:
+            dispatcher.execute(line)
+            line = framer.next_line()
+    elapsed = now_us() - start
+
+    print(f'commands: {handled[0]} in {elapsed}us, {handled[0]*1000000/max(elapsed, 1):.0f} commands/sec')
+
+    # Per command parse latency
+    def parse_one():
+        framer.feed(b'MRP3.0\n')
+        dispatcher.execute(framer.next_line())
+
+    us, allocated = measure(parse_one, 200)
+    report('frame+dispatch one command', us, allocated)
+
+    check_framing()
+
+
+# Every line comes out once: overlong lines as OVERFLOW (with their request id), the rest intact
+def drain(framer, data, chunk=20):
+    source = BurstSource(data, chunk)
+    lines = []
+    while source.in_waiting:
+        framer.poll(source)
+        line = framer.next_line()
+        while line is not None:
+            lines.append((line, framer.overflow_id) if line == LineFramer.OVERFLOW else line)
+            line = framer.next_line()
+    return lines
+
+
+def check_framing():
+    framer = LineFramer()
+    overlong = b'#3:PU1:0:' + b':'.join(b'100/50' for i in range(17)) + b':MON\n'
+    assert len(overlong) > len(framer.buffer)
+    lines = drain(framer, b'TH1\n' + overlong + b'TH2\n')
+    assert lines == ['TH1', (LineFramer.OVERFLOW, 3), 'TH2'], lines
+    assert framer.overflows == 1
+
+    # Terminator in a later read than the overflow, and no request id
+    lines = drain(framer, b'X'*300 + b'\rTH3\n', chunk=64)
+    assert lines == [(LineFramer.OVERFLOW, None), 'TH3'], lines
+
+    # An id out of range isn't echoed on the overflow NAK either
+    lines = drain(framer, b'#70000:' + b'X'*300 + b'\n')
+    assert lines == [(LineFramer.OVERFLOW, None)], lines
+
+    # A burst of blank lines is skipped without recursion
+    lines = drain(framer, b'\n'*5000 + b'TH4\n', chunk=128)
+    assert lines == ['TH4'], lines
+
+    dispatcher = CommandDispatcher()
+    dispatcher.register('TH', lambda args: args)
+    assert dispatcher.execute('#12') == BAD_ARGUMENT and dispatcher.request_id is None
+    assert dispatcher.execute('#12:TH5') == OK and dispatcher.request_id == 12
+    assert dispatcher.execute('#65535:TH6') == BAD_ARGUMENT and dispatcher.request_id is None
+    assert dispatcher.execute('#-1:TH7') == BAD_ARGUMENT and dispatcher.request_id is None
+    print('framing: overlong lines dropped to their terminator with one NAK, request id kept')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,76 @@
+# bench_delta.py
+#
+# Delta/varint stream encoding: bytes per sample against the text and binary frame formats,
+# encode cost (allocation free on device) and a round trip through DeltaDecoder.
+
+import math
+
+from benchmarks.benchutil import ON_DEVICE, measure, report
+from deltaframer import DeltaFramer, DeltaDecoder
+from sampleframer import SampleFramer
+
+
+TARE = 8000.0
+SCALE = 0.001
+
+
+# Raw counts for a slow pull with noise, as the HX711 would return them
+def raw_samples(count, noise=20):
+    seed = 1
+    samples = []
+    for i in range(count):
+        seed = (seed*1103515245 + 12345) & 0x7FFFFFFF
+        jitter = (seed % (2*noise + 1)) - noise
+        samples.append(int(TARE + 10000*0.5*(1 - math.cos(2*math.pi*i/200)) + jitter))
+    return samples
+
+
+def run(count=400, chunk=DeltaFramer.DEFAULT_CHUNK):
+    samples = raw_samples(count)
+
+    # --- Round trip and size ---
+    framer = DeltaFramer()
+    framer.set_calibration(TARE, SCALE)
+    framer.enable(chunk)
+    decoder = DeltaDecoder()
+    stream_bytes = 0
+    chunks = 0
+    decoded = []
+    for raw in samples:
+        if framer.add(raw, 0.0):
+            data = framer.flush()
+            stream_bytes += len(data)
+            chunks += 1
+            decoded += decoder.feed(data)
+    data = framer.flush()
+    if data is not None:
+        stream_bytes += len(data)
+        chunks += 1
+        decoded += decoder.feed(data)
+
+    assert [s[1] for s in decoded] == samples, 'decoded raw counts differ'
+    assert all(abs(s[2] - (raw - TARE)*SCALE) < 1e-6 for s, raw in zip(decoded, samples)), 'calibration not applied'
+
+    text_bytes = sum(len(f'D:{(raw - TARE)*SCALE}\n') for raw in samples)
+    binary_bytes = count*SampleFramer.SAMPLE_SIZE + (count//8)*SampleFramer.HEADER_SIZE
+    print(f'bytes/sample: delta {stream_bytes/count:.2f} ({chunk} byte chunks, {count/chunks:.1f} samples/chunk), '
+          f'binary {binary_bytes/count:.2f}, text {text_bytes/count:.2f}')
+    print(f'samples per {chunk} byte notification: delta {count*chunk/stream_bytes:.1f}, text {count*chunk/text_bytes:.1f}')
+
+    # --- Encode cost ---
+    index = [0]
+
+    def add_one():
+        i = index[0]
+        if framer.add(samples[i], 0.0):
+            framer.flush()
+        index[0] = (i + 1) % count
+
+    us, allocated = measure(add_one, count)
+    report('delta add', us, allocated)
+    if ON_DEVICE:
+        assert allocated == 0, 'delta encoding allocated on the heap'
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,115 @@
+# bench_feedback.py
+#
+# Custom motor feedback engine: cost per sample, and a check that motor commands are only issued
+# on state transitions. Runs anywhere, the motor is a recorder rather than the PWM output.
+# firmware() sends out of range MP pulse times to the firmware on the host simulation.
+
+import math
+from array import array
+
+from benchmarks.benchutil import measure, report, quiet
+from feedback import FeedbackEngine, STATE_NAMES, STATE_RESTING, STATE_STARTING, STATE_ACTIVE_PERFECT, STATE_ACTIVE_LOWER
+
+
+RATE = 80           # Samples per second
+CUSTOM = (2.0, 8.0, 12.0, 16.0, 5.0)    # lower, goal lower, goal upper, upper, goal (as scenarios.CUSTOM_MOTOR)
+
+
+# Counts the MotorManager calls the engine makes
+class RecordingMotor:
+
+    def __init__(self):
+        self.commands = 0       # motorOn/motorOff/setPulse calls
+        self.power_calls = 0
+        self.powerLevel = 0.0
+
+    def motorOn(self):
+        self.commands += 1
+
+    def motorOff(self):
+        self.commands += 1
+
+    def setPulse(self, on, off):
+        self.commands += 1
+
+    def setPower(self, power):
+        self.power_calls += 1
+        self.powerLevel = power
+
+
+# One rep: rest, smooth pull to peak, hold, release, rest
+def rep_waveform(peak=10.0, rise=0.5, hold=1.0, fall=0.5, rest=1.0):
+    loads = array('f')
+    for i in range(int(rest*RATE)):
+        loads.append(0.0)
+    for i in range(int(rise*RATE)):
+        loads.append(peak*0.5*(1 - math.cos(math.pi*i/(rise*RATE))))
+    for i in range(int(hold*RATE)):
+        loads.append(peak)
+    for i in range(int(fall*RATE)):
+        loads.append(peak*0.5*(1 + math.cos(math.pi*i/(fall*RATE))))
+    for i in range(int(rest*RATE)):
+        loads.append(0.0)
+    return loads
+
+
+def run(reps=20):
+    # Keep the per rep log lines out of the timing
+    quiet(run_engine, reps)
+
+
+def run_engine(reps):
+    motor = RecordingMotor()
+    engine = FeedbackEngine(motor)
+    loads = rep_waveform()
+    period_ms = 1000//RATE
+
+    # --- Behaviour: one rep walks the expected states and only transitions touch the motor ---
+    engine.set_custom(*CUSTOM)
+    setup_commands = motor.commands
+    visited = []
+    now = 0
+    for val in loads:
+        engine.update(val, now)
+        if not visited or visited[-1] != engine.state:
+            visited.append(engine.state)
+        now += period_ms
+
+    print('states: ' + ' -> '.join(STATE_NAMES[s] for s in visited))
+    assert visited[0] == STATE_RESTING and visited[1] == STATE_STARTING, 'rep start not detected'
+    assert STATE_ACTIVE_PERFECT in visited and STATE_ACTIVE_LOWER in visited, 'goal bands not reached'
+    assert visited[-1] == STATE_RESTING, 'rep end not detected'
+    assert motor.commands - setup_commands <= engine.transitions, 'motor commands issued without a transition'
+    print(f'transitions: {engine.transitions}, motor commands: {motor.commands - setup_commands}, power updates: {motor.power_calls}')
+
+    # --- Cost per sample over many reps ---
+    index = [0]
+    clock = [now]
+
+    def update_one():
+        i = index[0]
+        engine.update(loads[i], clock[0])
+        index[0] = (i + 1) % len(loads)
+        clock[0] += period_ms
+
+    us, allocated = measure(update_one, reps*len(loads))
+    report('feedback update', us, allocated)
+
+
+# Host only: pulse times that would put the next motor event at infinity must NAK, and the motor
+# task must keep running for the good pulse after them
+def firmware():
+    from benchmarks.scenarios import _run_firmware, steady, SPEED, HX711_MODEL
+    run_firmware = _run_firmware()
+    commands = ((1.0, '#1:MP1E400:1'), (1.1, '#2:MP1:1E400'), (1.2, '#3:MP-1:1'), (1.3, '#4:MP0.05:0.05'))
+    result = run_firmware(2.0, setup=steady, speed=SPEED, commands=commands, hx711=HX711_MODEL)
+
+    responses = result.responses()
+    assert responses[:4] == ['R:1,N,2,', 'R:2,N,2,', 'R:3,N,2,', 'R:4,A,0,'], responses
+    edges = [t for t, pin, duty in result.outputs.pwm if t > 1.3]
+    assert len(edges) >= 10, f'{len(edges)} motor edges after the good pulse'
+    print(f'bad pulse times rejected, {len(edges)} motor edges from the good pulse')
+
+
+if __name__ == '__main__':
+    run()
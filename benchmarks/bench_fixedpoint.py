@@ -0,0 +1,93 @@
+# bench_fixedpoint.py
+#
+# Fixed point against float filtering in DataStreamManager: checks both modes agree within one
+# count over a tare and calibration, then compares cost and heap bytes per sample (device only).
+
+import math
+
+from benchmarks.benchutil import ON_DEVICE, measure, report, quiet
+from datastreammanager import DataStreamManager
+
+
+RATIO = 0.125       # A power of two, so both modes use the same EMA ratio
+
+
+def raw_samples(count, noise=40):
+    seed = 7
+    samples = []
+    for i in range(count):
+        seed = (seed*1103515245 + 12345) & 0x7FFFFFFF
+        jitter = (seed % (2*noise + 1)) - noise
+        samples.append(int(-3000 + 25000*0.5*(1 - math.cos(2*math.pi*i/300)) + jitter))
+    return samples
+
+
+def make_dsm(fixed_point):
+    dsm = DataStreamManager(lambda: None, RATIO)
+    dsm.tare_val = 0.0
+    dsm.calibration_scale = 1.0
+    dsm.update_fixed_calibration()
+    dsm.set_outlier_filter(0)
+    dsm.set_fixed_point(fixed_point)
+    return dsm
+
+
+def run(count=600):
+    # Keep the tare/calibration log lines out of the output
+    quiet(compare, count)
+
+
+def compare(count):
+    samples = raw_samples(count)
+    reference = make_dsm(False)
+    fixed = make_dsm(True)
+
+    # --- Agreement: worst difference in counts, before and after tare/calibration ---
+    worst = 0.0
+    for i in range(count):
+        reference.add_sample(samples[i])
+        fixed.add_sample(samples[i])
+        if i == count//3:
+            reference.tare()
+            fixed.tare()
+        if i == count//2:
+            reference.calibrate(12.5)
+            fixed.calibrate(12.5)
+        scale = abs(reference.calibration_scale)
+        diff = abs(reference.get_filtered_value() - fixed.get_filtered_value())/scale
+        if diff > worst:
+            worst = diff
+
+    print(f'fixed point vs float: worst difference {worst:.3f} counts over {count} samples')
+    assert worst <= 1.0, 'fixed point result more than one count from float'
+
+    # Window statistics: worked out on demand in fixed point mode, kept per sample in float mode
+    variance = reference.history.variance()
+    assert abs(fixed.history.variance() - variance) <= 1e-6*variance + 1e-6, 'window variance differs between modes'
+    print(f'window stddev {reference.get_window_stddev():.2f} in both modes')
+
+    # --- Cost per sample ---
+    for name, dsm in (('float', reference), ('fixed point', fixed)):
+        index = [0]
+
+        def filter_one():
+            i = index[0]
+            dsm.add_sample(samples[i])
+            index[0] = (i + 1) % count
+
+        def filter_and_scale():
+            i = index[0]
+            dsm.add_sample(samples[i])
+            dsm.get_filtered_value()
+            index[0] = (i + 1) % count
+
+        us, allocated = measure(filter_one, count)
+        report(f'{name} filter', us, allocated)
+        if ON_DEVICE and dsm is fixed:
+            assert allocated == 0, 'fixed point filter allocated on the heap'
+        us, allocated = measure(filter_and_scale, count)
+        report(f'{name} filter + calibrated output', us, allocated)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,62 @@
+# bench_hx711.py
+#
+# Raw HX711 read path benchmark. On device this asserts the read path doesn't allocate.
+# Each call is timed from DRDY so the numbers are clocking cost, not time spent waiting for a conversion.
+
+import time
+
+from benchmarks.benchutil import measure, report
+
+
+def make_hx711():
+    import board
+    import digitalio
+    from hx711 import HX711
+
+    power = digitalio.DigitalInOut(board.D5)
+    power.switch_to_output()
+    power.value = True
+    return HX711(digitalio.DigitalInOut(board.D9), digitalio.DigitalInOut(board.D10))
+
+
+def measure_ready(hx, fn, count):
+    total_us = 0
+    total_bytes = 0
+    for i in range(count):
+        while not hx.is_ready():
+            time.sleep(0.001)
+        us, allocated = measure(fn, 1)
+        total_us += us
+        if allocated is None:
+            total_bytes = None
+        elif total_bytes is not None:
+            total_bytes += allocated
+    if total_bytes is None:
+        return total_us/count, None
+    return total_us/count, total_bytes/count
+
+
+def run(hx=None, count=40):
+    if hx is None:
+        hx = make_hx711()
+
+    # Warm up so the first call's one-off allocations don't count
+    hx.read_long()
+    hx.read_median(5)
+
+    us, allocated = measure_ready(hx, hx.read_long, count)
+    report('HX711.read_long', us, allocated)
+    assert allocated is None or allocated == 0, 'read_long allocated on the heap'
+
+    # Median reads wait for several conversions, so only the allocation figure is interesting
+    us, allocated = measure_ready(hx, lambda: hx.read_median(3), count//4)
+    report('HX711.read_median(3)', us, allocated)
+    assert allocated is None or allocated == 0, 'read_median(3) allocated on the heap'
+
+    us, allocated = measure_ready(hx, lambda: hx.read_median(5), count//4)
+    report('HX711.read_median(5)', us, allocated)
+    assert allocated is None or allocated == 0, 'read_median(5) allocated on the heap'
+
+
+if __name__ == '__main__':
+    run()
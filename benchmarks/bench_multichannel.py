@@ -0,0 +1,96 @@
+# bench_multichannel.py
+#
+# Shared clock multi channel HX711 reads: each channel comes back with its own cell's value, a
+# sweep of N channels against N single channel reads, and the per channel and combined filtering
+# in DataStreamManager in both filter modes. On the host extra amplifier models are attached to
+# the simulation sharing PD_SCK; on the device the cells must be wired to DOUT_PINS with PD_SCK on D10.
+
+from benchmarks.benchutil import ON_DEVICE, report, quiet
+from benchmarks.bench_hx711 import measure_ready
+
+
+DOUT_PINS = ('D9', 'D11', 'D12')
+OFFSETS = (8000, -5000, 120000)     # Simulated zero load counts per cell (D9 is attached by __main__)
+
+
+def attach_models():
+    import simhw
+    for name, offset in zip(DOUT_PINS[1:], OFFSETS[1:]):
+        if not any(m.dout is simhw.pin(name) for m in simhw.hx711):
+            simhw.attach_hx711(dout=name, offset=offset, noise=20.0, seed=offset)
+
+
+def make_reader(channels):
+    import board
+    import digitalio
+    from hx711 import HX711Multi
+
+    douts = [digitalio.DigitalInOut(getattr(board, name)) for name in DOUT_PINS[:channels]]
+    return HX711Multi(douts, digitalio.DigitalInOut(board.D10))
+
+
+def run(count=40):
+    if not ON_DEVICE:
+        attach_models()
+
+    # Keep the tare log line out of the output
+    quiet(compare, count)
+
+
+def compare(count):
+    from datastreammanager import DataStreamManager
+
+    channels = len(DOUT_PINS)
+    hx = make_reader(channels)
+
+    # --- Every channel reads its own cell ---
+    values = hx.read_channels()
+    if not ON_DEVICE:
+        for i in range(channels):
+            assert abs(values[i] - OFFSETS[i]) < 200, f'channel {i} read {values[i]}, expected about {OFFSETS[i]}'
+        print('channels: ' + ', '.join(str(v) for v in values))
+
+    # --- Sweep cost against the channel count ---
+    single_us = None
+    for n in range(1, channels + 1):
+        reader = hx if n == channels else make_reader(n)
+        us, allocated = measure_ready(reader, reader.read_channels, count)
+        report(f'{n} channel sweep', us, allocated)
+        if single_us is None:
+            single_us = us
+        else:
+            print(f'  {us/(n*single_us):.2f}x the time of {n} single channel reads')
+        if ON_DEVICE:
+            assert allocated == 0, 'sweep allocated on the heap'
+
+    # --- Per channel filters and the combined output, in float and fixed point ---
+    for fixed_point in (False, True):
+        mode = 'fixed point' if fixed_point else 'float'
+        dsm = DataStreamManager(lambda: None, 0.25, channels=channels)
+        dsm.set_fixed_point(fixed_point)
+        for i in range(count):
+            while not hx.is_ready():
+                pass
+            dsm.add_channels(hx.read_channels())
+        combined = dsm.get_filtered_counts()
+        total = sum(dsm.get_channel_counts(i) for i in range(channels))
+        assert abs(combined - total) < 1e-3*abs(total) + channels, f'{mode}: combined output is not the sum of the channels'
+        dsm.tare()
+        assert all(abs(dsm.get_channel_value(i)) < 1e-6 for i in range(channels)), f'{mode}: channels not tared'
+        print(f'{mode}: combined {combined:.1f} counts = sum of channel filters {total:.1f}')
+
+    # --- Channel tares are saved with the combined one and loaded by the next manager ---
+    reloaded = DataStreamManager(lambda: None, 0.25, channels=channels)
+    assert all(abs(reloaded.channel_tare[i] - dsm.channel_tare[i]) <= 1e-6*abs(dsm.channel_tare[i]) for i in range(channels)), 'channel tares not saved'
+    print('channel tares reloaded from settings')
+
+    # --- An invalid reading on one channel keeps the sweep, with that channel carried forward ---
+    dsm = DataStreamManager(lambda: None, 0.25, channels=2)
+    assert not dsm.add_channels((-1, 100)), 'sweep accepted with nothing to carry forward'
+    assert dsm.add_channels((200, 100)) and dsm.add_channels((-1, 300)), 'sweep dropped for one invalid channel'
+    assert dsm.get_channel_counts(0) == 200 and dsm.invalid == 2, 'invalid channel not carried forward'
+    print('one invalid channel: sweep kept, last value carried forward')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,59 @@
+# bench_patterns.py
+#
+# Haptic/LED pattern uploads and playback. run() parses the longest upload the format allows and
+# times the sequencer step on the device. firmware() sends that upload to the unmodified firmware
+# on the host simulation, with a request id, and plays it, so it checks the command line buffer
+# takes a full MAX_STEPS pattern end to end.
+
+from benchmarks.benchutil import measure, report
+from sequencer import parse_pattern, Sequencer, MAX_STEPS, MAX_REPEATS, MAX_UPLOAD_LENGTH
+from responses import MAX_REQUEST_ID
+
+
+# Every field at its widest, fading over the whole of each step
+def longest_upload():
+    text = f'{MAX_REPEATS}' + ':65535/100/65535'*MAX_STEPS
+    assert len(text) == MAX_UPLOAD_LENGTH, f'{len(text)} byte upload, MAX_UPLOAD_LENGTH is {MAX_UPLOAD_LENGTH}'
+    return text
+
+
+def run(count=200):
+    text = longest_upload()
+    pattern = parse_pattern(text)
+    assert pattern.count == MAX_STEPS and pattern.repeats == MAX_REPEATS
+    print(f'longest upload: {len(text)} bytes, {pattern.count} steps')
+
+    us, allocated = measure(lambda: parse_pattern(text), 20)
+    report('parse longest upload', us, allocated)
+
+    levels = []
+    sequencer = Sequencer(levels.append)
+    sequencer.play(pattern, 0)
+    now = [0]
+
+    def step():
+        now[0] += 5
+        sequencer.update(now[0])
+
+    us, allocated = measure(step, count)
+    report('sequencer update', us, allocated)
+
+
+# Host only: upload, acknowledge and play through the firmware's command path. The first command
+# plays a pattern before any upload, which must NAK rather than find the sequencers unbuilt
+def firmware():
+    from benchmarks.scenarios import _run_firmware, steady, SPEED, HX711_MODEL
+    run_firmware = _run_firmware()
+    command = f'#{MAX_REQUEST_ID}:PU7:' + longest_upload()
+    commands = ((0.9, '#1:PL7'), (1.0, command), (1.2, '#2:PP7'))
+    result = run_firmware(1.5, setup=steady, speed=SPEED, commands=commands, hx711=HX711_MODEL)
+
+    responses = result.responses()
+    assert responses[:3] == ['R:1,N,4,', f'R:{MAX_REQUEST_ID},A,0,7', 'R:2,A,0,7'], responses
+    sequencer = result.namespace['haptics']
+    assert sequencer.playing and sequencer.pattern.count == MAX_STEPS
+    print(f'{len(command)} byte PU command accepted and playing')
+
+
+if __name__ == '__main__':
+    run()
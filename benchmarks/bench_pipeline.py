@@ -0,0 +1,91 @@
+# bench_pipeline.py
+#
+# Per stage cost of the sample pipeline:
+#   HX711.read_long -> DataStreamManager.sample -> get_filtered_value -> uart.write / SampleFramer
+#
+# Reports per stage latency percentiles, samples/sec, heap bytes per sample (device only)
+# and how often the garbage collector runs.
+
+import time
+
+from benchmarks.benchutil import now_us, measure, report, quiet, LatencyRecorder, GCWatch
+from benchmarks.bench_hx711 import make_hx711
+from datastreammanager import DataStreamManager
+from sampleframer import SampleFramer
+
+
+def run(hx=None, uart=None, count=400):
+    if hx is None:
+        hx = make_hx711()
+
+    latest = [0]
+    dsm = quiet(DataStreamManager, lambda: latest[0], 0.1)     # Without the tare/calibration log lines
+    framer = SampleFramer()
+    framer.enable(8)
+
+    def wait_ready():
+        while not hx.is_ready():
+            time.sleep(0.001)
+
+    # --- Stage latencies ---
+    stages = ('read_long', 'dsm.sample', 'get_filtered_value', 'uart.write', 'framer.add')
+    recorders = [LatencyRecorder(count) for s in stages]
+    gc_watch = GCWatch()
+
+    gc_watch.start()
+    busy = 0
+    for i in range(count):
+        wait_ready()
+        t0 = now_us()
+        latest[0] = hx.read_long()
+        t1 = now_us()
+        dsm.sample()
+        t2 = now_us()
+        val = dsm.get_filtered_value()
+        t3 = now_us()
+        if uart is not None:
+            uart.write(f'D:{val}\n')
+        t4 = now_us()
+        if framer.add(dsm.last_raw, val) and uart is not None:
+            uart.write(framer.flush())
+        t5 = now_us()
+        gc_watch.poll()
+
+        recorders[0].add(t1 - t0)
+        recorders[1].add(t2 - t1)
+        recorders[2].add(t3 - t2)
+        recorders[3].add(t4 - t3)
+        recorders[4].add(t5 - t4)
+        busy += t5 - t0
+    collections = gc_watch.stop()
+
+    for name, recorder in zip(stages, recorders):
+        recorder.report(name)
+    print(f'pipeline: {count*1000000/max(busy, 1):.0f} samples/sec of CPU time, '
+          f'{collections} GC runs in {count} samples ({collections*1000/count:.1f} per 1000)')
+
+    # --- Heap allocations per sample (reported on device) ---
+    def text_pipeline():
+        latest[0] = hx.read_long()
+        dsm.sample()
+        val = dsm.get_filtered_value()
+        if uart is not None:
+            uart.write(f'D:{val}\n')
+
+    def binary_pipeline():
+        latest[0] = hx.read_long()
+        dsm.sample()
+        if framer.add(dsm.last_raw, dsm.get_filtered_value()) and uart is not None:
+            uart.write(framer.flush())
+
+    # Reads are only measured when a conversion is ready, so wait before each batch
+    wait_ready()
+    us, allocated = measure(text_pipeline, 1)
+    report('text pipeline (1 sample)', us, allocated)
+    wait_ready()
+    us, allocated = measure(binary_pipeline, 1)
+    report('binary pipeline (1 sample)', us, allocated)
+
+
+if __name__ == '__main__':
+    run()
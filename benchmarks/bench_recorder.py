@@ -0,0 +1,84 @@
+# bench_recorder.py
+#
+# Offline recorder: round trip of samples through the chunked log, flash bytes per sample and
+# the cost of staging a sample against writing out a staged block. On the device the drive has
+# to be writable from code (see boot.py).
+
+import os
+
+from benchmarks.benchutil import ON_DEVICE, measure, report, now_us, quiet
+import recorder
+
+
+def run(count=2000, path=None):
+    if path is None:
+        if ON_DEVICE:
+            path = '/bench.bin'
+        else:
+            import tempfile
+            path = os.path.join(tempfile.gettempdir(), 'bench_recorder.bin')
+
+    # Keep write failure log lines out of the timing
+    try:
+        quiet(round_trip, count, path)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def round_trip(count, path):
+    log_file = recorder.Recorder(path)
+    log_file.erase()
+    log_file.arm(True)
+
+    # --- Round trip: everything staged comes back in order from a download ---
+    for i in range(count):
+        log_file.add(i, i*0.5, i*12)
+    log_file.flush()
+    assert not log_file.error, 'log write failed'
+
+    log_file.start_download(0)
+    raws = []
+    chunk = log_file.read_next()
+    while chunk is not None:
+        count_in_chunk = chunk[2] | (chunk[3] << 8)
+        for k in range(count_in_chunk):
+            offset = recorder.HEADER_SIZE + k*recorder.SAMPLE_SIZE
+            raws.append(int.from_bytes(bytes(chunk[offset + 2:offset + 6]), 'little'))
+        chunk = log_file.read_next()
+    assert raws == list(range(count)), 'samples lost or reordered in the log'
+    assert log_file.download_next == log_file.chunks, 'download stopped early'
+
+    # Resuming from a chunk gives that chunk first
+    log_file.start_download(2)
+    chunk = log_file.read_next()
+    assert chunk[4] == 2, 'resumed download started at the wrong chunk'
+    log_file.stop_download()
+
+    print(f'{recorder.SAMPLES_PER_CHUNK} samples per {recorder.CHUNK_SIZE} byte chunk, '
+          f'{recorder.CHUNK_SIZE/recorder.SAMPLES_PER_CHUNK:.2f} flash bytes/sample, '
+          f'{log_file.chunks} chunks for {count} samples')
+
+    # --- Cost: staging a sample, and writing a full staged block ---
+    per_block = recorder.SAMPLES_PER_CHUNK*recorder.STAGE_CHUNKS
+    index = [0]
+
+    def stage_one():
+        i = index[0]
+        log_file.add(i, 1.0, i*12)
+        index[0] = i + 1
+
+    # One short of a full block, so nothing is written while timing
+    log_file.erase()
+    us, allocated = measure(stage_one, per_block - 1)
+    report('stage sample', us, allocated)
+
+    start = now_us()
+    log_file.flush()
+    print(f'block write: {now_us() - start} us for {recorder.STAGE_CHUNKS} chunks')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,61 @@
+# bench_reps.py
+#
+# Rep analyser: checks the summary figures against the known rep waveform, then the cost per
+# sample. Runs anywhere, samples are fed straight in rather than through the sensor task.
+
+from array import array
+
+from benchmarks.benchutil import measure, report
+from benchmarks.bench_feedback import RATE, rep_waveform
+from repanalyzer import RepAnalyzer
+
+
+PEAK = 14.0
+BANDS = (8.0, 12.0)     # Goal band as scenarios.CUSTOM_MOTOR
+
+
+def run(reps=20):
+    analyzer = RepAnalyzer(array('f', BANDS))
+    loads = rep_waveform(peak=PEAK)
+    period_ms = 1000//RATE
+
+    # --- Behaviour: one summary per rep, figures match the waveform ---
+    now = 0
+    summaries = 0
+    for i in range(3):
+        for val in loads:
+            if analyzer.update(val, now):
+                summaries += 1
+            now += period_ms
+
+    above_rest = [val for val in loads if val >= analyzer.rest_level]
+    tut_ms = len(above_rest)*period_ms
+    print(f'summary: {analyzer.format_text().strip()}')
+    assert summaries == 3 and analyzer.reps == 3, 'reps not detected once each'
+    assert analyzer.peak == PEAK, 'peak load wrong'
+    assert abs(analyzer.tut_ms - tut_ms) <= period_ms, 'time under tension wrong'
+    assert abs(analyzer.impulse_s() - sum(above_rest)*period_ms/1000) < 0.05*PEAK, 'impulse wrong'
+    assert sum(analyzer.band_ms) == analyzer.tut_ms, 'band times do not add up to the rep'
+    assert analyzer.rise > 0 and analyzer.fall > 0, 'rise/fall rates missing'
+
+    # A pull that never reaches the start level isn't a rep
+    analyzer.update(analyzer.start_level - 1, now)
+    analyzer.update(0.0, now + period_ms)
+    assert analyzer.reps == 3, 'short pull counted as a rep'
+
+    # --- Cost per sample over many reps ---
+    index = [0]
+    clock = [now]
+
+    def update_one():
+        i = index[0]
+        analyzer.update(loads[i], clock[0])
+        index[0] = (i + 1) % len(loads)
+        clock[0] += period_ms
+
+    us, allocated = measure(update_one, reps*len(loads))
+    report('rep analyser update', us, allocated)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,73 @@
+# bench_txscheduler.py
+#
+# TX scheduler: writes per connection interval against one write per message, drop-oldest on a
+# link too slow for the stream, control messages never lost, and the cost of queueing a sample.
+
+from benchmarks.benchutil import ON_DEVICE, measure, report
+from txscheduler import TxScheduler
+
+
+# Stands in for the UART, keeps what was written
+class RecordingUart:
+
+    def __init__(self):
+        self.data = bytearray()
+        self.writes = 0
+
+    def write(self, buf):
+        self.data += buf
+        self.writes += 1
+
+
+def run(count=400):
+    # --- Coalescing: 80 samples/s of text over a 30ms interval ---
+    uart = RecordingUart()
+    tx = TxScheduler(uart)
+    sample = b'D:12.3456\n'
+    for i in range(count):
+        tx.write_stream(sample)
+        if i % 3 == 2:       # ~3 samples per interval
+            tx.flush()
+    while tx.pending():
+        tx.flush()
+    assert bytes(uart.data) == sample*count, 'stream reordered or lost on a fast enough link'
+    print(f'{count} samples in {uart.writes} writes ({count/uart.writes:.1f} samples/write)')
+
+    # --- Slow link: stream drops whole old samples, control gets through intact ---
+    uart = RecordingUart()
+    tx = TxScheduler(uart)
+    for i in range(count):
+        tx.write_stream(b'D:%d\n' % i)
+        if i % 50 == 0:
+            tx.write(b'R:%d,A,0,\n' % i)
+        if i % 40 == 39:    # Link takes far less than is produced
+            tx.flush()
+    while tx.pending():
+        tx.flush()
+    lines = bytes(uart.data).split(b'\n')[:-1]
+    samples = [int(line[2:]) for line in lines if line.startswith(b'D:')]
+    acks = [line for line in lines if line.startswith(b'R:')]
+    assert len(acks) == (count + 49)//50, 'control message lost'
+    assert samples == sorted(samples) and samples[-1] == count - 1, 'stream out of order or newest lost'
+    assert tx.dropped == count - len(samples) and tx.dropped, 'drops not counted'
+    assert tx.stalls == 0, 'stream stalled instead of dropping'
+    print(f'slow link: {len(samples)}/{count} samples delivered, {tx.dropped} dropped, {tx.stalls} stalls')
+
+    # --- Cost of queueing a sample ---
+    tx = TxScheduler(RecordingUart())
+    index = [0]
+
+    def queue_one():
+        tx.write_stream(sample)
+        index[0] += 1
+        if index[0] % 8 == 0:
+            tx.flush()
+
+    us, allocated = measure(queue_one, count)
+    report('queue sample', us, allocated)
+    if ON_DEVICE:
+        assert allocated < 64, 'queueing allocated more than the flush memoryview'
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,121 @@
+# benchutil.py
+#
+# Timing and heap allocation helpers shared by the benchmarks
+
+import gc
+import time
+from array import array
+
+from logger import log, WARNING
+
+
+# True when running on CircuitPython/MicroPython, where gc.mem_alloc() counts heap bytes
+ON_DEVICE = hasattr(gc, 'mem_alloc')
+
+# Wall clock even when the host simulation has taken over time.monotonic_ns
+_clock_ns = getattr(time, 'perf_counter_ns', None) or time.monotonic_ns
+
+
+def now_us():
+    return _clock_ns() // 1000
+
+
+# Heap bytes allocated so far, or None where the runtime can't tell us
+def heap_allocated():
+    if ON_DEVICE:
+        return gc.mem_alloc()
+    return None
+
+
+# Run fn() count times with the collector paused. Returns (microseconds per call, heap bytes per call).
+# Heap bytes is None off device.
+def measure(fn, count):
+    gc.collect()
+    gc.disable()
+    try:
+        start_alloc = heap_allocated()
+        start = now_us()
+        for i in range(count):
+            fn()
+        elapsed = now_us() - start
+        end_alloc = heap_allocated()
+    finally:
+        gc.enable()
+
+    if start_alloc is None:
+        return elapsed/count, None
+    return elapsed/count, (end_alloc - start_alloc)/count
+
+
+# Run fn(*args) with info and debug logging off, so log lines stay out of the output and the timing
+def quiet(fn, *args):
+    level = log.level
+    log.set_level(WARNING)
+    try:
+        return fn(*args)
+    finally:
+        log.set_level(level)
+
+
+def report(name, us_per_call, bytes_per_call):
+    if bytes_per_call is None:
+        print(f'{name}: {us_per_call:.1f} us/call')
+    else:
+        print(f'{name}: {us_per_call:.1f} us/call, {bytes_per_call:.1f} bytes/call')
+
+
+# Per call latencies in a preallocated array, summarised as percentiles
+class LatencyRecorder:
+
+    def __init__(self, size):
+        self.samples = array('L', [0]*size)
+        self.count = 0
+
+    def add(self, us):
+        if self.count < len(self.samples):
+            self.samples[self.count] = us
+            self.count += 1
+
+    def percentile(self, ordered, p):
+        if not ordered:
+            return 0
+        return ordered[min(len(ordered) - 1, (len(ordered)*p)//100)]
+
+    def report(self, name):
+        ordered = sorted(self.samples[:self.count])
+        print(f'{name}: p50={self.percentile(ordered, 50)}us p90={self.percentile(ordered, 90)}us '
+              f'p99={self.percentile(ordered, 99)}us max={ordered[-1] if ordered else 0}us n={self.count}')
+
+
+# Counts garbage collections. CPython reports them through gc.callbacks, on the device a drop
+# in gc.mem_alloc() between polls means the collector ran.
+class GCWatch:
+
+    def __init__(self):
+        self.collections = 0
+        self.last_alloc = heap_allocated()
+        self.callback = None
+
+    def start(self):
+        self.collections = 0
+        if ON_DEVICE:
+            self.last_alloc = gc.mem_alloc()
+        else:
+            def callback(phase, info):
+                if phase == 'start':
+                    self.collections += 1
+            self.callback = callback
+            gc.callbacks.append(callback)
+
+    def poll(self):
+        if ON_DEVICE:
+            alloc = gc.mem_alloc()
+            if alloc < self.last_alloc:
+                self.collections += 1
+            self.last_alloc = alloc
+
+    def stop(self):
+        if self.callback is not None:
+            gc.callbacks.remove(self.callback)
+            self.callback = None
+        return self.collections
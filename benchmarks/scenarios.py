@@ -0,0 +1,85 @@
+# scenarios.py
+#
+# End to end scenarios: the unmodified firmware running against the host simulation.
+# The same waveforms, seeds and command scripts are used every run so results compare between builds.
+#
+# The simulated clock runs SPEED times faster than the host CPU while the firmware is busy, which
+# stands in for the device being that much slower than CPython.
+
+import sys
+
+SPEED = 20.0
+DURATION = 10.0
+
+# Model the load cell in calibrated units directly (scale 1, no offset) so motor thresholds are simple
+HX711_MODEL = {'offset': 0, 'counts_per_unit': 1.0, 'noise': 0.2}
+
+CUSTOM_MOTOR = 'C2.08.012.16.5.0'     # lower 2, goal band 8-12, upper 16, goal 5
+
+
+def _run_firmware():
+    from benchmarks.benchutil import ON_DEVICE
+    if ON_DEVICE:
+        raise RuntimeError('Scenarios run on the host simulation only')
+    import os
+    sim_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sim')
+    if sim_dir not in sys.path:
+        sys.path.insert(0, sim_dir)
+    from run import run_firmware
+    return run_firmware
+
+
+def steady(simhw):
+    simhw.hx711[0].set_load(simhw.constant(10.0))
+
+
+def reps(simhw):
+    simhw.hx711[0].set_load(simhw.reps(14.0, start=2.0))
+
+
+SCENARIOS = (
+    # name, setup, commands
+    ('steady text', steady, ()),
+    ('steady binary', steady, ((1.5, 'BIN8'),)),
+    ('steady delta', steady, ((1.5, 'DLT'),)),
+    ('reps', reps, ()),
+    ('reps + custom motor', reps, ((1.5, CUSTOM_MOTOR),)),
+    ('reps + deadband/heartbeat', reps, ((1.5, 'RP0.5:1000:0'), (1.6, 'TH0.3'))),
+    ('reps summaries only', reps, ((1.5, CUSTOM_MOTOR), (1.6, 'SUM1'))),
+    ('command burst', steady, tuple((2.0 + i*0.001, f'#{i}:TH{i % 5}') for i in range(100))),
+)
+
+
+def run_scenario(name, setup, commands):
+    run_firmware = _run_firmware()
+    result = run_firmware(DURATION, setup=setup, speed=SPEED, commands=commands, hx711=HX711_MODEL)
+
+    ns = result.namespace or {}
+    hx = ns.get('hx')
+    scheduler = ns.get('scheduler')
+    sensor = None
+    if scheduler is not None:
+        sensor = [t for t in scheduler.tasks if t.name == 'sensor'][0]
+
+    samples = len(result.samples())
+    reads = sum(m.reads for m in result.hx711)
+    print(f'--- {name} ---')
+    print(f'  HX711 reads/s: {reads/DURATION:.1f}, samples sent/s: {samples/DURATION:.1f}, '
+          f'UART bytes/s: {len(result.received)/DURATION:.0f}, writes/s: {result.central.writes/DURATION:.0f}')
+    if hx is not None:
+        print(f'  missed conversions: {hx.missed_conversions}, late conversions: {hx.late_conversions}')
+    if sensor is not None:
+        print(f'  sensor task worst lateness: {sensor.max_lateness}ms')
+        runs = {t.name: t.runs for t in scheduler.tasks}
+        print(f'  motor task runs/s: {runs["motor"]/DURATION:.1f}, pixel task runs/s: {runs["pixel"]/DURATION:.1f}')
+    print(f'  responses: {len(result.responses())}, rep summaries: {len(result.summaries())}, wall time: {result.wall:.2f}s')
+    return result
+
+
+def run():
+    for name, setup, commands in SCENARIOS:
+        run_scenario(name, setup, commands)
+
+
+if __name__ == '__main__':
+    run()
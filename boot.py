@@ -0,0 +1,17 @@
+# boot.py
+#
+# Filesystem access for the offline recorder
+#
+# CIRCUITPY is normally writable from the computer over USB and read only to code. With a file
+# named record_enable in the root of the drive it's remounted writable for code instead, so the
+# recorder can keep its log (the computer then sees the drive read only). To get USB write access
+# back, delete the flag from the REPL: import os; os.remove('/record_enable'), then reset.
+
+import os
+import storage
+
+try:
+    os.stat('/record_enable')
+    storage.remount('/', readonly=False)
+except OSError:
+    pass    # No flag, leave the drive to USB
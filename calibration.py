@@ -0,0 +1,124 @@
+# calibration.py
+#
+# Multi point calibration table
+#
+# Maps tared counts (filter output minus tare) to load through straight segments between up to
+# MAX_POINTS calibration points. The tare point (0 counts, 0 load) is always in the table, so one
+# extra point gives the same result as the single scale factor and each further point corrects
+# the non-linearity of the cell. Loads outside the points extend the end segments.
+#
+# Slopes and intercepts are worked out when points change, so evaluating a sample is a binary
+# search over at most MAX_POINTS - 2 breakpoints and one multiply-add. They're kept in lists of
+# floats rather than float arrays, since reading a float array element allocates on the device.
+#
+# Stored in nvm as (counts, load) pairs of f32.
+
+import struct
+from array import array
+
+
+Q_BITS = 4          # Fractional bits of fixed point counts (matches DataStreamManager)
+POINT_FORMAT = '<ff'
+POINT_SIZE = struct.calcsize(POINT_FORMAT)
+
+
+class CalibrationTable:
+
+    MAX_POINTS = 8
+    MIN_SPACING = 1.0       # Points closer than this many counts replace each other
+
+    def __init__(self):
+        self.counts = []
+        self.loads = []
+
+        # Precomputed segments
+        self.breaks = []                # Interior breakpoints in counts
+        self.breaks_q = array('l')      # Same in Q4 counts
+        self.slopes = []                # Load per count, one per segment
+        self.slopes_q = []              # Load per Q4 count
+        self.intercepts = []
+
+        self.clear()
+
+    @property
+    def active(self):
+        return len(self.counts) >= 2
+
+    # Back to the tare point only
+    def clear(self):
+        self.counts = [0.0]
+        self.loads = [0.0]
+        self.rebuild()
+
+    # Add (or replace) a point. Returns the number of points, including the tare point
+    def add_point(self, counts, load):
+        if abs(counts) < self.MIN_SPACING:
+            raise ValueError('Calibration point at the tare point')
+        for i in range(len(self.counts)):
+            if abs(self.counts[i] - counts) < self.MIN_SPACING:
+                self.loads[i] = load
+                self.rebuild()
+                return len(self.counts)
+
+        if len(self.counts) >= self.MAX_POINTS:
+            raise ValueError('Calibration table full')
+
+        i = 0
+        while i < len(self.counts) and self.counts[i] < counts:
+            i += 1
+        self.counts.insert(i, counts)
+        self.loads.insert(i, load)
+        self.rebuild()
+        return len(self.counts)
+
+    def rebuild(self):
+        n = len(self.counts)
+        self.breaks = [self.counts[i] for i in range(1, n - 1)]
+        self.breaks_q = array('l', [round(c*(1 << Q_BITS)) for c in self.breaks])
+        self.slopes = []
+        self.slopes_q = []
+        self.intercepts = []
+        for i in range(n - 1):
+            slope = (self.loads[i + 1] - self.loads[i])/(self.counts[i + 1] - self.counts[i])
+            self.slopes.append(slope)
+            self.slopes_q.append(slope/(1 << Q_BITS))
+            self.intercepts.append(self.loads[i] - slope*self.counts[i])
+
+    # Segment holding x: the number of breakpoints at or below it
+    def segment(self, breaks, x):
+        lo = 0
+        hi = len(breaks)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if x >= breaks[mid]:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Load for tared counts. Only valid while the table is active
+    def evaluate(self, counts):
+        i = self.segment(self.breaks, counts)
+        return counts*self.slopes[i] + self.intercepts[i]
+
+    # Load per count of the segment holding tared counts, for spreads around that point
+    def slope(self, counts):
+        return self.slopes[self.segment(self.breaks, counts)]
+
+    # Same for tared counts in Q4, without converting them to float first
+    def evaluate_q(self, counts_q):
+        i = self.segment(self.breaks_q, counts_q)
+        return counts_q*self.slopes_q[i] + self.intercepts[i]
+
+    def to_bytes(self):
+        data = bytearray(len(self.counts)*POINT_SIZE)
+        for i in range(len(self.counts)):
+            struct.pack_into(POINT_FORMAT, data, i*POINT_SIZE, self.counts[i], self.loads[i])
+        return bytes(data)
+
+    def from_bytes(self, data):
+        self.clear()
+        for i in range(min(len(data)//POINT_SIZE, self.MAX_POINTS)):
+            counts, load = struct.unpack_from(POINT_FORMAT, data, i*POINT_SIZE)
+            if abs(counts) >= self.MIN_SPACING:     # The tare point is stored too, it's already there
+                self.add_point(counts, load)
@@ -1,307 +1,552 @@
+# Start up is timed from here (BOOT command)
+from perfstats import BootTimer
+boot = BootTimer()
+
 import board
 import digitalio
-import time
 
 from adafruit_ble import BLERadio
 from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
 from adafruit_ble.services.nordic import UARTService
 
-from adafruit_bluefruit_connect.packet import Packet
+# Advertise before anything else is imported or set up, so a central can find us while the rest
+# starts. connection_task takes over advertising once the main loop runs
+ble = BLERadio()
+uart = UARTService()
+advertisement = ProvideServicesAdvertisement(uart)
+ble.start_advertising(advertisement)
+boot.mark('advertising')
+
+# Turn on power to HX711 board (connected to a GPIO pin). Done early so it settles while the rest starts up
+power = digitalio.DigitalInOut(board.D5)
+power.switch_to_output()
+power.value = True
 
-from hx711 import HX711
+from hx711 import HX711, HX711Multi
 from pixelflasher import PixelFlasher
 from datastreammanager import DataStreamManager
 from settings import Settings
 from motormanager import MotorManager
+from feedback import FeedbackEngine
+from reportpolicy import ReportPolicy
+from repanalyzer import RepAnalyzer
+from txscheduler import TxScheduler
+from sampleframer import SampleFramer
+from scheduler import Scheduler
+from commandparser import LineFramer, CommandDispatcher
+from responses import ResponseWriter, CommandError
+from perfstats import PerfStats, PHASE_WAIT, PHASE_READ, PHASE_FILTER, PHASE_TX, PHASE_COMMAND, PHASE_MOTOR, PHASE_PIXEL, PHASE_REPS
+from logger import log
+from ticks import ticks_ms
+import responses
+import time
 
+boot.mark('imports')
 
-ble = BLERadio()
-uart = UARTService()
-advertisement = ProvideServicesAdvertisement(uart)
 settings = Settings()
 
-class MotorState():
-    ACTIVE_PERFECT = 'perfect'
-    ACTIVE_UPPER = 'active_upper'
-    ACTIVE_LOWER = 'active_lower'
-    RESTING = 'resting'
-    STARTING = 'starting'
-    FAILED = 'failed'
-    UNKNOWN = 'unknown'
+# Offline log, relative to the working directory (the root of CIRCUITPY). Needs boot.py to make the drive writable
+RECORD_PATH = 'offline.bin'
 
 # Default Connection Interval
-DEFAULT_CI = 28             # 28ms - Actually rounds up to 30 when set, but setting 30 results in 45, which is weird
-MESSAGE_WEIGHT_TH = 0.0     # Weights below this amount not reported via BLE
+DEFAULT_CI = Settings.DEFAULT_CI    # 28ms - Actually rounds up to 30 when set, but setting 30 results in 45, which is weird
 
-# Turn on power to HX711 board (connected to a GPIO pin)
-power = digitalio.DigitalInOut(board.D5)
-power.switch_to_output()
-power.value = True
+# Motor and pixel tasks sleep until their output next changes, checking a steady output this often
+OUTPUT_IDLE_MS = 1000
+
+# Longest command line: '#65534:PU7:' (request id at responses.MAX_REQUEST_ID) and a full length
+# pattern upload (sequencer.MAX_UPLOAD_LENGTH, 261 bytes) with its terminator
+RX_LINE_SIZE = 288
+
+# Load cell amplifier DOUT pins. For more cells (up to 4) add their pins here, all share PD_SCK on D10
+LOAD_CELL_PINS = (board.D9,)
 
-hx = HX711(digitalio.DigitalInOut(board.D9), digitalio.DigitalInOut(board.D10))
+if len(LOAD_CELL_PINS) > 1:
+    hx = HX711Multi([digitalio.DigitalInOut(p) for p in LOAD_CELL_PINS], digitalio.DigitalInOut(board.D10))
+else:
+    hx = HX711(digitalio.DigitalInOut(LOAD_CELL_PINS[0]), digitalio.DigitalInOut(board.D10))
 
 # Subsystems
 flasher = PixelFlasher()
 motor = MotorManager()
-
-# Motor Pulse feedback states
-motorRangeEnabled = False
-motorPulseEnabled = False
-
-motorRange = 0.0
-
-# Motor varibales. Can probably be moved to MotorManager
-motorCustomEnabled = False
-motorRepStarted = False
-motorRepStartIndicationFinished = False
-
-motorStartTime = 0.0
-
-motorBoundLower = 0.0
-motorBoundGoalUpper = 0.0
-motorBoundGoalLower = 0.0
-motorBoundUpper = 0.0
-motorGoal = 0.0
+sampleFramer = SampleFramer()   # Binary sample frames (opt in with BIN command)
+deltaFramer = None          # Delta compressed raw samples, made by the first DLT command
+framer = sampleFramer       # Active binary stream, text samples while it is disabled
+rx = LineFramer(RX_LINE_SIZE)   # Command line framing for the UART
+tx = TxScheduler(uart)      # All output, sent once per connection interval (TXQ command)
+responder = ResponseWriter(tx)
+stats = PerfStats()         # Hot path timing, off until STATS1 and reported by the STATS command
+policy = ReportPolicy()     # Which samples get sent (RP and TH commands)
+patterns = None             # Uploaded haptic/LED patterns and their players, made by the first pattern command
+haptics = None
+lights = None
+feedback = FeedbackEngine(motor)    # Load driven motor feedback modes (MR, MRP, C, Z)
+analyzer = RepAnalyzer(feedback.band_limits)    # Per rep summaries, goal band follows the custom motor bounds
+summariesOnly = False       # Send rep summaries instead of samples (SUM command)
+recorder = None             # Offline sample log, made when recording is armed or by the first REC command
 
 MRP_PULSE = 0.5     # On time for pulses in pulse feedback modes
 MRP_BREAK = 1.0     # Off time for pulses in pulse feedback modes (modulated by load cell pressure)
 
-def clearMotorModes():
-    global motorRangeEnabled
-    global motorPulseEnabled
-
-    motorRangeEnabled = False
-    motorPulseEnabled = False
-
-    global motorCustomEnabled
-    global motorFastPulse
-
-    motorCustomEnabled = False
-    motorFastPulse = False
-
-    motor.motorOff()
-
-
-# Sample function for data manager
+# Sample function for data manager - never blocks, returns None until a conversion is ready
 def getHX711Sample():
-    return hx.get_value(1)
-
-dsm = DataStreamManager(getHX711Sample,1)
-
-# Command processor - This is pretty basic/brute force, but there are only a handful of commands
+    return hx.try_read()
+
+dsm = DataStreamManager(getHX711Sample,1,channels=hx.channels)
+
+# --- DEFERRED SUBSYSTEMS --- Most sessions never use these, so their imports and buffers wait
+# for the first command that needs them
+
+def get_delta_framer():
+    global deltaFramer
+
+    if deltaFramer is None:
+        from deltaframer import DeltaFramer
+        deltaFramer = DeltaFramer(interval_ms=txTask.period_ms)
+    return deltaFramer
+
+def get_patterns():
+    global patterns
+    global haptics
+    global lights
+
+    if patterns is None:
+        from sequencer import PatternLibrary, Sequencer
+        patterns = PatternLibrary()
+        haptics = Sequencer(motor.setLevel)
+        lights = Sequencer(flasher.setLevel)
+        feedback.sequencer = haptics
+    return patterns
+
+def get_recorder():
+    global recorder
+
+    if recorder is None:
+        from recorder import Recorder
+        recorder = Recorder(RECORD_PATH)
+        recorder.armed = settings.get_recording()
+    return recorder
+
+# Recording armed before the last power off carries on
+if settings.get_recording():
+    get_recorder()
+
+boot.mark('subsystems')
+firstSample = True          # Until the first sample is taken, for the boot breakdown
+
+# --- COMMAND HANDLERS --- Each gets the text after the command word (already upper case) and returns
+# the value to echo in the response. Bad arguments raise ValueError, other failures raise CommandError.
+
+# --- TARE COMMAND ---
+def cmd_tare(args):
+    if not dsm.has_samples():
+        raise CommandError(responses.NOT_READY, 'No samples yet')
+    dsm.tare()
+    if deltaFramer is not None:
+        deltaFramer.set_calibration(dsm.tare_val, dsm.calibration_scale)
+    return dsm.tare_val
+
+# --- CALIBRATION COMMAND ----
+def cmd_calibrate(args):
+    cal = float(args)
+    if not dsm.has_samples():
+        raise CommandError(responses.NOT_READY, 'No samples yet')
+    if dsm.calibration_table.active:
+        raise CommandError(responses.FAILED, 'Calibration table in use, CPCLR first')
+    dsm.calibrate(cal)
+    if deltaFramer is not None:
+        deltaFramer.set_calibration(dsm.tare_val, dsm.calibration_scale)
+    return dsm.calibration_scale
+
+# --- CALIBRATION POINT COMMANDS --- CP<load> adds the current load to the calibration table, CPCLR clears it
+def cmd_calibration_point(args):
+    load = float(args)
+    if not dsm.has_samples():
+        raise CommandError(responses.NOT_READY, 'No samples yet')
+    return dsm.add_calibration_point(load)
+
+def cmd_calibration_clear(args):
+    dsm.clear_calibration_points()
+    return 0
+
+# --- GET CONNECTION INTERVAL COMMAND ---
+def cmd_get_ci(args):
+    connection = ble.connections[0]
+    tx.write(f'CI:{connection.connection_interval}\n')
+    return connection.connection_interval
+
+# --- SET CONNECTION INTERVAL COMMAND ---
+def cmd_set_ci(args):
+    ci = int(args)
+    if not ((ci > 10) and (ci < 255)):   # Sanity check value
+        raise CommandError(responses.OUT_OF_RANGE, 'Invalid CI request')
+
+    # Request Change to CI
+    settings.set_connectionInterval(ci)
+    log.info('Requesting CI: %d', ci)
+    connection = ble.connections[0]
+    connection.connection_interval = settings.get_connectionInterval()
+
+    # Echo new CI back to controller
+    log.info('Actual CI: %s', connection.connection_interval)
+    set_tx_interval(connection.connection_interval)
+    tx.write(f'CI:{connection.connection_interval}\n')
+    return connection.connection_interval
+
+# --- MOTOR POWER COMMAND ---
+def cmd_motor_power(args):
+    motor.setPower(float(args))
+    return motor.powerLevel
+
+# --- MOTOR ON COMMAND ---
+def cmd_motor_on(args):
+    feedback.clear()
+    motor.motorOn()
+    log.info('Motor turned on')
+
+# --- MOTOR OFF COMMAND ---
+def cmd_motor_off(args):
+    feedback.clear()
+
+# --- MOTOR PULSE COMMAND --- Format MP<on>:<off>
+def cmd_motor_pulse(args):
+    feedback.clear()
+    split = args.split(":")
+    if (len(split) != 2):
+        raise CommandError(responses.BAD_ARGUMENT, 'Invalid Motor Pulse Request')
+    on = float(split[0])
+    off = float(split[1])
+    motor.setPulse(on,off)      # ValueError for times out of range, the motor is left off
+
+# --- MOTOR RANGE PULSE COMMAND ---
+def cmd_motor_range_pulse(args):
+    feedback.set_range(float(args), MRP_PULSE, MRP_BREAK)
+    return feedback.range
+
+# --- MOTOR RANGE COMMAND ---
+def cmd_motor_range(args):
+    feedback.set_range(float(args))
+    return feedback.range
+
+# --- PATTERN UPLOAD COMMAND --- Format PU<id>:<repeats>:<ms>/<level>[/<fade ms>]:... (see sequencer.py)
+def cmd_pattern_upload(args):
+    pattern_id, _, steps = args.partition(':')
+    library = get_patterns()
+    from sequencer import parse_pattern
+    library.store(int(pattern_id), parse_pattern(steps))
+    return int(pattern_id)
+
+def get_pattern(args):
+    pattern = get_patterns().get(int(args))
+    if pattern is None:
+        raise CommandError(responses.NOT_READY, 'Pattern not uploaded')
+    return pattern
+
+# --- PATTERN PLAY COMMANDS --- PP<id> plays on the motor, PL<id> on the NeoPixel, PS stops both
+def cmd_pattern_play(args):
+    pattern = get_pattern(args)
+    feedback.clear()
+    motor.motorOn()
+    haptics.play(pattern, ticks_ms())
+    motorTask.wake()
+    return int(args)
+
+def cmd_pattern_light(args):
+    pattern = get_pattern(args)     # Builds the sequencers on first use, so before lights is read
+    lights.play(pattern, ticks_ms())
+    pixelTask.wake()
+    return int(args)
+
+def cmd_pattern_stop(args):
+    if patterns is not None:
+        haptics.stop()
+        lights.stop()
+
+# --- BINARY STREAMING COMMAND --- Format BIN<samples per frame>, BIN0 returns to text samples
+def cmd_binary(args):
+    global framer
+
+    count = int(args) if args else 8
+    if deltaFramer is not None:
+        deltaFramer.disable()
+    framer = sampleFramer
+    if (count > 0):
+        framer.enable(count)
+        return framer.samples_per_frame
+    framer.disable()
+    return 0
+
+# --- DELTA STREAMING COMMAND --- Format DLT<chunk bytes> (default one 20 byte notification), DLT0 returns to text samples
+def cmd_delta(args):
+    global framer
+
+    size = int(args) if args else None
+    sampleFramer.disable()
+    if (size is None or size > 0):
+        delta = get_delta_framer()
+        delta.set_calibration(dsm.tare_val, dsm.calibration_scale)
+        delta.enable(delta.DEFAULT_CHUNK if size is None else size)
+        framer = delta
+        return framer.chunk_size
+    if deltaFramer is not None:
+        deltaFramer.disable()
+    framer = sampleFramer
+    return 0
+
+# --- FIXED POINT FILTER COMMAND --- FXP1 runs the EMA and tare in integers, FXP0 back to floats
+def cmd_fixed_point(args):
+    dsm.set_fixed_point(int(args) != 0)
+    return int(dsm.fixed_point)
+
+# --- CHANNELS COMMAND --- Reports each load cell as CH:<load>,<load>,... (tared, shared scale)
+def cmd_channels(args):
+    tx.write('CH:' + ','.join(str(dsm.get_channel_value(i)) for i in range(dsm.channels)) + '\n')
+    return dsm.channels
+
+# --- OUTLIER FILTER COMMAND --- Format HF<window>[:<threshold>], window below 3 disables, at most HampelFilter.MAX_WINDOW
+def cmd_outlier_filter(args):
+    split = args.split(":")
+    if (len(split) == 2):
+        dsm.set_outlier_filter(int(split[0]), float(split[1]))
+    else:
+        dsm.set_outlier_filter(int(split[0]))
+    return dsm.outlier_filter.window
+
+# --- TASK STATISTICS COMMAND --- Reports run counts, worst case lateness and period per task and the
+# idle time as T:/TI: lines (see Scheduler.report), then resets them
+def cmd_tasks(args):
+    scheduler.report(tx.write)
+    scheduler.reset_stats()
+    return len(scheduler.tasks)
+
+# --- PERFORMANCE STATISTICS COMMAND --- STATS dumps one frame, STATSR dumps it then starts over.
+# STATS1 turns phase timing on, STATS0 off again (the default, timing allocates)
+def cmd_stats(args):
+    if args:
+        stats.enabled = int(args) != 0
+        return int(stats.enabled)
+    if framer.enabled:
+        tx.write(stats.pack(hx.missed_conversions, hx.late_conversions, dsm.get_rejected_count(), policy.suppressed))
+    else:
+        tx.write(stats.format_text(hx.missed_conversions, hx.late_conversions, dsm.get_rejected_count(), policy.suppressed))
+
+def cmd_stats_reset(args):
+    cmd_stats(args)
+    stats.reset()
+    hx.reset_stats()
+    dsm.reset_rejected_count()
+    policy.reset_stats()
+    tx.reset_stats()
+
+# --- LOG COMMANDS --- LOG sends the recent event ring as L: lines, LOGL<level> sets the level (0 debug - 4 off)
+def cmd_log(args):
+    log.dump(tx.write)
+
+def cmd_log_level(args):
+    log.set_level(int(args))
+    return log.level
+
+# --- BOOT COMMAND --- Reports start up milestones as B:<name>:<ms>,... (ms since code.py started)
+def cmd_boot(args):
+    tx.write(boot.format_text())
+    return boot.get('advertising')
+
+# --- REP SUMMARY COMMAND --- SUM1 sends only rep summaries (no samples), SUM0 streams samples again.
+# Summaries are sent either way.
+def cmd_summaries(args):
+    global summariesOnly
+
+    summariesOnly = int(args) != 0
+    return int(summariesOnly)
+
+# --- REP THRESHOLD COMMAND --- Format RT<start level>:<rest level>
+def cmd_rep_threshold(args):
+    split = args.split(":")
+    if (len(split) != 2):
+        raise CommandError(responses.BAD_ARGUMENT, 'Invalid Rep Threshold Request')
+    analyzer.set_levels(float(split[0]), float(split[1]))
+    return analyzer.start_level
+
+# --- RECORDING COMMANDS --- REC1 arms offline recording (kept over power cycles), REC0 disarms it,
+# RECS reports RS:<armed>,<chunks>,<error>, RECX erases the log, RECD<chunk> downloads the log from
+# that chunk on, ending with RD:<first chunk>,<next chunk> (pass next chunk to resume)
+def cmd_record(args):
+    enabled = int(args) != 0
+    settings.set_recording(enabled)
+    if not enabled and recorder is None:
+        return 0
+    get_recorder().arm(enabled)
+    return int(recorder.armed)
+
+def cmd_record_status(args):
+    get_recorder()
+    tx.write(f'RS:{int(recorder.armed)},{recorder.chunks},{recorder.error}\n')
+    return recorder.chunks
+
+def cmd_record_erase(args):
+    get_recorder().erase()
+    if recorder.chunks:
+        raise CommandError(responses.FAILED, 'Log not erased')
+    return 0
+
+def cmd_record_download(args):
+    first = int(args) if args else 0
+    if not get_recorder().chunks:
+        raise CommandError(responses.NOT_READY, 'Nothing recorded')
+    if not 0 <= first <= recorder.chunks:
+        raise CommandError(responses.OUT_OF_RANGE, 'No such chunk')
+    try:
+        recorder.start_download(first)
+    except OSError:
+        raise CommandError(responses.FAILED, 'Log not readable')
+    return recorder.chunks
+
+# --- TX QUEUE COMMAND --- Format TXQ<mtu>:<packets per event>, TXQ alone reports the counters as
+# TQ:<bytes/s>,<bytes sent>,<stalls>,<dropped>,<control peak>,<stream peak>
+def cmd_tx_queue(args):
+    if args:
+        split = args.split(":")
+        if (len(split) != 2):
+            raise CommandError(responses.BAD_ARGUMENT, 'Invalid TX Queue Request')
+        tx.configure(int(split[0]), int(split[1]))
+    else:
+        tx.write(f'TQ:{tx.rate},{tx.sent},{tx.stalls},{tx.dropped},{tx.control.peak},{tx.stream.peak}\n')
+    return tx.budget
+
+# --- WEIGHT THRESHOLD --- Loads at or below this are reported as rest
+def cmd_weight_threshold(args):
+    policy.floor = float(args)
+    return policy.floor
+
+# --- REPORT POLICY COMMAND --- Format RP<deadband>:<heartbeat ms>:<min period ms>, RP alone reports
+# the settings and counters as RP:<deadband>,<heartbeat>,<min period>,<sent>,<suppressed>
+def cmd_report_policy(args):
+    if args:
+        split = args.split(":")
+        if (len(split) != 3):
+            raise CommandError(responses.BAD_ARGUMENT, 'Invalid Report Policy Request')
+        policy.configure(float(split[0]), int(split[1]), int(split[2]))
+    else:
+        tx.write(f'RP:{policy.deadband},{policy.heartbeat_ms},{policy.min_period_ms},{policy.sent},{policy.suppressed}\n')
+    return policy.deadband
+
+# --- NEW MOTOR CUSTOM COMMAND --- Format C##.##.##.##.## (C<lower><goalLower><goalUpper><upper><goal>)
+def cmd_motor_custom(args):
+    feedback.set_custom(float(args[0:3]), float(args[3:6]), float(args[6:9]), float(args[9:12]), float(args[12:]))
+    log.info('Custom motor: %s,%s,%s,%s,%s', feedback.lower, feedback.goal_lower, feedback.goal_upper, feedback.upper, feedback.goal)
+    return feedback.goal
+
+# --- NEW MOTOR DUAL CUSTOM COMMAND --- Format Z1########## (each number = 5 characters including decimal)
+def cmd_motor_custom_lower(args):
+    if not args.startswith('1'):
+        raise CommandError(responses.UNKNOWN_COMMAND, 'Unknown command')
+
+    feedback.set_custom_lower(float(args[1:6]), float(args[6:]))
+    return feedback.goal_lower
+
+# --- Format ############### (each number = 5 characters including decimal)
+def cmd_motor_custom_upper(args):
+    feedback.set_custom_upper(float(args[:5]), float(args[5:10]), float(args[10:15]))
+    return feedback.goal
+
+# --- RESUME CUSTOM MOTOR FEEDBACK ---
+def cmd_resume_custom(args):
+    feedback.resume()
+
+# Dispatch table. The command word is the leading run of letters, so prefixes can't shadow each other
+commands = CommandDispatcher()
+commands.register('TARE', cmd_tare)
+commands.register('CAL', cmd_calibrate)
+commands.register('CP', cmd_calibration_point)
+commands.register('CPCLR', cmd_calibration_clear)
+commands.register('CI', cmd_get_ci)
+commands.register('SETCI', cmd_set_ci)
+commands.register('MPOW', cmd_motor_power)
+commands.register('MON', cmd_motor_on)
+commands.register('MOFF', cmd_motor_off)
+commands.register('MP', cmd_motor_pulse)
+commands.register('MRP', cmd_motor_range_pulse)
+commands.register('MR', cmd_motor_range)
+commands.register('PU', cmd_pattern_upload)
+commands.register('PP', cmd_pattern_play)
+commands.register('PL', cmd_pattern_light)
+commands.register('PS', cmd_pattern_stop)
+commands.register('BIN', cmd_binary)
+commands.register('DLT', cmd_delta)
+commands.register('HF', cmd_outlier_filter)
+commands.register('CH', cmd_channels)
+commands.register('FXP', cmd_fixed_point)
+commands.register('TASKS', cmd_tasks)
+commands.register('STATS', cmd_stats)
+commands.register('STATSR', cmd_stats_reset)
+commands.register('LOG', cmd_log)
+commands.register('LOGL', cmd_log_level)
+commands.register('BOOT', cmd_boot)
+commands.register('SUM', cmd_summaries)
+commands.register('RT', cmd_rep_threshold)
+commands.register('REC', cmd_record)
+commands.register('RECS', cmd_record_status)
+commands.register('RECX', cmd_record_erase)
+commands.register('RECD', cmd_record_download)
+commands.register('TXQ', cmd_tx_queue)
+commands.register('TH', cmd_weight_threshold)
+commands.register('RP', cmd_report_policy)
+commands.register('C', cmd_motor_custom)
+commands.register('Z', cmd_motor_custom_lower)
+commands.register('', cmd_motor_custom_upper)
+commands.register('R', cmd_resume_custom)
+
+# Command processor - takes one framed, upper case command line and sends back one response
 def process_device_command(command):
+    if __debug__ and log.debugging:
+        log.debug('CLEAN: %s', command)
 
-    global motorRange
-    global motorRangeEnabled
-    global motorPulseEnabled
-    global MRP_PULSE
-    global MRP_BREAK
-    global MESSAGE_WEIGHT_TH
-
-    # --- NEW ---
-    global motorCustomEnabled
-    global motorRepStarted
-    global motorBoundLower
-    global motorBoundGoalUpper
-    global motorBoundGoalLower
-    global motorBoundUpper
-    global motorGoal
-
-    # Clean and standardize command
-    clean = command.strip().upper().decode("utf-8")
-    print(f'CLEAN: {clean}')
-
-    # --- TARE COMMAND ---
-    if (clean == 'TARE'):
-        dsm.tare()
-
-    # --- CALIBRATION COMMAND ----
-    elif (clean.startswith('CAL')):
-        try:
-            cal = float(clean[3:])
-            dsm.calibrate(cal)
-        except ValueError:
-            print("Invalid calibration request")
-
-    # --- GET CONNECTION INTERVAL COMMAND ---
-    elif (clean == 'CI'):
-        connection = ble.connections[0]
-        uart.write(f'CI:{connection.connection_interval}\n')
-
-    # --- SET CONNECTION INTERVAL COMMAND ---
-    elif (clean.startswith('SETCI')):
-        try:
-            ci = int(clean[5:])
-            if (ci > 10) and (ci < 255):   # Sanity check value
-
-                # Request Change to CI
-                settings.set_connectionInterval(ci)
-                print("Requesting CI:",ci)
-                connection = ble.connections[0]
-                connection.connection_interval = settings.get_connectionInterval()
-
-                # Echo new CI back to controller
-                print("Actual CI:",connection.connection_interval)
-                uart.write(f'CI:{connection.connection_interval}\n')
-
-        except ValueError:
-            print("Invalid CI request")
-    
-    # --- MOTOR POWER COMMAND ---
-    elif (clean.startswith('MPOW')):
-        try:
-            pow = float(clean[4:])
-            motor.setPower(pow)
-        except ValueError:
-            print("Invalid Motor Power Request")
-    # --- MOTOR ON COMMAND ---
-    elif (clean == "MON"):
-        clearMotorModes()
-        motor.motorOn()
-        print('Motor turned on')
-
-    # --- MOTOR OFF COMMAND ---
-    elif (clean == "MOFF"):
-        clearMotorModes()
-        motor.motorOff()
-
-    # --- MOTOR PULSE COMMAND ---
-    elif (clean.startswith('MP')):
-        clearMotorModes()
-        try:
-            splitme = clean[2:]
-            split = splitme.split(":")
-            if (len(split) == 2):
-                on = float(split[0])
-                off = float(split[1])
-                motor.setPulse(on,off)
-            else:
-                print('Invalid Motor Pulse Request')
-        except ValueError:
-            print("Invalid Motor Pulse Request")
-
-    # --- MOTOR RANGE PULSE COMMAND ---
-    elif (clean.startswith('MRP')):
-        clearMotorModes()
-        try:
-            motorRange = float(clean[3:])
-            motorPulseEnabled = True
-            motor.setPower(1.0)
-            motor.setPulse(MRP_PULSE,MRP_BREAK)
-        except ValueError:
-            print('Invalid Motor Range Pulse Request')
-
-    # --- MOTOR RANGE COMMAND ---
-    elif (clean.startswith('MR')):
-        clearMotorModes()
-        try:
-            motorRange = float(clean[2:])
-            motorRangeEnabled = True
-            motor.motorOn()
-        except ValueError:
-            print('Invalid Motor Range Request')
-
-    # --- WEIGHT THRESHOLD ---
-    elif (clean.startswith('TH')):
-        try:
-            MESSAGE_WEIGHT_TH = float(clean[2:])
-        except ValueError:
-            print('Bad weight threshold')
-
-    # --- NEW MOTOR CUSTOM COMMAND --- Format MC##.##.##.##.## (MC<lower>.<goalLower>.<goalUpper>.<upper>.<goal>)
-    elif (clean.startswith('C')):
-        clearMotorModes()
-        print(clean)
-        try:
-            motorBoundLower = float(clean[1:4])
-            motorBoundGoalLower = float(clean[4:7])
-            motorBoundGoalUpper= float(clean[7:10])
-            motorBoundUpper= float(clean[10:13])
-            motorGoal = float(clean[13:])
-            print(f'{motorBoundLower},{motorBoundGoalLower},{motorBoundGoalUpper},{motorBoundUpper},{motorGoal}')
-            motorCustomEnabled = True
-            motor.motorOn()
-        except ValueError:
-            print('Invalid custom motor upper values')
-
-    # --- NEW MOTOR DUAL CUSTOM COMMAND --- Format Z1########## (each number = 5 characters including decimal)
-    elif (clean.startswith('Z1')):
-        clearMotorModes()
-        print(clean)
-        try:
-            motorBoundLower = float(clean[2:7])
-            motorBoundGoalLower = float(clean[7:])
-            motorCustomEnabled = True
-        except ValueError:
-            print('Invalid custom motor lower values')
-            
-    # --- Format ############### (each number = 5 characters including decimal)
-    elif (clean[0].isdigit()):
-        print(clean)
-        try:
-            motorBoundGoalUpper = float(clean[:5])
-            motorBoundUpper = float(clean[5:10])
-            motorGoal= float(clean[10:15])
-            motorCustomEnabled = True
-            motor.motorOn()
-        except ValueError:
-            print('Invalid custom motor upper values')
-
-    elif (clean.startswith('R')):
-        motorCustomEnabled = True
-
-def get_motor_state(val):
-    if val < motorBoundLower or (val < motorGoal and not motorRepStarted):
-        return MotorState.RESTING
-    elif motorRepStarted and not motorRepStartIndicationFinished:
-        return MotorState.STARTING
-    elif val < motorBoundGoalLower and motorRepStartIndicationFinished:
-        return MotorState.ACTIVE_LOWER
-    elif val < motorBoundGoalUpper and motorRepStartIndicationFinished:
-        return MotorState.ACTIVE_PERFECT
-    elif motorRepStartIndicationFinished:
-        return MotorState.ACTIVE_UPPER
-    else:
-        return MotorState.UNKNOWN
+    if command == LineFramer.OVERFLOW:
+        log.warning('Command too long, dropped')
+        responder.send(rx.overflow_id, responses.TOO_LONG, None, framer.enabled)
+        return
 
-def get_motor_bools(val):
-    global motorRepStarted
-    global motorStartTime
-    global motorRepStartIndicationFinished
+    code = commands.execute(command)
+    if code != responses.OK:
+        log.warning('Command failed (%d): %s %s', code, command, commands.error)
 
-    if val > motorGoal and not motorRepStarted:
-        motorRepStarted = True
-        print('REP STARTED')
-        motorStartTime = time.monotonic()
+    responder.send(commands.request_id, code, commands.value, framer.enabled)
 
-    elif motorRepStarted and val > motorBoundLower and motorStartTime + .6 <= time.monotonic() and not motorRepStartIndicationFinished:
-        motorRepStartIndicationFinished = True
-        print(f'INDICATION FINISHED {motorStartTime - time.monotonic()}')
+# Connection state, updated by connection_task
+isConnected = False
+sensorFault = False
 
-    elif val < 5:
-        motorRepStartIndicationFinished = False
-        motorRepStarted = False
+# --- TASKS ---
 
-# Main loop
-while True:
+# Advertise while disconnected and set up the link when a central connects
+def connection_task():
+    global isConnected
+    global sensorFault
 
-    # Start advertising BLE packets
-    print('HERE')
-    ble.start_advertising(advertisement)
+    if isConnected and not ble.connected:
+        isConnected = False
+        if recorder is not None:
+            recorder.stop_download()
+        tx.clear()
 
-    # Disconnected State
-    print('AWAITING CONNECTION')
-    print(advertisement)
-    flasher.setDisconnectedState()
+    if not isConnected and not ble.advertising and not ble.connected:
+        # Start advertising BLE packets
+        ble.start_advertising(advertisement)
 
-    # Keep Subsystems Updated
-    while not ble.connected:
-        flasher.update()
-        motor.update()
+        # Disconnected State
+        log.info('AWAITING CONNECTION')
+        log.debug('%s', advertisement)
+        flasher.setDisconnectedState()
 
     # Transition to Connected State
-    if ble.connected:
-        print('CONNECTED')
+    if ble.connected and not isConnected:
+        isConnected = True
+        log.info('CONNECTED')
+        boot.mark('connected')
+
+        # Anything recorded while disconnected goes to flash before streaming starts
+        if recorder is not None:
+            recorder.flush()
 
         # Status update
         flasher.setNegotiatingState()
@@ -310,74 +555,192 @@ while True:
         # Set up connection interval
         connection = ble.connections[0]
 
-        # Check for uninitialized default value in settings
-        if (settings.get_connectionInterval() == 0xff):
-            print('Setting default connection interval to 30ms')
-            settings.set_connectionInterval(DEFAULT_CI)
-
         # Read actual connection interval
         connection.connection_interval = settings.get_connectionInterval()
-        print('Stored CI:',settings.get_connectionInterval())
-        print('Actual CI:',connection.connection_interval,' ms')
+        log.info('Stored CI: %s', settings.get_connectionInterval())
+        log.info('Actual CI: %s ms', connection.connection_interval)
+        set_tx_interval(connection.connection_interval)
 
         # Update flash pattern
         flasher.setConnectedState()
-
-    # Connected State
-    while ble.connected:
-
-        # Process Commands
-        if (uart.in_waiting > 0):
-            # Send to command interpreter
-            print(f' IN WAITING {uart.in_waiting}')
-            process_device_command(uart.read(16))
-            uart.write(f'D:{6969}\n')
-
-        # Update Subsystems
-        flasher.update()
-        motor.update()
-
-        # Process Samples
-        if (hx.is_ready()):
-            dsm.sample()
-
-            # Send latest sample to device
-            val = dsm.get_filtered_value()
-            if (abs(val) > MESSAGE_WEIGHT_TH):
-                uart.write(f'D:{val}\n')
-
-            # Check special motor feedback modes to see if they need updates
-            if motorRangeEnabled:
-                motor.setPower(val/motorRange)
-
-            if motorCustomEnabled:
-                get_motor_bools(val)
-                motorState = get_motor_state(val)
-                print(f'MOTOR STATE: {motorState}, STARTING: {motorRepStarted}, STARTED: {motorRepStartIndicationFinished}, GOAL: {motorGoal}')
-                if motorState == 'resting':
-                    motor.motorOn()
-                    if val < 4:
-                        motor.setPower(0)
-                    else:
-                        motor.setPower(val/motorGoal)
-                # TODO Determine relevant motor/pull states for Loadcell
-                # ? Resting, Started, FAILED,
-                if motorState == 'starting':
-                    motor.motorOff()
-                    # ensures setPulse is only called once
-                    # if motor.onInterval != 0.2:
-                    #     motor.setPulse(0.2, 0.1)
-                    #     motor.setPower(1)
-                elif motorState =='active_lower':
-                    motor.motorOn()
-                    motor.setPower(1)
-                elif motorState == 'perfect':
-                    motor.setPower(0)
-                    motor.setPulse(0.05, 0.05)
-                elif motorState == 'active_upper':
-                    motor.setPower(1)
-                elif motorState == 'failed':
-                    motor.setPower(1)
-                    motor.setPulse(0.1, 0.05)
-                elif motorState == 'unknown':
-                    motor.setPower(0)
+        sensorFault = False
+
+# Process Commands - handles partial reads and several commands per read
+def rx_task():
+    if not isConnected:
+        return
+
+    start = stats.start()
+    rx.poll(uart)
+    command = rx.next_line()
+    while command is not None:
+        # Send to command interpreter
+        process_device_command(command)
+        command = rx.next_line()
+    stats.stop(PHASE_COMMAND, start)
+
+# Queue the offline log one chunk at a time, as fast as the link takes it
+def download_task():
+    if not (isConnected and recorder is not None and recorder.downloading) or tx.room() < recorder.CHUNK_SIZE:
+        return
+
+    start = stats.start()
+    chunk = recorder.read_next()
+    if chunk is None:
+        tx.write(f'RD:{recorder.download_first},{recorder.download_next}\n')
+    else:
+        tx.write(chunk)
+    stats.stop(PHASE_TX, start)
+
+# Once per connection interval: queue any partial binary frame, then send one event's worth
+def tx_task():
+    if not isConnected:
+        return
+
+    start = stats.start()
+    if framer.is_due():
+        data = framer.flush()
+        if data is not None:
+            tx.write_stream(data)
+    tx.flush()
+    stats.stop(PHASE_TX, start)
+
+# ms until a monotonic event time, capped at OUTPUT_IDLE_MS (None is a steady output). The cap is
+# applied before converting to int, so a runaway event time (inf, NaN) can't raise in a task
+def ms_until(event):
+    if event is None:
+        return OUTPUT_IDLE_MS
+    delay = event - time.monotonic()
+    if not (delay < OUTPUT_IDLE_MS/1000):
+        return OUTPUT_IDLE_MS
+    if delay <= 0:
+        return 0
+    return int(delay*1000) + 1
+
+# Motor and pixel run at their period while a pattern is stepping, otherwise they sleep until the
+# next pulse or flash edge. Changes from commands and feedback wake them through onChange
+def motor_task():
+    start = stats.start()
+    if haptics is not None:
+        haptics.update(ticks_ms())
+    motor.update()
+    if haptics is None or not haptics.playing:
+        motorTask.sleep(ms_until(motor.next_event_time()))
+    stats.stop(PHASE_MOTOR, start)
+
+def pixel_task():
+    start = stats.start()
+    if lights is not None:
+        lights.update(ticks_ms())
+    flasher.update()
+    if lights is None or not lights.playing:
+        pixelTask.sleep(ms_until(flasher.next_event_time()))
+    stats.stop(PHASE_PIXEL, start)
+
+# Write settings changes once they settle, rather than on every TARE/CAL
+def settings_task():
+    settings.service()
+
+# Process Samples - streamed while connected, recorded while disconnected and recording is armed
+def sensor_task():
+    global sensorFault
+    global firstSample
+
+    recording = not isConnected
+    if recording and (recorder is None or not recorder.recording):
+        return
+
+    # Report load cell faults (powered down or unplugged amplifier) on transitions only
+    if not recording and hx.fault != sensorFault:
+        sensorFault = hx.fault
+        if sensorFault:
+            log.error('HX711 FAULT')
+            flasher.setFaultState()
+        else:
+            log.warning('HX711 RECOVERED')
+            flasher.setConnectedState()
+        tx.write(f'F:{int(sensorFault)}\n')
+
+    # Nothing ready: run the fault timeout and count the poll, without reading the clock
+    if not hx.is_ready():
+        hx.check_timeout(ticks_ms())
+        stats.tally(PHASE_WAIT)
+        return
+
+    start = stats.start()
+    raw = hx.try_read()
+    stats.stop(PHASE_READ, start)
+    if raw is None:
+        return
+
+    start = stats.start()
+    if hx.channels > 1:
+        accepted = dsm.add_channels(raw)
+    else:
+        accepted = dsm.add_sample(raw)
+    stats.stop(PHASE_FILTER, start)
+    if not accepted:
+        return
+    if firstSample:
+        firstSample = False
+        boot.mark('first_sample')
+
+    # Send latest sample to device
+    start = stats.start()
+    val = dsm.get_filtered_value()
+    now = ticks_ms()
+    if recording:
+        recorder.add(dsm.last_raw, val, now)
+        stats.stop(PHASE_TX, start)
+        return
+    if not summariesOnly and policy.check(val, now):
+        if framer.enabled:
+            if framer.add(dsm.last_raw, val):
+                tx.write_stream(framer.flush())
+        else:
+            tx.write_stream(f'D:{val}\n')
+    stats.stop(PHASE_TX, start)
+
+    # Motor feedback modes follow the load
+    start = stats.start()
+    feedback.update(val, now)
+    stats.stop(PHASE_MOTOR, start)
+
+    # Rep summary once a rep ends
+    start = stats.start()
+    if analyzer.update(val, now):
+        if framer.enabled:
+            tx.write(analyzer.pack())
+        else:
+            tx.write(analyzer.format_text())
+    stats.stop(PHASE_REPS, start)
+
+
+# Match the TX batching period to the connection interval
+def set_tx_interval(interval_ms):
+    sampleFramer.set_interval(interval_ms)
+    if deltaFramer is not None:
+        deltaFramer.set_interval(interval_ms)
+    txTask.set_period(max(int(interval_ms), 1))
+
+
+# Main loop - sensor reads have top priority, everything else runs at its own period
+scheduler = Scheduler()
+scheduler.add_task('sensor', sensor_task, 2, priority=5)
+scheduler.add_task('rx', rx_task, 10, priority=4)
+txTask = scheduler.add_task('tx', tx_task, DEFAULT_CI, priority=3)
+scheduler.add_task('download', download_task, 5, priority=1)
+motorTask = scheduler.add_task('motor', motor_task, 5, priority=2)
+scheduler.add_task('connection', connection_task, 50, priority=1)
+pixelTask = scheduler.add_task('pixel', pixel_task, 20, priority=0)
+scheduler.add_task('settings', settings_task, 500, priority=0)
+motor.onChange = motorTask.wake
+flasher.onChange = pixelTask.wake
+
+# The rest of start up happened while advertising, show how long it all took
+log.info('AWAITING CONNECTION')
+flasher.setDisconnectedState()
+boot.mark('main_loop')
+log.info('Boot times (ms): %s', boot.format_text().strip())
+
+scheduler.run()
@@ -0,0 +1,228 @@
+# commandparser.py
+#
+# Line framed command receiver and table driven command dispatch
+#
+# Commands are ASCII lines ending in '\n', '\r' or ';'. Several commands may arrive in one read
+# and one command may be split across reads. Unterminated input is also accepted once the link
+# has been idle for a short while, which keeps older apps that send bare commands working.
+# A line longer than the buffer is dropped through to its '\n' or '\r' and comes out of
+# next_line() as OVERFLOW, so it still gets its one (failed) response.
+
+from ticks import ticks_ms, ticks_diff
+from responses import CommandError, OK, UNKNOWN_COMMAND, BAD_ARGUMENT, MAX_REQUEST_ID
+
+
+class LineFramer:
+
+    NEWLINE = 0x0A
+    RETURN = 0x0D
+    SEMICOLON = 0x3B
+    HASH = 0x23
+    COLON = 0x3A
+
+    OVERFLOW = '\n'        # Returned by next_line() for a line that didn't fit, never a real line
+
+    def __init__(self, size=128, idle_ms=50):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.length = 0         # Bytes received and not yet consumed
+        self.scanned = 0        # Bytes already searched for a terminator
+
+        self.idle_ms = idle_ms
+        self.last_rx = ticks_ms()
+
+        # A line longer than the buffer is dropped up to the next '\n' or '\r', then reported once
+        self.overflows = 0      # Lines dropped for being longer than the buffer
+        self.discarding = False
+        self.overflow_pending = False
+        self.overflow_id = None     # Request id of the dropped line, if it got that far
+
+    # Read whatever the UART has straight into the buffer
+    def poll(self, uart):
+        waiting = uart.in_waiting
+        if waiting == 0:
+            return 0
+
+        if self.length == len(self.buffer):
+            if self._find_end() >= 0:
+                return 0        # Complete lines still to be taken, leave the rest waiting
+            # A full buffer without a terminator can't be a valid command
+            self._overflow()
+
+        start = self.length
+        count = uart.readinto(self.view[start:start + min(waiting, len(self.buffer) - start)])
+        if count:
+            self._received(start, count)
+        return count or 0
+
+    # Add bytes directly (used when the data doesn't come from a UART). Returns the number taken,
+    # which is short if complete lines have to be taken with next_line() first
+    def feed(self, data):
+        taken = 0
+        for b in data:
+            if self.length == len(self.buffer):
+                if self._find_end() >= 0:
+                    break
+                self._overflow()
+            self.buffer[self.length] = b
+            self._received(self.length, 1)
+            taken += 1
+        return taken
+
+    # Drop the line filling the buffer, keeping its request id for the response
+    def _overflow(self):
+        self.overflows += 1
+        self.overflow_id = None
+        buffer = self.buffer
+        if buffer[0] == self.HASH:
+            value = 0
+            i = 1
+            while i < self.length and 0x30 <= buffer[i] <= 0x39 and value <= MAX_REQUEST_ID:
+                value = value*10 + buffer[i] - 0x30
+                i += 1
+            if i > 1 and i < self.length and buffer[i] == self.COLON and value <= MAX_REQUEST_ID:
+                self.overflow_id = value
+        self.discarding = True
+        self.length = 0
+        self.scanned = 0
+
+    # Take count new bytes at start: upper case them, or drop them while discarding an overflowed line
+    def _received(self, start, count):
+        self.last_rx = ticks_ms()
+        end = start + count
+        buffer = self.buffer
+        for i in range(start, end):
+            b = buffer[i]
+            if 0x61 <= b <= 0x7A:
+                buffer[i] = b - 0x20
+        if not self.discarding:
+            self.length = end
+            return
+
+        for i in range(start, end):
+            b = buffer[i]
+            if b == self.NEWLINE or b == self.RETURN:
+                # End of the dropped line, keep what follows it
+                self.discarding = False
+                self.overflow_pending = True
+                remaining = end - i - 1
+                for j in range(remaining):
+                    buffer[j] = buffer[i + 1 + j]
+                self.length = remaining
+                self.scanned = 0
+                return
+        self.length = 0
+
+    # Index of the first terminator, or -1. Picks up where the last search stopped
+    def _find_end(self):
+        buffer = self.buffer
+        i = self.scanned
+        while i < self.length:
+            b = buffer[i]
+            if b == self.NEWLINE or b == self.RETURN or b == self.SEMICOLON:
+                self.scanned = i
+                return i
+            i += 1
+        self.scanned = i
+        return -1
+
+    # Return the next complete command as a stripped str, OVERFLOW for a dropped line, or None
+    def next_line(self):
+        while True:
+            if self.overflow_pending:
+                self.overflow_pending = False
+                return self.OVERFLOW
+            if self.discarding:
+                # A quiet link ends a dropped line too, as it ends a bare command
+                if ticks_diff(ticks_ms(), self.last_rx) < self.idle_ms:
+                    return None
+                self.discarding = False
+                return self.OVERFLOW
+
+            end = self._find_end()
+            if end < 0:
+                # No terminator. Treat a quiet link as the end of a bare command
+                if self.length == 0 or ticks_diff(ticks_ms(), self.last_rx) < self.idle_ms:
+                    return None
+                end = self.length
+                consumed = self.length
+            else:
+                consumed = end + 1
+
+            try:
+                line = str(self.view[:end], 'utf-8').strip()
+            except UnicodeError:
+                line = ''
+
+            # Move any remaining bytes to the front
+            buffer = self.buffer
+            remaining = self.length - consumed
+            for i in range(remaining):
+                buffer[i] = buffer[consumed + i]
+            self.length = remaining
+            self.scanned = 0
+
+            # Blank lines are skipped
+            if line:
+                return line
+
+
+class CommandDispatcher:
+
+    def __init__(self):
+        self.handlers = {}
+
+        # Outcome of the last execute()
+        self.request_id = None
+        self.value = None
+        self.error = ''
+
+    # Register a handler for a command word. The handler gets the text after the word and returns
+    # a value to echo back (or None). It fails the command by raising CommandError or ValueError.
+    def register(self, name, handler):
+        self.handlers[name] = handler
+
+    # Run one command line, optionally prefixed with #<request id>:
+    # The command word is the leading run of letters, everything after it is the argument.
+    # Commands that start with a digit are looked up under the empty word ''.
+    # Returns an error code from responses; request_id, value and error describe the outcome.
+    def execute(self, line):
+        self.request_id = None
+        self.value = None
+        self.error = ''
+
+        if line.startswith('#'):
+            sep = line.find(':')
+            if sep < 0:
+                self.error = 'Bad request id'
+                return BAD_ARGUMENT
+            try:
+                request_id = int(line[1:sep])
+            except ValueError:
+                request_id = -1
+            if not (0 <= request_id <= MAX_REQUEST_ID):
+                self.error = 'Bad request id'
+                return BAD_ARGUMENT
+            self.request_id = request_id
+            line = line[sep+1:]
+
+        i = 0
+        n = len(line)
+        while i < n and 'A' <= line[i] <= 'Z':
+            i += 1
+
+        handler = self.handlers.get(line[:i])
+        if handler is None:
+            self.error = 'Unknown command'
+            return UNKNOWN_COMMAND
+
+        try:
+            self.value = handler(line[i:])
+        except CommandError as e:
+            self.error = str(e)
+            return e.code
+        except (ValueError, IndexError, ZeroDivisionError) as e:
+            self.error = str(e)
+            return BAD_ARGUMENT
+
+        return OK
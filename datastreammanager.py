@@ -1,61 +1,337 @@
 # datastreammanager.py
 #
 # Manager for HX711 data stream
+#
+# The EMA and tare normally run in floats. In fixed point mode (set_fixed_point) they run on
+# integers in Q4 (1/16 count), with the EMA ratio rounded to a power of two so the update is a
+# shift, and the only float is the single multiply in get_filtered_value(). That keeps per sample
+# work within small ints, so nothing is allocated (the sample history stops keeping its float
+# sum of squares too). Results stay within one count of float mode for ratios down to 1/16.
+#
+# With several load cells (channels > 1) each channel has its own outlier filter and EMA, and the
+# sum of the channels feeds the combined filter, which is what tare, calibration and the stream
+# use. The EMA is linear, so the combined output is the sum of the channel outputs. The channel
+# EMAs follow the same float or Q4 mode as the combined one. An invalid reading (-1) on one channel
+# is counted and that channel's last value is carried into the sweep, so the others still count.
 
-from settings import Settings
 import math
+import struct
+
+from settings import Settings
+from samplehistory import SampleHistory
+from hampelfilter import HampelFilter
+from calibration import CalibrationTable
+from ticks import ticks_ms
+from logger import log
 
 settings = Settings()
 
+Q_BITS = 4      # Fractional bits of the fixed point filter state
+
 class DataStreamManager:
 
-    def __init__(self, sample_function, filter_ratio = 0.10):
+    def __init__(self, sample_function, filter_ratio = 0.10, history_size = 64, outlier_window = 7, channels = 1):
         self.filter_ratio = filter_ratio
         self.sample_function = sample_function
-        self.filtered_value = sample_function()
+        self.outlier_filter = HampelFilter(outlier_window)  # Rolling median spike rejection ahead of the EMA
+        self.history = SampleHistory(history_size)      # Recent raw/filtered samples with windowed stats
+        self.invalid = 0        # Samples dropped as invalid readings (-1)
+
+        # Per channel filters, only used with more than one load cell
+        self.channels = channels
+        self.channel_filters = [HampelFilter(outlier_window) for i in range(channels)] if channels > 1 else []
+        self.channel_filtered = [None]*channels     # EMA per channel in raw counts
+        self.channel_filtered_q = [None]*channels   # Same in Q4 counts, fixed point mode
+        self.channel_last = [None]*channels         # Last accepted reading, stands in for an invalid one
+        self.channel_tare = [0.0]*channels
+        self.channel_tare_q = [0]*channels
 
-        if math.isnan(settings.get_tare()):
-            # Tare is uninitialized - set default of 0
-            print('Tare uninitialized. Setting to 0')
-            settings.set_tare(0.0)
+        # Nothing is read here, so start up doesn't wait on the sensor. The first sample seeds the EMA
+        self.filtered_value = None
+        self.last_raw = None
 
+        # Defaults (tare 0, scale 1) come from the settings store when nothing has been saved
         self.tare_val = settings.get_tare()
-        print('Tare loaded:',self.tare_val)
+        log.info('Tare loaded: %s', self.tare_val)
 
-        if math.isnan(settings.get_calibration()):
-            # Calibration is uninitialized, set default of 1.0
-            print('Calibration uninitialized. Setting to 1')
-            settings.set_calibration(1.0)
+        # Channel tares are only used if they were saved with the same number of load cells
+        if channels > 1:
+            data = settings.get_channel_tares()
+            if len(data) == 4*channels:
+                self.channel_tare = list(struct.unpack('<%df' % channels, data))
+                log.info('Channel tares loaded: %s', self.channel_tare)
 
         self.calibration_scale = settings.get_calibration()     # Unit scale for calibration point
-        print('Calibration loaded:',self.calibration_scale)
+        log.info('Calibration loaded: %s', self.calibration_scale)
+
+        # Multi point calibration, used instead of the scale once it has a point besides the tare
+        self.calibration_table = CalibrationTable()
+        self.calibration_table.from_bytes(settings.get_calibration_table())
+        if self.calibration_table.active:
+            log.info('Calibration table loaded: %d points', len(self.calibration_table.counts))
 
-        self.REJECT_RATIO = 100.0        # Back to back samples that are off by this ratio are rejected
+        # Fixed point mode state
+        self.fixed_point = False
+        self.filtered_q = None      # EMA in Q4 counts, None until the first sample
+        self.tare_q = 0
+        self.scale_q = 0.0          # Output units per Q4 count
+        self.ema_shift = max(0, round(-math.log(filter_ratio)/math.log(2)))    # Nearest power of two ratio
+        self.ema_round = (1 << self.ema_shift) >> 1
+        self.update_fixed_calibration()
 
+    # Take a sample if one is available. Returns True if a new sample was added to the filter
     def sample(self):
-        val = self.sample_function();
+        if self.channels > 1:
+            return self.add_channels(self.sample_function())
+        return self.add_sample(self.sample_function())
+
+    # Feed one reading per channel (any sequence). Returns True if it was accepted
+    def add_channels(self, values):
+        if values is None:
+            return False
+
+        # A channel with nothing to carry forward yet holds back the whole sweep
+        for i in range(self.channels):
+            if (values[i] == -1) and (self.channel_last[i] is None):
+                self.invalid += 1
+                return False
+
+        total = 0
+        ratio = self.filter_ratio
+        for i in range(self.channels):
+            if (values[i] == -1):
+                self.invalid += 1
+                val = self.channel_last[i]
+            else:
+                val = self.channel_filters[i].filter(values[i])
+                self.channel_last[i] = val
+            total += val
+
+            if self.fixed_point:
+                val_q = val << Q_BITS
+                filtered_q = self.channel_filtered_q[i]
+                if filtered_q is None:
+                    self.channel_filtered_q[i] = val_q
+                else:
+                    self.channel_filtered_q[i] = filtered_q + ((val_q - filtered_q + self.ema_round) >> self.ema_shift)
+                continue
+
+            filtered = self.channel_filtered[i]
+            if filtered is None:
+                self.channel_filtered[i] = val
+            else:
+                self.channel_filtered[i] = (1.0-ratio)*filtered + ratio*val
+
+        # Spikes are already gone, the combined filter only smooths
+        self.filter(total)
+        return True
+
+    # Feed a reading taken elsewhere through the filters. Returns True if it was accepted
+    def add_sample(self, val):
+        # Nothing ready yet
+        if val is None:
+            return False
 
         # Is this a reasonable value?
 
         # Ignore -1 values
         if (val == -1):
-            print("Rejected outlier:",val)
+            self.invalid += 1
+            if __debug__ and log.debugging:
+                log.debug('Rejected outlier: %d', val)
+            return False
+
+        # Replace spikes with the rolling median
+        self.filter(self.outlier_filter.filter(val))
+        return True
+
+    # EMA and history for a reading that has passed the outlier checks
+    def filter(self, val):
+        self.last_raw = val
+        if self.fixed_point:
+            val_q = val << Q_BITS
+            if self.filtered_q is None:
+                self.filtered_q = val_q
+            else:
+                self.filtered_q += (val_q - self.filtered_q + self.ema_round) >> self.ema_shift
+            self.history.push(ticks_ms(), val, self.filtered_q >> Q_BITS)
             return
 
-        self.filtered_value = (1.0-self.filter_ratio)*self.filtered_value + self.filter_ratio*val
+        if self.filtered_value is None:
+            self.filtered_value = val
+        else:
+            self.filtered_value = (1.0-self.filter_ratio)*self.filtered_value + self.filter_ratio*val
+
+        self.history.push(ticks_ms(), val, self.filtered_value)
 
 
     def get_filtered_value(self):
+        if self.fixed_point:
+            if self.filtered_q is None:
+                return 0.0
+            if self.calibration_table.active:
+                return self.calibration_table.evaluate_q(self.filtered_q - self.tare_q)
+            return (self.filtered_q - self.tare_q)*self.scale_q
+        if self.filtered_value is None:
+            return 0.0
+        if self.calibration_table.active:
+            return self.calibration_table.evaluate(self.filtered_value - self.tare_val)
         return (self.filtered_value - self.tare_val)*self.calibration_scale
 
+    # One channel's load in output units, from its own tare and the shared calibration. The table
+    # is fitted to the combined load, so on a channel it is only as good as the cells are linear
+    def get_channel_value(self, channel):
+        if self.channels == 1:
+            return self.get_filtered_value()
+        if self.fixed_point:
+            filtered_q = self.channel_filtered_q[channel]
+            if filtered_q is None:
+                return 0.0
+            if self.calibration_table.active:
+                return self.calibration_table.evaluate_q(filtered_q - self.channel_tare_q[channel])
+            return (filtered_q - self.channel_tare_q[channel])*self.scale_q
+        filtered = self.channel_filtered[channel]
+        if filtered is None:
+            return 0.0
+        if self.calibration_table.active:
+            return self.calibration_table.evaluate(filtered - self.channel_tare[channel])
+        return (filtered - self.channel_tare[channel])*self.calibration_scale
+
+    # One channel's filter output in raw counts, either mode. None before its first sample
+    def get_channel_counts(self, channel):
+        if self.fixed_point:
+            filtered_q = self.channel_filtered_q[channel]
+            if filtered_q is None:
+                return None
+            return filtered_q/(1 << Q_BITS)
+        return self.channel_filtered[channel]
+
+    # True once the first sample has been filtered
+    def has_samples(self):
+        return self.filtered_value is not None or self.filtered_q is not None
+
+    # Filter output in raw counts (uncalibrated), either mode. None before the first sample
+    def get_filtered_counts(self):
+        if self.fixed_point:
+            if self.filtered_q is None:
+                return None
+            return self.filtered_q/(1 << Q_BITS)
+        return self.filtered_value
+
+    # Switch between the float and fixed point filter, carrying the filter state over
+    def set_fixed_point(self, enabled):
+        if enabled == self.fixed_point:
+            return
+        if enabled:
+            if self.filtered_value is not None:
+                self.filtered_q = round(self.filtered_value*(1 << Q_BITS))
+            self.filtered_value = None
+            for i in range(self.channels):
+                if self.channel_filtered[i] is not None:
+                    self.channel_filtered_q[i] = round(self.channel_filtered[i]*(1 << Q_BITS))
+                self.channel_filtered[i] = None
+        else:
+            if self.filtered_q is not None:
+                self.filtered_value = self.filtered_q/(1 << Q_BITS)
+            self.filtered_q = None
+            for i in range(self.channels):
+                if self.channel_filtered_q[i] is not None:
+                    self.channel_filtered[i] = self.channel_filtered_q[i]/(1 << Q_BITS)
+                self.channel_filtered_q[i] = None
+        self.fixed_point = enabled
+
+        # The running sum of squares is float work on every sample, variance is worked out on demand instead
+        self.history.set_running_sumsq(not enabled)
+
+    # Fixed point copies of the tare and scale, redone whenever they change
+    def update_fixed_calibration(self):
+        self.tare_q = round(self.tare_val*(1 << Q_BITS))
+        for i in range(self.channels):
+            self.channel_tare_q[i] = round(self.channel_tare[i]*(1 << Q_BITS))
+        self.scale_q = self.calibration_scale/(1 << Q_BITS)
+
+    # Configure outlier rejection. A window below 3 disables it
+    def set_outlier_filter(self, window, threshold=None):
+        for f in [self.outlier_filter] + self.channel_filters:
+            f.set_window(window)
+            if threshold is not None:
+                f.set_threshold(threshold)
+
+    # Invalid readings plus spikes replaced by the outlier filter
+    def get_rejected_count(self):
+        rejected = self.invalid + self.outlier_filter.rejected
+        for f in self.channel_filters:
+            rejected += f.rejected
+        return rejected
+
+    def reset_rejected_count(self):
+        self.invalid = 0
+        self.outlier_filter.rejected = 0
+        for f in self.channel_filters:
+            f.rejected = 0
+
+    # Load for tared counts, through the calibration table when it is active like the stream
+    def counts_to_load(self, counts):
+        if self.calibration_table.active:
+            return self.calibration_table.evaluate(counts)
+        return counts*self.calibration_scale
+
+    # Windowed statistics over the sample history, in calibrated units. With the table the spread
+    # is scaled by the slope of the segment holding the window mean
+    def get_window_mean(self):
+        return self.counts_to_load(self.history.mean() - self.tare_val)
+
+    def get_window_stddev(self):
+        if self.calibration_table.active:
+            return self.history.stddev()*abs(self.calibration_table.slope(self.history.mean() - self.tare_val))
+        return self.history.stddev()*abs(self.calibration_scale)
+
+    def get_window_range(self):
+        return abs(self.counts_to_load(self.history.max() - self.tare_val) - self.counts_to_load(self.history.min() - self.tare_val))
+
+    # True once the window is full and its spread is within max_stddev (calibrated units)
+    def is_stable(self, max_stddev):
+        return self.history.count == self.history.capacity and self.get_window_stddev() <= max_stddev
+
     # Reset tare value to current load
     def tare(self):
-        self.tare_val = self.filtered_value
+        if not self.has_samples():
+            log.warning('No samples yet, tare ignored')
+            return
+        self.tare_val = self.get_filtered_counts()
+        for i in range(self.channels):
+            counts = self.get_channel_counts(i)
+            if counts is not None:
+                self.channel_tare[i] = counts
+        self.update_fixed_calibration()
         settings.set_tare(self.tare_val)
-        print("Tared to:",self.tare_val)
+        if self.channels > 1:
+            settings.set_channel_tares(struct.pack('<%df' % self.channels, *self.channel_tare))
+        log.info('Tared to: %s', self.tare_val)
 
-    # Set calibration for current load value
+    # Add the current load as a calibration table point. Returns the number of points (including the tare point)
+    def add_calibration_point(self, current_load):
+        if not self.has_samples():
+            log.warning('No samples yet, calibration point ignored')
+            return len(self.calibration_table.counts)
+        points = self.calibration_table.add_point(self.get_filtered_counts() - self.tare_val, current_load)
+        settings.set_calibration_table(self.calibration_table.to_bytes())
+        return points
+
+    # Drop the calibration table, going back to the single scale factor
+    def clear_calibration_points(self):
+        self.calibration_table.clear()
+        settings.set_calibration_table(b'')
+
+    # Set calibration for current load value. The scale isn't used while the table is active
     def calibrate(self, current_load):
+        if not self.has_samples():
+            log.warning('No samples yet, calibration ignored')
+            return
+        if self.calibration_table.active:
+            log.warning('Calibration table in use, calibration ignored')
+            return
         # Assuming tare = 0, we can create a unit scale factor based on this sample point
-        self.calibration_scale = current_load/(self.filtered_value-self.tare_val)
+        self.calibration_scale = current_load/(self.get_filtered_counts()-self.tare_val)
+        self.update_fixed_calibration()
         settings.set_calibration(self.calibration_scale)
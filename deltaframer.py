@@ -0,0 +1,299 @@
+# deltaframer.py
+#
+# Delta compressed raw sample stream for the BLE UART
+#
+# Raw counts change slowly next to their 24 bit range, so instead of absolute values the stream
+# carries a keyframe with one absolute sample plus the calibration, then chunks of zig-zag varint
+# deltas. Calibration is applied on the receiving side: value = (raw - tare)*scale. Chunks are
+# sized to fit a BLE notification.
+#
+# Frame layouts (little endian):
+#   Keyframe - sync (u8), type 'K' (u8), sequence (u8), time ms (u32), raw (i32), tare (f32), scale (f32)
+#   Chunk    - sync (u8), type 'D' (u8), sequence (u8), sample count (u8), then per sample
+#              varint ms since the previous sample, zig-zag varint raw minus the previous raw
+#
+# Keyframes go out when streaming starts, when the calibration changes and every KEYFRAME_CHUNKS
+# chunks so a receiver can pick the stream up again. The sequence number is shared by both frame
+# types, so a gap shows a lost frame and deltas should be dropped until the next keyframe.
+#
+# Encoding works in a preallocated buffer and allocates nothing per sample.
+
+import struct
+from ticks import ticks_ms, ticks_diff
+
+
+SYNC = 0xA5
+TYPE_KEYFRAME = 0x4B    # 'K'
+TYPE_DELTAS = 0x44      # 'D'
+
+KEYFRAME_FORMAT = '<BBBIiff'
+KEYFRAME_SIZE = struct.calcsize(KEYFRAME_FORMAT)
+CHUNK_HEADER_SIZE = 4
+
+MAX_DT_MS = 0x1FFFFF    # Gaps longer than this are clamped (fits a 3 byte varint)
+
+
+def varint_size(value):
+    if value < 0x80:
+        return 1
+    if value < 0x4000:
+        return 2
+    if value < 0x200000:
+        return 3
+    if value < 0x10000000:
+        return 4
+    return 5
+
+
+class DeltaFramer:
+
+    DEFAULT_CHUNK = 20      # Payload of a notification at the default ATT MTU
+    MIN_CHUNK = 16
+    MAX_CHUNK = 244         # Largest notification payload with data length extension
+    KEYFRAME_CHUNKS = 50
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK, interval_ms=30):
+        # A chunk, then room for a keyframe sent straight after it
+        self.buffer = bytearray(self.MAX_CHUNK + KEYFRAME_SIZE)
+        self.view = memoryview(self.buffer)
+
+        self.enabled = False
+        self.chunk_size = chunk_size
+        self.interval_ms = interval_ms      # Flush period, normally the connection interval
+
+        self.tare = 0.0
+        self.scale = 1.0
+
+        self.sequence = 0
+        self.count = 0              # Samples in the open chunk
+        self.end = CHUNK_HEADER_SIZE    # Bytes used in the buffer
+        self.closed = False         # Buffer holds finished frames waiting for flush()
+        self.key_pending = True
+        self.chunks_since_key = 0
+
+        # A sample that didn't fit the closed chunk, written to the next one by flush()
+        self.carry = False
+        self.carry_dt = 0
+        self.carry_delta = 0
+
+        self.last_raw = 0
+        self.last_time = 0
+        self.last_flush = ticks_ms()
+
+    def enable(self, chunk_size):
+        self.chunk_size = max(self.MIN_CHUNK, min(chunk_size, self.MAX_CHUNK))
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.reset()
+        self.enabled = False
+
+    def reset(self):
+        self.count = 0
+        self.end = CHUNK_HEADER_SIZE
+        self.closed = False
+        self.carry = False
+        self.key_pending = True
+
+    def set_interval(self, interval_ms):
+        self.interval_ms = interval_ms
+
+    # Calibration the receiver applies. A change is sent in a new keyframe
+    def set_calibration(self, tare, scale):
+        if tare != self.tare or scale != self.scale:
+            self.tare = tare
+            self.scale = scale
+            self.key_pending = True
+
+    # Add a sample. Value is unused (calibration happens on the receiving side) but keeps the
+    # SampleFramer interface. Returns True when there is data to send, which must be flushed before
+    # the next add.
+    def add(self, raw, value):
+        now = ticks_ms()
+        self.write_carry()
+
+        if self.key_pending:
+            # Close the open chunk, the keyframe follows it in the same write
+            self.close_chunk()
+            struct.pack_into(KEYFRAME_FORMAT, self.buffer, self.end, SYNC, TYPE_KEYFRAME, self.sequence, now, raw, self.tare, self.scale)
+            self.sequence = (self.sequence + 1) & 0xFF
+            self.end += KEYFRAME_SIZE
+            self.closed = True
+            self.key_pending = False
+            self.chunks_since_key = 0
+            self.last_raw = raw
+            self.last_time = now
+            return True
+
+        dt = ticks_diff(now, self.last_time)
+        if dt > MAX_DT_MS:
+            dt = MAX_DT_MS
+        delta = raw - self.last_raw
+        if delta >= 0:
+            delta = delta << 1
+        else:
+            delta = ((-delta) << 1) - 1
+        self.last_raw = raw
+        self.last_time = now
+
+        if self.end + varint_size(dt) + varint_size(delta) > self.chunk_size or self.count == 255:
+            # Chunk is full, this sample starts the next one
+            self.close_chunk()
+            self.carry = True
+            self.carry_dt = dt
+            self.carry_delta = delta
+            return True
+
+        self.write_sample(dt, delta)
+        return False
+
+    # Start a new chunk with the sample left over from the last one. Only once the buffer has been
+    # flushed, the caller may still be sending the previous view until then.
+    def write_carry(self):
+        if self.carry and not self.closed:
+            self.carry = False
+            self.write_sample(self.carry_dt, self.carry_delta)
+
+    def write_sample(self, dt, delta):
+        end = self.write_varint(self.end, dt)
+        self.end = self.write_varint(end, delta)
+        self.count += 1
+
+    def write_varint(self, offset, value):
+        buffer = self.buffer
+        while value > 0x7F:
+            buffer[offset] = (value & 0x7F) | 0x80
+            value >>= 7
+            offset += 1
+        buffer[offset] = value
+        return offset + 1
+
+    # Finish the open chunk's header. The buffer then holds only finished frames
+    def close_chunk(self):
+        if self.closed:
+            return
+        if self.count == 0:
+            self.end = 0
+        else:
+            buffer = self.buffer
+            buffer[0] = SYNC
+            buffer[1] = TYPE_DELTAS
+            buffer[2] = self.sequence
+            buffer[3] = self.count
+            self.sequence = (self.sequence + 1) & 0xFF
+            self.chunks_since_key += 1
+            if self.chunks_since_key >= self.KEYFRAME_CHUNKS:
+                self.key_pending = True
+        self.closed = True
+
+    # Check if a partial chunk has waited a full interval
+    def is_due(self):
+        return (self.count > 0 or self.closed or self.carry) and ticks_diff(ticks_ms(), self.last_flush) >= self.interval_ms
+
+    # Finalize the open chunk. Returns a view of the frames to send, or None if there is nothing
+    def flush(self):
+        self.last_flush = ticks_ms()
+        self.write_carry()
+        self.close_chunk()
+        end = self.end
+
+        self.count = 0
+        self.end = CHUNK_HEADER_SIZE
+        self.closed = False
+
+        if end == 0:
+            return None
+        return self.view[:end]
+
+
+# Receiving side, for the app and for testing. feed() takes stream bytes and returns the decoded
+# samples as (time ms, raw, value) tuples. Unknown bytes are skipped.
+class DeltaDecoder:
+
+    def __init__(self):
+        self.pending = b''
+        self.synced = False     # Seen a keyframe and no sequence gaps since
+        self.sequence = None
+        self.time = 0
+        self.raw = 0
+        self.tare = 0.0
+        self.scale = 1.0
+        self.lost = 0           # Frames missing from the sequence
+
+    def value(self, raw):
+        return (raw - self.tare)*self.scale
+
+    def read_varint(self, data, offset):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, offset
+
+    def check_sequence(self, sequence):
+        if self.sequence is not None and sequence != (self.sequence + 1) & 0xFF:
+            self.lost += (sequence - self.sequence - 1) & 0xFF
+            self.synced = False
+        self.sequence = sequence
+
+    # Size of the frame at offset, or None if it isn't complete yet
+    def frame_size(self, data, offset):
+        if len(data) - offset < 2:
+            return None
+        if data[offset + 1] == TYPE_KEYFRAME:
+            return KEYFRAME_SIZE if len(data) - offset >= KEYFRAME_SIZE else None
+        if len(data) - offset < CHUNK_HEADER_SIZE:
+            return None
+        end = offset + CHUNK_HEADER_SIZE
+        try:
+            for i in range(2*data[offset + 3]):
+                end = self.read_varint(data, end)[1]
+        except IndexError:
+            return None
+        return end - offset
+
+    # Decode one frame starting at offset. Returns the samples it holds
+    def decode_frame(self, data, offset):
+        samples = []
+        if data[offset + 1] == TYPE_KEYFRAME:
+            sync, kind, sequence, self.time, self.raw, self.tare, self.scale = struct.unpack_from(KEYFRAME_FORMAT, data, offset)
+            self.check_sequence(sequence)
+            self.synced = True
+            samples.append((self.time, self.raw, self.value(self.raw)))
+            return samples
+
+        self.check_sequence(data[offset + 2])
+        end = offset + CHUNK_HEADER_SIZE
+        for i in range(data[offset + 3]):
+            dt, end = self.read_varint(data, end)
+            delta, end = self.read_varint(data, end)
+            if delta & 1:
+                delta = -((delta + 1) >> 1)
+            else:
+                delta >>= 1
+            self.time += dt
+            self.raw += delta
+            if self.synced:
+                samples.append((self.time, self.raw, self.value(self.raw)))
+        return samples
+
+    def feed(self, data):
+        data = self.pending + bytes(data)
+        samples = []
+        i = 0
+        while i < len(data):
+            if data[i] != SYNC or (i + 1 < len(data) and data[i + 1] not in (TYPE_KEYFRAME, TYPE_DELTAS)):
+                i += 1
+                continue
+            size = self.frame_size(data, i)
+            if size is None:
+                break
+            samples += self.decode_frame(data, i)
+            i += size
+        self.pending = data[i:]
+        return samples
@@ -0,0 +1,216 @@
+# feedback.py
+#
+# Load driven motor feedback modes
+#
+# FeedbackEngine owns the feedback mode and the rep tracking state, and turns each filtered
+# sample into motor commands. States are small ints and the active band is looked up in a
+# threshold table built when the bounds change. Motor commands are edge triggered: a state's
+# entry actions run once on the transition into it, the only per sample motor call is the power
+# tracking while resting (and the proportional power of range mode).
+#
+# Time is passed in (ticks ms) so the engine can be driven off device by tests and benchmarks.
+
+from array import array
+
+from ticks import ticks_diff
+from logger import log
+
+
+# Feedback modes
+MODE_OFF = 0
+MODE_RANGE = 1          # Power proportional to load
+MODE_RANGE_PULSE = 2    # Fixed pulse pattern at full power
+MODE_CUSTOM = 3         # Rep tracking with goal bands
+
+# Custom mode states
+STATE_NONE = 0          # No state yet, the next update enters one
+STATE_RESTING = 1
+STATE_STARTING = 2
+STATE_ACTIVE_LOWER = 3
+STATE_ACTIVE_PERFECT = 4
+STATE_ACTIVE_UPPER = 5
+STATE_FAILED = 6
+STATE_UNKNOWN = 7
+
+STATE_NAMES = ('none', 'resting', 'starting', 'active_lower', 'perfect', 'active_upper', 'failed', 'unknown')
+
+# Entry actions per state: (pulse on s, pulse off s, power). None leaves that setting alone.
+# A pulse of (1.0, 0.0) is always on, (0.0, 1.0) is off.
+STATE_ACTIONS = (
+    (None, None, None),     # NONE
+    (1.0, 0.0, None),       # RESTING - power tracks the load, see update()
+    (0.0, 1.0, None),       # STARTING - quiet while the rep start is indicated
+    (1.0, 0.0, 1.0),        # ACTIVE_LOWER
+    (0.05, 0.05, 0.0),      # ACTIVE_PERFECT
+    (None, None, 1.0),      # ACTIVE_UPPER
+    (0.1, 0.05, 1.0),       # FAILED
+    (None, None, 0.0),      # UNKNOWN
+)
+
+
+class FeedbackEngine:
+
+    START_INDICATION_MS = 600   # Time from rep start before the goal bands apply
+    REST_LEVEL = 5.0            # Load below which a rep is over
+    REST_POWER_FLOOR = 4.0      # Load below which the motor stays silent while resting
+
+    def __init__(self, motor, sequencer=None):
+        self.motor = motor
+        self.sequencer = sequencer      # Motor pattern player, stopped whenever a feedback mode takes over
+        self.mode = MODE_OFF
+        self.state = STATE_NONE
+
+        # Custom mode bounds
+        self.lower = 0.0
+        self.goal_lower = 0.0
+        self.goal_upper = 0.0
+        self.upper = 0.0
+        self.goal = 0.0
+
+        # Range mode full scale load
+        self.range = 0.0
+
+        # Active band table, rebuilt when the bounds change: loads below band_limits[i] are band_states[i]
+        self.band_limits = array('f', [0.0, 0.0])
+        self.band_states = bytes((STATE_ACTIVE_LOWER, STATE_ACTIVE_PERFECT, STATE_ACTIVE_UPPER))
+
+        # Rep tracking
+        self.rep_started = False
+        self.indication_finished = False
+        self.rep_start_time = 0
+
+        self.transitions = 0
+
+    # --- MODES ---
+
+    # Stop all feedback and turn the motor off
+    def clear(self):
+        self.stop_sequence()
+        self.mode = MODE_OFF
+        self.state = STATE_NONE
+        self.motor.motorOff()
+
+    def stop_sequence(self):
+        if self.sequencer is not None:
+            self.sequencer.stop()
+
+    def set_range(self, full_scale, pulse_on=None, pulse_off=None):
+        if full_scale <= 0:
+            raise ValueError('Range must be positive')
+        self.clear()
+        self.range = full_scale
+        if pulse_on is None:
+            self.mode = MODE_RANGE
+            self.motor.motorOn()
+        else:
+            self.mode = MODE_RANGE_PULSE
+            self.motor.setPower(1.0)
+            self.motor.setPulse(pulse_on, pulse_off)
+
+    def set_custom(self, lower, goal_lower, goal_upper, upper, goal):
+        self.clear()
+        self.lower = lower
+        self.goal_lower = goal_lower
+        self.goal_upper = goal_upper
+        self.upper = upper
+        self.goal = goal
+        self.build_table()
+        self.enter_custom()
+        self.motor.motorOn()
+
+    # Lower bounds only (the rest keep their values)
+    def set_custom_lower(self, lower, goal_lower):
+        self.clear()
+        self.lower = lower
+        self.goal_lower = goal_lower
+        self.build_table()
+        self.enter_custom()
+
+    # Upper bounds and goal only, without clearing the current mode
+    def set_custom_upper(self, goal_upper, upper, goal):
+        self.goal_upper = goal_upper
+        self.upper = upper
+        self.goal = goal
+        self.build_table()
+        self.enter_custom()
+        self.motor.motorOn()
+
+    # Pick custom feedback back up with the current bounds
+    def resume(self):
+        self.enter_custom()
+
+    def enter_custom(self):
+        self.stop_sequence()
+        self.mode = MODE_CUSTOM
+        self.state = STATE_NONE     # Forces the entry actions on the next update
+
+    def build_table(self):
+        self.band_limits[0] = self.goal_lower
+        self.band_limits[1] = self.goal_upper
+
+    # --- UPDATE ---
+
+    # Feed one filtered sample taken at now (ticks ms)
+    def update(self, val, now):
+        mode = self.mode
+        if mode == MODE_CUSTOM:
+            self.track_rep(val, now)
+            state = self.classify(val)
+            if state != self.state:
+                self.enter(state)
+            if state == STATE_RESTING:
+                if val < self.REST_POWER_FLOOR or self.goal <= 0:
+                    self.motor.setPower(0)
+                else:
+                    self.motor.setPower(val/self.goal)
+        elif mode == MODE_RANGE:
+            self.motor.setPower(val/self.range)
+
+    # Rep start/end detection
+    def track_rep(self, val, now):
+        if not self.rep_started:
+            if val >= self.goal:
+                self.rep_started = True
+                self.rep_start_time = now
+                log.info('REP STARTED')
+            elif val < self.REST_LEVEL:
+                self.indication_finished = False
+        elif (not self.indication_finished) and val > self.lower and ticks_diff(now, self.rep_start_time) >= self.START_INDICATION_MS:
+            self.indication_finished = True
+            log.info('INDICATION FINISHED %d', ticks_diff(now, self.rep_start_time))
+        elif val < self.REST_LEVEL:
+            self.indication_finished = False
+            self.rep_started = False
+
+    def classify(self, val):
+        if val < self.lower or (val < self.goal and not self.rep_started):
+            return STATE_RESTING
+        if not self.indication_finished:
+            if self.rep_started:
+                return STATE_STARTING
+            return STATE_UNKNOWN
+
+        limits = self.band_limits
+        if val < limits[0]:
+            return self.band_states[0]
+        if val < limits[1]:
+            return self.band_states[1]
+        return self.band_states[2]
+
+    def enter(self, state):
+        if __debug__ and log.debugging:
+            log.debug('MOTOR STATE: %s -> %s', STATE_NAMES[self.state], STATE_NAMES[state])
+
+        self.state = state
+        self.transitions += 1
+
+        pulse_on, pulse_off, power = STATE_ACTIONS[state]
+        if pulse_on is not None:
+            if pulse_on == 0.0:
+                self.motor.motorOff()
+            elif pulse_off == 0.0:
+                self.motor.motorOn()
+            else:
+                self.motor.setPulse(pulse_on, pulse_off)
+        if power is not None:
+            self.motor.setPower(power)
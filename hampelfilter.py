@@ -0,0 +1,124 @@
+# hampelfilter.py
+#
+# Streaming Hampel filter (rolling median outlier rejection) for raw HX711 counts
+#
+# The last `window` samples are kept twice: in arrival order (to know what to evict) and sorted
+# (to read the median). Each sample does one evict and one insert by binary search plus a shift,
+# so nothing is re-sorted. The median absolute deviation comes from a two pointer walk outwards
+# from the median of the sorted window.
+
+from array import array
+
+
+class HampelFilter:
+
+    MAD_SCALE = 1.4826      # MAD to standard deviation for normally distributed noise
+    MAX_WINDOW = 31         # Two arrays of this many longs per filter, and the insert shift is O(window)
+
+    def __init__(self, window=7, threshold=3.0, min_deviation=16):
+        self.threshold = threshold
+        self.min_deviation = min_deviation      # Never reject within this many counts of the median (flat signals have MAD 0)
+        self.rejected = 0
+        self.set_window(window)
+
+    # Window in samples, below 3 disables. Raises ValueError above MAX_WINDOW, before allocating anything
+    def set_window(self, window):
+        if window > self.MAX_WINDOW:
+            raise ValueError(f'Outlier window must be at most {self.MAX_WINDOW}')
+        self.window = max(window, 0)
+        self.arrival = array('l', [0]*max(self.window, 1))
+        self.ordered = array('l', [0]*max(self.window, 1))
+        self.head = 0
+        self.count = 0
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+
+    def enabled(self):
+        return self.window >= 3
+
+    def reset(self):
+        self.head = 0
+        self.count = 0
+
+    # Index of the first element in ordered[0:count] that is >= value
+    def _lower_bound(self, value, count):
+        ordered = self.ordered
+        lo = 0
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if ordered[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _median(self):
+        n = self.count
+        if n & 1:
+            return self.ordered[n >> 1]
+        return (self.ordered[(n >> 1) - 1] + self.ordered[n >> 1]) >> 1
+
+    # Median absolute deviation around median m - the k-th smallest of |x - m| merged from both sides
+    def _mad(self, m):
+        ordered = self.ordered
+        n = self.count
+        left = self._lower_bound(m, n) - 1  # Walks down through values below m
+        right = left + 1                    # Walks up through values at or above m
+        dev = 0
+        for k in range(n//2 + 1):
+            if left < 0:
+                dev = ordered[right] - m
+                right += 1
+            elif right >= n:
+                dev = m - ordered[left]
+                left -= 1
+            elif m - ordered[left] < ordered[right] - m:
+                dev = m - ordered[left]
+                left -= 1
+            else:
+                dev = ordered[right] - m
+                right += 1
+        return dev
+
+    def _insert(self, value):
+        ordered = self.ordered
+        count = self.count
+
+        if count == self.window:
+            # Evict the oldest sample from the sorted window
+            old = self.arrival[self.head]
+            i = self._lower_bound(old, count)
+            while i < count - 1:
+                ordered[i] = ordered[i+1]
+                i += 1
+            count -= 1
+
+        # Shift larger values up and drop the new one in place
+        i = count
+        while i > 0 and ordered[i-1] > value:
+            ordered[i] = ordered[i-1]
+            i -= 1
+        ordered[i] = value
+
+        self.arrival[self.head] = value
+        self.head = (self.head + 1) % self.window
+        self.count = count + 1
+
+    # Filter one sample. Outliers are replaced by the window median. Every sample enters the window,
+    # so a genuine step change is followed once it makes up half the window.
+    def filter(self, value):
+        if self.window < 3:
+            return value
+
+        result = value
+        if self.count == self.window:
+            m = self._median()
+            deviation = abs(value - m)
+            if deviation > self.min_deviation and deviation > self.threshold*self.MAD_SCALE*self._mad(m):
+                self.rejected += 1
+                result = m
+
+        self._insert(value)
+        return result
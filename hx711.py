@@ -3,183 +3,400 @@
 #   Module for heading HX711 load cell amplifier
 
 
-import time
 import digitalio
+from array import array
+
+from ticks import ticks_ms, ticks_diff, ticks_add
+
+
+# Raised when the HX711 doesn't signal a finished conversion before the deadline
+class HX711TimeoutError(RuntimeError):
+    pass
 
 
 class HX711:
 
-    def __init__(self, dout, pd_sck, gain=128) -> None:
+    def __init__(self, dout, pd_sck, gain=128, rate=80, timeout=0.1) -> None:
         self.pd_sck = pd_sck
         self.dout = dout
 
         self.pd_sck.switch_to_output()
         self.dout.switch_to_input(pull=digitalio.Pull.UP)
+        self.channels = 1
+
+        self.set_gain(gain)
+
+        self.lastVal = 0
 
+        # Conversion timing and fault tracking. Kept in integer ms ticks so the read path doesn't allocate
+        self.rate = rate                    # Set by the RATE pin on the amplifier board (10 or 80 SPS)
+        self.timeout = timeout              # No conversion for this long means the amplifier is dead
+        self.timeout_ms = int(timeout*1000)
+        self.fault = False
+        self.missed_conversions = 0         # Conversion periods that passed without a read
+        self.late_conversions = 0           # Reads that came more than 1.5 periods after the previous one
+
+        # Preallocated scratch space for read_median
+        self.MEDIAN_MAX = 9
+        self.medianScratch = array('l', [0]*self.MEDIAN_MAX)
+
+        # No start up delay. After power up the output takes 4 conversion periods to settle (50ms at
+        # 80 SPS, 400ms at 10 SPS), so the fault timeout runs from the end of that instead, and
+        # wait_ready() polls through it for the first conversion
+        now = ticks_ms()
+        self.settle_ms = 4000//rate
+        self.lastReadyTime = ticks_add(now, self.settle_ms)
+        self.lastPollTime = now
+
+
+    # Channel A at gain 128 or 64, or channel B (gain 32). Takes effect from the conversion after the next read
+    def set_gain(self, gain):
         if (gain == 128):
             self.GAIN = 1
         elif (gain == 64):
             self.GAIN = 3
         elif (gain == 32):
             self.GAIN = 2
+        else:
+            raise ValueError('HX711 gain must be 128, 64 or 32')
 
+    def is_ready(self):
+        return self.dout.value  == 0
 
-        self.lastVal = 0
+    # Non-blocking read. Returns None if no conversion is ready yet
+    def try_read(self):
+        if self.dout.value:
+            self.check_timeout(ticks_ms())
+            return None
+
+        return self.read_long()
+
+    # Flag a fault if the amplifier hasn't produced a conversion within the timeout (now in ticks_ms)
+    def check_timeout(self, now):
+        # If nobody polled us for a while the gap isn't the amplifier's fault, restart the watchdog
+        # (unless it's still settling after power up)
+        if (ticks_diff(now, self.lastPollTime) > self.timeout_ms) and (ticks_diff(now, self.lastReadyTime) > 0):
+            self.lastReadyTime = now
+        self.lastPollTime = now
+
+        if (not self.fault) and (ticks_diff(now, self.lastReadyTime) > self.timeout_ms):
+            self.fault = True
+
+        return self.fault
+
+    # Tick wait_ready() gives up at: timeout from now, or from the end of settling right after power up
+    def ready_deadline(self, timeout):
+        if timeout is None:
+            timeout_ms = self.timeout_ms
+        else:
+            timeout_ms = int(timeout*1000)
+
+        start = ticks_ms()
+        self.check_timeout(start)
+        if ticks_diff(self.lastReadyTime, start) > 0:
+            start = self.lastReadyTime
+        return ticks_add(start, timeout_ms)
+
+    # Block until a conversion is ready, or raise HX711TimeoutError after timeout seconds
+    def wait_ready(self, timeout=None):
+        deadline = self.ready_deadline(timeout)
+
+        while self.dout.value:
+            if ticks_diff(ticks_ms(), deadline) > 0:
+                self.fault = True
+                raise HX711TimeoutError("HX711 conversion timed out")
+
+    # Update missed/late conversion counters after a conversion has been read
+    def record_conversion(self):
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self.lastReadyTime)
+
+        if (2*elapsed*self.rate > 3000):
+            self.late_conversions += 1
+            self.missed_conversions += elapsed*self.rate//1000 - 1
+
+        self.lastReadyTime = now
+        self.lastPollTime = now
+        self.fault = False
+
+    def reset_stats(self):
+        self.missed_conversions = 0
+        self.late_conversions = 0
+
+    # Read one conversion. This is the hot path, so it is fully unrolled and allocation free:
+    # pins are cached in locals, bits are OR'd straight into place and the sign is fixed in place.
+    def read_long(self):
+        self.wait_ready()
 
-        time.sleep(1)
+        sck = self.pd_sck
+        dout = self.dout
+        value = 0
 
+        # Clock HX711 Digital Serial Clock (PD_SCK), sampling DOUT after the falling edge. MSB first.
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x800000
 
-    def convertFromTwosComplement24bit(self, inputValue):
-        return -(inputValue & 0x800000) + (inputValue & 0x7fffff)
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x400000
 
-    def is_ready(self):
-        return self.dout.value  == 0
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x200000
 
-    def readNextBit(self):
-       # Clock HX711 Digital Serial Clock (PD_SCK).  DOUT will be
-       # ready 1us after PD_SCK rising edge, so we sample after
-       # lowering PD_SCL, when we know DOUT will be stable.
-       self.pd_sck.value = True
-       self.pd_sck.value = False
-       value = self.dout.value
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x100000
 
-       # Convert Boolean to int and return it.
-       return int(value)
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x080000
 
-    def readNextByte(self):
-        byteValue = 0
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x040000
 
-       # Read bits and build the byte from top, or bottom, depending
-       # on whether we are in MSB or LSB bit mode.
-        for x in range(8):
-            byteValue <<= 1
-            byteValue |= self.readNextBit()
-        return byteValue
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x020000
 
-    # Optimized version of byte read loop
-    def readNextByteFast(self):
-        byteValue = 0
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x010000
 
-        sck = self.pd_sck
-        dout = self.dout
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x008000
 
-        # Unroll loop
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x004000
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x002000
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x001000
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x000800
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x000400
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x000200
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x000100
 
-        byteValue <<= 1
         sck.value = True
         sck.value = False
-        if (dout.value):
-            byteValue |= 1
+        if dout.value:
+            value |= 0x000080
 
-        return byteValue
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000040
 
-    def readRawBytes(self):
-        # Wait for and get the Read Lock, incase another thread is already
-        # driving the HX711 serial interface.
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000020
 
-        # Wait until HX711 is ready for us to read a sample.
-        while not self.is_ready():
-            pass
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000010
 
-        # Read three bytes of data from the HX711.
-        firstByte  = self.readNextByteFast()
-        secondByte = self.readNextByteFast()
-        thirdByte  = self.readNextByteFast()
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000008
 
-        # HX711 Channel and gain factor are set by number of bits read
-        # after 24 data bits.
-        for i in range(self.GAIN):
-           # Clock a bit out of the HX711 and throw it away.
-           self.pd_sck.value = True
-           self.pd_sck.value = False
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000004
+
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000002
 
-        # Return an orderd list of raw byte values.
-        return [firstByte, secondByte, thirdByte]
+        sck.value = True
+        sck.value = False
+        if dout.value:
+            value |= 0x000001
 
-    def read_long(self):
-        # Get a sample from the HX711 in the form of raw bytes.
-        dataBytes = self.readRawBytes()
+        # HX711 Channel and gain factor are set by number of bits read
+        # after 24 data bits.
+        sck.value = True
+        sck.value = False
+        if (self.GAIN > 1):
+            sck.value = True
+            sck.value = False
+            if (self.GAIN > 2):
+                sck.value = True
+                sck.value = False
 
-        # Join the raw bytes into a single 24bit 2s complement value.
-        twosComplementValue = ((dataBytes[0] << 16) |
-                               (dataBytes[1] << 8)  |
-                               dataBytes[2])
+        self.record_conversion()
 
         # Convert from 24bit twos-complement to a signed value.
-        signedIntValue = self.convertFromTwosComplement24bit(twosComplementValue)
+        if value & 0x800000:
+            value -= 0x1000000
 
         # Record the latest sample value we've read.
-        self.lastVal = signedIntValue
+        self.lastVal = value
 
-        # Return the sample value we've read from the HX711.
-        return int(signedIntValue)
+        return value
 
     # A median-based read method, might help when getting random value spikes
-    # for unknown or CPU-related reasons
+    # for unknown or CPU-related reasons. Sorts in a preallocated scratch array.
     def read_median(self, times=3):
        if times <= 0:
           raise ValueError("HX711::read_median(): times must be greater than zero!")
+       if times > self.MEDIAN_MAX:
+          raise ValueError(f"HX711::read_median(): times must be at most {self.MEDIAN_MAX}")
 
        # If times == 1, just return a single reading.
        if times == 1:
           return self.read_long()
 
-       valueList = []
-
+       # Median of three - sorting network, no scratch needed
+       if times == 3:
+          a = self.read_long()
+          b = self.read_long()
+          c = self.read_long()
+          if a > b:
+             a, b = b, a
+          if b > c:
+             b, c = c, b
+          if a > b:
+             a, b = b, a
+          return b
+
+       scratch = self.medianScratch
        for x in range(times):
-          valueList += [self.read_long()]
+          scratch[x] = self.read_long()
 
-       valueList.sort()
+       # Insertion sort in place - times is small
+       for i in range(1, times):
+          v = scratch[i]
+          j = i - 1
+          while j >= 0 and scratch[j] > v:
+             scratch[j+1] = scratch[j]
+             j -= 1
+          scratch[j+1] = v
 
        # If times is odd we can just take the centre value.
+       midpoint = times // 2
        if (times & 0x1) == 0x1:
-          return valueList[len(valueList) // 2]
+          return scratch[midpoint]
        else:
           # If times is even we have to take the arithmetic mean of
           # the two middle values.
-          midpoint = len(valueList) / 2
-          return sum(valueList[midpoint:midpoint+2]) / 2.0
+          return (scratch[midpoint-1] + scratch[midpoint]) / 2.0
 
 
     def get_value(self, times=3):
-        return self.read_median(times)
\ No newline at end of file
+        return self.read_median(times)
+
+
+# Several HX711s on one shared PD_SCK, each with its own DOUT. Every clock edge shifts a bit out of
+# all of them, so a sweep of N channels costs the 27 clock pulses of one read plus N pin reads per
+# bit. The amplifiers run off their own oscillators, so a sweep waits until every DOUT shows a
+# finished conversion. Gain and channel selection go out on the shared clock and apply to all.
+class HX711Multi(HX711):
+
+    def __init__(self, douts, pd_sck, gain=128, rate=80, timeout=0.1) -> None:
+        super().__init__(douts[0], pd_sck, gain, rate, timeout)
+        for dout in douts[1:]:
+            dout.switch_to_input(pull=digitalio.Pull.UP)
+        self.douts = douts
+        self.channels = len(douts)
+        self.values = array('l', [0]*self.channels)    # Latest sweep, reused by every read
+
+    def is_ready(self):
+        for dout in self.douts:
+            if dout.value:
+                return False
+        return True
+
+    # Non-blocking read of all channels. Returns the values array, or None until every channel is ready
+    def try_read(self):
+        if not self.is_ready():
+            self.check_timeout(ticks_ms())
+            return None
+
+        return self.read_channels()
+
+    def wait_ready(self, timeout=None):
+        deadline = self.ready_deadline(timeout)
+
+        while not self.is_ready():
+            if ticks_diff(ticks_ms(), deadline) > 0:
+                self.fault = True
+                raise HX711TimeoutError("HX711 conversion timed out")
+
+    # One sweep. Returns the values array (signed counts per channel), valid until the next read
+    def read_channels(self):
+        self.wait_ready()
+
+        sck = self.pd_sck
+        douts = self.douts
+        values = self.values
+        channels = self.channels
+        for i in range(channels):
+            values[i] = 0
+
+        # MSB first, sampling every DOUT after the falling edge
+        bit = 0x800000
+        while bit:
+            sck.value = True
+            sck.value = False
+            for i in range(channels):
+                if douts[i].value:
+                    values[i] |= bit
+            bit >>= 1
+
+        # Gain/channel pulses for the next conversion
+        for i in range(self.GAIN):
+            sck.value = True
+            sck.value = False
+
+        self.record_conversion()
+
+        for i in range(channels):
+            if values[i] & 0x800000:
+                values[i] -= 0x1000000
+        self.lastVal = values[0]
+
+        return values
+
+    def read_long(self):
+        return self.read_channels()[0]
@@ -0,0 +1,94 @@
+# logger.py
+#
+# Levelled logging with an optional in RAM ring of recent events
+#
+# Messages and their arguments are passed separately (log.info('CI: %d', ci)) and only formatted
+# when the level is enabled, so a disabled call costs a compare. Hot path call sites go one step
+# further and are wrapped in `if __debug__ and log.debugging:`, which skips the call (and its
+# argument tuple) with one attribute read, and lets mpy-cross -O compile the line out entirely.
+#
+# Enabled messages go to the console and/or the ring. The ring holds the last ring_size events
+# and is fetched over BLE with the LOG command, so a production build can run with the console
+# off and still keep diagnostics.
+
+from array import array
+
+from ticks import ticks_ms
+
+
+DEBUG = 0
+INFO = 1
+WARNING = 2
+ERROR = 3
+OFF = 4
+
+LEVEL_NAMES = ('D', 'I', 'W', 'E')
+
+
+class Logger:
+
+    def __init__(self, level=INFO, console=True, ring_size=32):
+        self.console = console
+
+        # Ring of recent events, preallocated. Only the text is allocated per event
+        self.ring_size = ring_size
+        self.ring_times = array('L', [0]*ring_size)
+        self.ring_levels = bytearray(ring_size)
+        self.ring_text = [None]*ring_size
+        self.ring_head = 0          # Next slot to write
+        self.ring_count = 0
+
+        self.set_level(level)
+
+    def set_level(self, level):
+        if not (DEBUG <= level <= OFF):
+            raise ValueError('Invalid log level')
+        self.level = level
+        self.debugging = level <= DEBUG
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, *args):
+        if level < self.level:
+            return
+        if args:
+            msg = msg % args
+
+        if self.console:
+            print(msg)
+
+        if self.ring_size:
+            head = self.ring_head
+            self.ring_times[head] = ticks_ms()
+            self.ring_levels[head] = level
+            self.ring_text[head] = msg
+            self.ring_head = (head + 1) % self.ring_size
+            if self.ring_count < self.ring_size:
+                self.ring_count += 1
+
+    def debug(self, msg, *args):
+        if self.debugging:
+            self.log(DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(ERROR, msg, *args)
+
+    # Write the ring oldest first as L:<ms>,<level>,<text> lines, then empty it
+    def dump(self, write):
+        index = (self.ring_head - self.ring_count) % self.ring_size if self.ring_size else 0
+        for i in range(self.ring_count):
+            write(f'L:{self.ring_times[index]},{LEVEL_NAMES[self.ring_levels[index]]},{self.ring_text[index]}\n')
+            self.ring_text[index] = None
+            index = (index + 1) % self.ring_size
+        self.ring_count = 0
+
+
+# Shared by every module
+log = Logger()
@@ -1,6 +1,11 @@
 # motormanager.py
 #
 # Vibration Motor Manager for Power and Pulse Patterns
+#
+# The PWM duty cycle is only written when it actually changes. Each update works out when the
+# output next changes (end of the on or off phase) and later updates return straight away until
+# then, or until the power or pattern is changed. The main loop runs update() only when there's
+# work: it sleeps the motor task until next_event_time(), and onChange wakes it for a change.
 
 import board
 import time
@@ -13,6 +18,7 @@ class MotorManager:
 
         # Set up motor control
         self.motor = pwmio.PWMOut(board.D13, frequency=5000, duty_cycle=0)
+        self.duty = 0       # Last duty cycle written
 
         # Timers
         self.onTime = 0.0
@@ -21,7 +27,11 @@ class MotorManager:
         self.onInterval = 0.0
         self.offInterval = 0.0
 
+        self.nextEvent = None   # Monotonic time the output next needs updating, None when idle
+        self.onChange = None    # Called when a change needs an update before nextEvent (wakes the motor task)
+
         self.POWER_CUTOFF = 0.2    # Threshold at which to turn motor off to avoid low loads that won't spin it anyhow
+        self.MAX_PULSE = 60.0      # Longest on or off time in seconds. Keeps event times finite
 
         self.updateTimeRef = time.monotonic()
 
@@ -30,40 +40,83 @@ class MotorManager:
 
 
     def update(self):
-        if (self.onInterval != 0.0):
-            if (time.monotonic() < self.onTime):
-                # To avoid loading the motor at low values, trim duty cycles below threshld
-                if (self.powerLevel > self.POWER_CUTOFF):
-                    self.motor.duty_cycle = int(self.powerLevel*65535.0)
-                else:
-                    self.motor.duty_cycle = 0
-
-            elif (time.monotonic() < self.offTime):
-                self.motor.duty_cycle = 0
+        if self.nextEvent is None:
+            return
+        now = time.monotonic()
+        if now < self.nextEvent:
+            return
+
+        if (self.onInterval == 0.0):
+            self.nextEvent = None
+            return
+
+        if (now >= self.offTime):
+            # Start the next cycle
+            self.onTime = now+self.onInterval
+            self.offTime = self.onTime+self.offInterval
+
+        if (now < self.onTime):
+            # To avoid loading the motor at low values, trim duty cycles below threshld
+            if (self.powerLevel > self.POWER_CUTOFF):
+                self.setDuty(int(self.powerLevel*65535.0))
             else:
-                self.onTime = time.monotonic()+self.onInterval
-                self.offTime = self.onTime+self.offInterval
-
-        pass
+                self.setDuty(0)
+            self.nextEvent = self.onTime
+        else:
+            self.setDuty(0)
+            self.nextEvent = self.offTime
+
+    # Apply a change on the next update, and get that update run
+    def changed(self):
+        self.nextEvent = 0.0
+        if self.onChange is not None:
+            self.onChange()
+
+    # Monotonic time the next update has work to do, None if the output is steady
+    def next_event_time(self):
+        return self.nextEvent
+
+    def setDuty(self,duty):
+        if (duty != self.duty):
+            self.motor.duty_cycle = duty
+            self.duty = duty
 
     def setPower(self,power):
         power = min(power,1.0)
         power = max(power,0.0)
-        self.powerLevel = power
+        if (power != self.powerLevel):
+            self.powerLevel = power
+            self.changed()
+
+    # Level from the pattern sequencer: 0-100 %, None when the pattern ends
+    def setLevel(self,level):
+        if level is None:
+            self.motorOff()
+        else:
+            self.setPower(level/100.0)
 
     def motorOn(self):
         self.setPulse(1.0,0.0)  # Always on
 
     def motorOff(self):
-        self.motor.duty_cycle = 0   # Stop motor right away
+        self.setDuty(0)   # Stop motor right away
         self.setPulse(0.0,1.0) # Always off
 
+    # On/off times in seconds, 0 to MAX_PULSE (0 on is always off, 0 off is always on). NaN fails both compares
+    def checkPulse(self,onTime,offTime):
+        if not (0.0 <= onTime <= self.MAX_PULSE and 0.0 <= offTime <= self.MAX_PULSE):
+            raise ValueError(f'Pulse times must be 0 to {self.MAX_PULSE}s')
+
     def setPulse(self,onTime,offTime):
+        self.checkPulse(onTime,offTime)
         self.onInterval = onTime
         self.offInterval = offTime
         self.onTime = time.monotonic()+self.onInterval
         self.offTime = self.onTime+self.offInterval
+        self.changed()
 
     def updatePulse(self,onTime,offTime):
+        self.checkPulse(onTime,offTime)
         self.onInterval = onTime
         self.offInterval = offTime
+        self.changed()
@@ -0,0 +1,140 @@
+# perfstats.py
+#
+# Lightweight hot path instrumentation for the main loop phases
+#
+# Each phase keeps a call count, total and peak time in preallocated arrays, so timing a phase
+# only costs two clock reads. Timing is off until STATS1 turns it on: monotonic_ns() returns a
+# long int, which allocates on the device, so it is a diagnostic mode rather than always running.
+# While off, start() and stop() return without reading the clock. Sensor polls that find no
+# conversion ready (wait) are only counted, never timed.
+# The STATS command dumps everything as one compact frame:
+#   Text    - S:<free heap>,<missed>,<late>,<rejected>,<suppressed>|<count>,<mean us>,<peak us>|...\n
+#   Binary  - sync (u8), type 'I' (u8), free heap, missed, late, rejected, suppressed (u32 each),
+#             phase count (u8), then count, mean us, peak us (u32 each) per phase
+#
+# BootTimer records start up milestones in ms since it was made (the first thing code.py does).
+# The BOOT command sends them as B:<name>:<ms>,<name>:<ms>,...\n
+
+import gc
+import struct
+import time
+from array import array
+
+from ticks import ticks_ms, ticks_diff
+
+
+PHASE_WAIT = 0          # Sensor polls that found no conversion ready
+PHASE_READ = 1          # Clocking a conversion out of the HX711
+PHASE_FILTER = 2        # Outlier rejection, EMA and history
+PHASE_TX = 3            # Sample output (UART write / framing)
+PHASE_COMMAND = 4       # Command RX, parsing and handling
+PHASE_MOTOR = 5         # Motor feedback and PWM update
+PHASE_PIXEL = 6         # NeoPixel update
+PHASE_REPS = 7          # Rep analysis
+
+PHASE_NAMES = ('wait', 'read', 'filter', 'tx', 'command', 'motor', 'pixel', 'reps')
+PHASE_COUNT = len(PHASE_NAMES)
+
+TOTAL_LIMIT = 0xFFFFFFFF
+
+
+class PerfStats:
+
+    SYNC = 0xA5
+    TYPE_STATS = 0x49   # 'I'
+
+    HEADER_FORMAT = '<BBIIIIIB'
+    PHASE_FORMAT = '<III'
+
+    def __init__(self):
+        self.count = array('L', [0]*PHASE_COUNT)
+        self.total_us = array('L', [0]*PHASE_COUNT)
+        self.peak_us = array('L', [0]*PHASE_COUNT)
+
+        self.header_size = struct.calcsize(self.HEADER_FORMAT)
+        self.phase_size = struct.calcsize(self.PHASE_FORMAT)
+        self.buffer = bytearray(self.header_size + PHASE_COUNT*self.phase_size)
+
+        self.enabled = False
+
+    def start(self):
+        if not self.enabled:
+            return 0
+        return time.monotonic_ns()
+
+    # Record the time since start against a phase. Phases started while timing was off are skipped
+    def stop(self, phase, start):
+        if not self.enabled or not start:
+            return
+        us = (time.monotonic_ns() - start)//1000
+
+        # Halve the history rather than overflow, which keeps the mean meaningful
+        if self.total_us[phase] > TOTAL_LIMIT - us:
+            self.total_us[phase] >>= 1
+            self.count[phase] >>= 1
+
+        self.count[phase] += 1
+        self.total_us[phase] += us
+        if us > self.peak_us[phase]:
+            self.peak_us[phase] = us
+
+    # Count a phase without timing it
+    def tally(self, phase):
+        if self.enabled:
+            self.count[phase] += 1
+
+    def reset(self):
+        for i in range(PHASE_COUNT):
+            self.count[i] = 0
+            self.total_us[i] = 0
+            self.peak_us[i] = 0
+
+    def mean_us(self, phase):
+        if self.count[phase] == 0:
+            return 0
+        return self.total_us[phase]//self.count[phase]
+
+    def free_heap(self):
+        try:
+            return gc.mem_free()
+        except AttributeError:
+            return 0        # Not available off device
+
+    # missed/late conversions, rejected readings and suppressed (unsent) samples come from their owners
+    def format_text(self, missed, late, rejected, suppressed):
+        parts = [f'S:{self.free_heap()},{missed},{late},{rejected},{suppressed}']
+        for i in range(PHASE_COUNT):
+            parts.append(f'{self.count[i]},{self.mean_us(i)},{self.peak_us[i]}')
+        return '|'.join(parts) + '\n'
+
+    def pack(self, missed, late, rejected, suppressed):
+        struct.pack_into(self.HEADER_FORMAT, self.buffer, 0, self.SYNC, self.TYPE_STATS, self.free_heap(),
+                         missed, late, rejected, suppressed, PHASE_COUNT)
+        offset = self.header_size
+        for i in range(PHASE_COUNT):
+            struct.pack_into(self.PHASE_FORMAT, self.buffer, offset, self.count[i], self.mean_us(i), self.peak_us[i])
+            offset += self.phase_size
+        return self.buffer
+
+
+class BootTimer:
+
+    def __init__(self):
+        self.start = ticks_ms()
+        self.names = []
+        self.times = []
+
+    # Record a milestone. Only the first time counts, so it can be called again on later connects
+    def mark(self, name):
+        if name not in self.names:
+            self.names.append(name)
+            self.times.append(ticks_diff(ticks_ms(), self.start))
+
+    # ms to a milestone, None if it hasn't happened
+    def get(self, name):
+        if name not in self.names:
+            return None
+        return self.times[self.names.index(name)]
+
+    def format_text(self):
+        return 'B:' + ','.join(f'{self.names[i]}:{self.times[i]}' for i in range(len(self.names))) + '\n'
@@ -1,17 +1,24 @@
 # pixelflasher.py
 #
 # NeoPixel Manager for State/Blinking Patterns
+#
+# With auto_write every fill is a full NeoPixel transfer, so the pixel is only written when its
+# colour changes, and updates between flash edges return without touching it. The pixel task
+# sleeps until next_event_time(), and onChange wakes it when the state or level changes.
 
 import neopixel
 import board
 import time
 
+OFF = (0,0,0)
+
 class PixelFlasher:
 
     def __init__(self):
         self.pixel = neopixel.NeoPixel(board.NEOPIXEL, 1, brightness=0.2, auto_write=True)
-        self.currentColor = (0,0,0)
-        self.pixel.fill(self.currentColor)
+        self.currentColor = OFF
+        self.shownColor = OFF   # Last colour written to the pixel
+        self.pixel.fill(self.shownColor)
 
         self.onTime = 0.0
         self.offTime = 0.0
@@ -19,21 +26,65 @@ class PixelFlasher:
         self.onInterval = 0.0
         self.offInterval = 0.0
 
+        self.nextEvent = None   # Monotonic time the pixel next needs updating, None when idle
+        self.onChange = None    # Called when a change needs an update before nextEvent (wakes the pixel task)
+        self.levelColor = None  # Colour set by the pattern sequencer, overrides the flash pattern while set
+
         self.updateTimeRef = time.monotonic()
 
         pass
 
     def update(self):
-        if (self.onInterval != 0.0):
-            if (time.monotonic() < self.onTime):
-                self.pixel.fill(self.currentColor)
-            elif (time.monotonic() < self.offTime):
-                self.pixel.fill((0,0,0))
-            else:
-                self.onTime = time.monotonic()+self.onInterval
-                self.offTime = self.onTime+self.offInterval
+        if self.nextEvent is None:
+            return
+        now = time.monotonic()
+        if now < self.nextEvent:
+            return
 
-        pass
+        if (self.levelColor is not None):
+            self.show(self.levelColor)
+            self.nextEvent = None
+            return
+
+        if (self.onInterval == 0.0):
+            self.nextEvent = None
+            return
+
+        if (now >= self.offTime):
+            # Start the next flash
+            self.onTime = now+self.onInterval
+            self.offTime = self.onTime+self.offInterval
+
+        if (now < self.onTime):
+            self.show(self.currentColor)
+            self.nextEvent = self.onTime
+        else:
+            self.show(OFF)
+            self.nextEvent = self.offTime
+
+    # Apply a change on the next update, and get that update run
+    def changed(self):
+        self.nextEvent = 0.0
+        if self.onChange is not None:
+            self.onChange()
+
+    # Monotonic time the next update has work to do, None if the pixel is steady
+    def next_event_time(self):
+        return self.nextEvent
+
+    def show(self,color):
+        if (color != self.shownColor):
+            self.pixel.fill(color)
+            self.shownColor = color
+
+    # Level from the pattern sequencer: 0-100 % of the state colour, None to go back to flashing
+    def setLevel(self,level):
+        if level is None:
+            self.levelColor = None
+            self.setFlash(self.currentColor,self.onInterval,self.offInterval)
+        else:
+            self.levelColor = (self.currentColor[0]*level//100,self.currentColor[1]*level//100,self.currentColor[2]*level//100)
+            self.changed()
 
     def setDisconnectedState(self):
         self.setFlash((0,0,127),0.25,0.5)
@@ -44,9 +95,13 @@ class PixelFlasher:
     def setConnectedState(self):
         self.setFlash((0,64,0),1.0,0.0)
 
+    def setFaultState(self):
+        self.setFlash((127,0,0),0.1,0.1)
+
     def setFlash(self,color,onTime,offTime):
         self.currentColor = color
         self.onInterval = onTime
         self.offInterval = offTime
         self.onTime = time.monotonic()+self.onInterval
-        self.offTime = self.onTime+self.offInterval
\ No newline at end of file
+        self.offTime = self.onTime+self.offInterval
+        self.changed()
@@ -0,0 +1,170 @@
+# recorder.py
+#
+# Offline sample log on the CIRCUITPY filesystem
+#
+# While armed and disconnected, samples are staged in RAM and appended to an append-only log of
+# fixed size chunks. Chunks are CHUNK_SIZE bytes (one filesystem sector), so chunk n is always at
+# n*CHUNK_SIZE in the file and a download can resume from any chunk. The staging buffer holds
+# STAGE_CHUNKS chunks (one 4KB flash erase block) and is written in one go when full, or when the
+# link comes back. A partial last chunk is padded out to the full size.
+#
+# Chunk layout (little endian):
+#   Header - sync (u8), type 'L' (u8), sample count (u16), chunk index (u32), base timestamp ms (u32)
+#   Sample - ms since base timestamp (u16), raw HX711 count (i32), filtered value (f32)
+#
+# Timestamps are ticks ms, so they're relative to the boot the chunk was recorded in.
+#
+# The filesystem is read only to code unless boot.py remounted it. Writes then fail with OSError,
+# which stops recording and is reported by the RECS command, rather than taking down the main loop.
+
+import os
+import struct
+
+from ticks import ticks_diff
+from logger import log
+
+
+SYNC = 0xA5
+TYPE_LOG = 0x4C         # 'L'
+
+HEADER_FORMAT = '<BBHII'
+SAMPLE_FORMAT = '<Hif'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SAMPLE_SIZE = struct.calcsize(SAMPLE_FORMAT)
+
+CHUNK_SIZE = 512
+SAMPLES_PER_CHUNK = (CHUNK_SIZE - HEADER_SIZE)//SAMPLE_SIZE
+STAGE_CHUNKS = 8
+
+
+class Recorder:
+
+    CHUNK_SIZE = CHUNK_SIZE
+
+    def __init__(self, path):
+        self.path = path
+        self.stage = bytearray(STAGE_CHUNKS*CHUNK_SIZE)
+        self.read_buffer = bytearray(CHUNK_SIZE)
+        self.read_view = memoryview(self.read_buffer)
+
+        self.armed = False
+        self.error = 0          # errno of the last failed write, recording stops until re-armed
+
+        self.chunks = self.stored_chunks()     # Chunks in the file
+        self.staged = 0         # Complete chunks in the staging buffer
+        self.count = 0          # Samples in the open chunk
+        self.base_time = 0
+
+        # Download state
+        self.download_file = None
+        self.download_first = 0
+        self.download_next = 0
+
+    def stored_chunks(self):
+        try:
+            return os.stat(self.path)[6]//CHUNK_SIZE
+        except OSError:
+            return 0
+
+    @property
+    def recording(self):
+        return self.armed and not self.error
+
+    def arm(self, enabled):
+        self.armed = enabled
+        self.error = 0
+        if not enabled:
+            self.flush()
+
+    # --- RECORDING ---
+
+    def add(self, raw, value, now):
+        if self.count == 0:
+            self.base_time = now
+        dt = ticks_diff(now, self.base_time)
+        offset = self.staged*CHUNK_SIZE + HEADER_SIZE + self.count*SAMPLE_SIZE
+        struct.pack_into(SAMPLE_FORMAT, self.stage, offset, min(dt, 0xFFFF), raw, value)
+        self.count += 1
+
+        # Chunks end early rather than overflow the time offset
+        if self.count >= SAMPLES_PER_CHUNK or dt >= 0xFF00:
+            self.close_chunk()
+            if self.staged >= STAGE_CHUNKS:
+                self.write_stage()
+
+    def close_chunk(self):
+        if self.count == 0:
+            return
+        struct.pack_into(HEADER_FORMAT, self.stage, self.staged*CHUNK_SIZE, SYNC, TYPE_LOG,
+                         self.count, self.chunks + self.staged, self.base_time)
+        end = (self.staged + 1)*CHUNK_SIZE
+        for i in range(self.staged*CHUNK_SIZE + HEADER_SIZE + self.count*SAMPLE_SIZE, end):
+            self.stage[i] = 0
+        self.staged += 1
+        self.count = 0
+
+    # Write out everything staged, including a partial chunk
+    def flush(self):
+        self.close_chunk()
+        self.write_stage()
+
+    def write_stage(self):
+        if self.staged == 0:
+            return
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(memoryview(self.stage)[:self.staged*CHUNK_SIZE])
+            self.chunks += self.staged
+        except OSError as e:
+            self.error = e.args[0] if e.args else -1
+            log.error('Recording stopped, log write failed: %s', e)
+        self.staged = 0
+
+    # Delete the log
+    def erase(self):
+        self.stop_download()
+        self.staged = 0
+        self.count = 0
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass        # Nothing recorded yet
+        self.chunks = self.stored_chunks()
+
+    # --- DOWNLOAD ---
+
+    @property
+    def downloading(self):
+        return self.download_file is not None
+
+    # Start sending the log from chunk first. Raises OSError if the log can't be opened
+    def start_download(self, first):
+        if first < 0 or first > self.chunks:
+            raise IndexError('No such chunk')
+        self.stop_download()
+        self.download_file = open(self.path, 'rb')
+        self.download_file.seek(first*CHUNK_SIZE)
+        self.download_first = first
+        self.download_next = first
+
+    def stop_download(self):
+        if self.download_file is not None:
+            self.download_file.close()
+            self.download_file = None
+
+    # Next chunk of the download, or None once it has finished (download_next is then where it
+    # stopped, which is chunks unless the read failed)
+    def read_next(self):
+        if self.download_next >= self.chunks:
+            self.stop_download()
+            return None
+        try:
+            size = self.download_file.readinto(self.read_buffer)
+        except OSError as e:
+            log.error('Log read failed: %s', e)
+            size = 0
+        if size != CHUNK_SIZE:
+            self.stop_download()
+            return None
+        self.download_next += 1
+        return self.read_view
@@ -0,0 +1,150 @@
+# repanalyzer.py
+#
+# Rep detection and per rep summaries on the filtered load stream
+#
+# A rep runs from the load rising through rest_level to it falling back below, and only counts if
+# the load reached start_level on the way. Every sample updates the running figures, so when the
+# rep ends the summary is ready without keeping the samples:
+#   peak load, time under tension (ms above rest_level), impulse (load x seconds, trapezoidal),
+#   ms spent below, inside and above the goal band, and the rise and fall rates in load per second.
+# The rates are measured across the rest_level to start_level band (first time up through it, last
+# time down), where they aren't thrown by noise around the peak.
+#
+# The goal band is read from the feedback engine's band limits, so it follows the C/Z commands.
+# With no band set all time counts as above it.
+#
+# Summaries (little endian):
+#   Text   - P:<rep>,<tut ms>,<peak>,<impulse>,<below ms>,<in ms>,<above ms>,<rise>,<fall>\n
+#   Binary - sync (u8), type 'P' (u8), rep (u16), start time ms (u32), tut ms (u32), peak (f32),
+#            impulse (f32), below ms (u32), in ms (u32), above ms (u32), rise (f32), fall (f32)
+
+import struct
+
+from ticks import ticks_diff
+
+
+class RepAnalyzer:
+
+    SYNC = 0xA5
+    TYPE_REP = 0x50     # 'P'
+    FORMAT = '<BBHIIffIIIff'
+
+    START_LEVEL = 10.0      # Load a rep has to reach to count
+    REST_LEVEL = 5.0        # Load below which a rep is over (as FeedbackEngine.REST_LEVEL)
+
+    def __init__(self, band_limits):
+        self.band_limits = band_limits      # [goal lower, goal upper], shared with the feedback engine
+        self.start_level = self.START_LEVEL
+        self.rest_level = self.REST_LEVEL
+        self.buffer = bytearray(struct.calcsize(self.FORMAT))
+
+        self.reps = 0               # Completed reps, numbers the summaries
+        self.in_rep = False
+        self.confirmed = False      # Reached start_level
+
+        # Running figures for the current rep
+        self.start_time = 0
+        self.start_val = 0.0
+        self.last_time = 0
+        self.last_val = 0.0
+        self.peak = 0.0
+        self.rise_time = 0          # First sample at or above start_level
+        self.rise_val = 0.0
+        self.high_time = 0          # Latest sample at or above start_level
+        self.high_val = 0.0
+        self.impulse = 0.0          # Load x ms
+        self.band_ms = [0, 0, 0]    # Below, inside, above the goal band
+
+        # Summary of the last completed rep
+        self.tut_ms = 0
+        self.rise = 0.0
+        self.fall = 0.0
+
+    def set_levels(self, start_level, rest_level):
+        if rest_level < 0 or start_level < rest_level:
+            raise ValueError('Rep start level must be at or above the rest level')
+        self.start_level = start_level
+        self.rest_level = rest_level
+        self.in_rep = False
+
+    # Feed one filtered sample taken at now (ticks ms). Returns True when it completes a rep, the
+    # summary is then ready to send
+    def update(self, val, now):
+        if not self.in_rep:
+            if val >= self.rest_level:
+                self.begin(val, now)
+            return False
+
+        dt = ticks_diff(now, self.last_time)
+        last_val = self.last_val
+
+        # The interval since the last sample is credited to the band of the last sample
+        limits = self.band_limits
+        if last_val < limits[0]:
+            self.band_ms[0] += dt
+        elif last_val < limits[1]:
+            self.band_ms[1] += dt
+        else:
+            self.band_ms[2] += dt
+        self.impulse += (val + last_val)*0.5*dt
+
+        self.last_time = now
+        self.last_val = val
+        if val > self.peak:
+            self.peak = val
+        if val >= self.start_level:
+            if not self.confirmed:
+                self.confirmed = True
+                self.rise_time = now
+                self.rise_val = val
+            self.high_time = now
+            self.high_val = val
+
+        if val >= self.rest_level:
+            return False
+
+        self.in_rep = False
+        if not self.confirmed:
+            return False
+        self.finish(val, now)
+        return True
+
+    def begin(self, val, now):
+        self.in_rep = True
+        self.confirmed = val >= self.start_level
+        self.start_time = now
+        self.start_val = val
+        self.last_time = now
+        self.last_val = val
+        self.peak = val
+        self.rise_time = now
+        self.rise_val = val
+        self.high_time = now
+        self.high_val = val
+        self.impulse = 0.0
+        self.band_ms[0] = 0
+        self.band_ms[1] = 0
+        self.band_ms[2] = 0
+
+    def finish(self, val, now):
+        self.reps += 1
+        self.tut_ms = ticks_diff(now, self.start_time)
+        rise_ms = ticks_diff(self.rise_time, self.start_time)
+        fall_ms = ticks_diff(now, self.high_time)
+        self.rise = (self.rise_val - self.start_val)*1000/rise_ms if rise_ms > 0 else 0.0
+        self.fall = (self.high_val - val)*1000/fall_ms if fall_ms > 0 else 0.0
+
+    # Impulse of the last rep in load x seconds
+    def impulse_s(self):
+        return self.impulse/1000
+
+    def format_text(self):
+        band = self.band_ms
+        return (f'P:{self.reps},{self.tut_ms},{self.peak},{self.impulse_s()},'
+                f'{band[0]},{band[1]},{band[2]},{self.rise},{self.fall}\n')
+
+    def pack(self):
+        band = self.band_ms
+        struct.pack_into(self.FORMAT, self.buffer, 0, self.SYNC, self.TYPE_REP, self.reps & 0xFFFF, self.start_time,
+                         self.tut_ms, self.peak, self.impulse_s(), band[0], band[1], band[2], self.rise, self.fall)
+        return self.buffer
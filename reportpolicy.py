@@ -0,0 +1,63 @@
+# reportpolicy.py
+#
+# Decides which filtered samples are worth sending over BLE
+#
+# A sample is sent when it has moved at least deadband from the last sent value, when nothing has
+# been sent for heartbeat_ms (so the app can tell a steady load from a dropped link), but never
+# more often than every min_period_ms. Loads within floor of zero count as zero: the drop to rest
+# is reported once, after that only heartbeats go out. The defaults send every sample above the floor.
+
+from ticks import ticks_diff
+
+
+class ReportPolicy:
+
+    def __init__(self, deadband=0.0, heartbeat_ms=0, min_period_ms=0, floor=0.0):
+        self.deadband = deadband
+        self.heartbeat_ms = heartbeat_ms        # 0 disables the heartbeat
+        self.min_period_ms = min_period_ms
+        self.floor = floor                      # Loads at or below this are reported as rest
+
+        self.started = False
+        self.last_level = 0.0       # Last sent value, after the floor was applied
+        self.last_time = 0
+
+        self.sent = 0
+        self.suppressed = 0
+
+    def configure(self, deadband, heartbeat_ms, min_period_ms):
+        if deadband < 0 or heartbeat_ms < 0 or min_period_ms < 0:
+            raise ValueError('Report policy values must not be negative')
+        self.deadband = deadband
+        self.heartbeat_ms = heartbeat_ms
+        self.min_period_ms = min_period_ms
+
+    def reset_stats(self):
+        self.sent = 0
+        self.suppressed = 0
+
+    # Returns True if val (taken at now, ticks ms) should be sent, and counts it either way
+    def check(self, val, now):
+        elapsed = ticks_diff(now, self.last_time)
+        if self.started and elapsed < self.min_period_ms:
+            self.suppressed += 1
+            return False
+
+        level = val if abs(val) > self.floor else 0.0
+
+        if not self.started or (self.heartbeat_ms and elapsed >= self.heartbeat_ms):
+            send = True
+        elif level == 0.0:
+            send = self.last_level != 0.0
+        else:
+            send = abs(level - self.last_level) >= self.deadband
+
+        if not send:
+            self.suppressed += 1
+            return False
+
+        self.started = True
+        self.last_level = level
+        self.last_time = now
+        self.sent += 1
+        return True
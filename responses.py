@@ -0,0 +1,58 @@
+# responses.py
+#
+# Command responses for the BLE UART
+#
+# Every command gets one response, kept apart from the sample stream:
+#   Text    - R:<request id>,<A|N>,<error code>,<value>\n   (id and value empty when absent)
+#   Binary  - sync (u8), frame type 'R' (u8), request id (u16), error code (u8), value (f32, NaN when absent)
+#
+# A command may carry a request id as #<id>:<command>, which is echoed back so clients can
+# pipeline commands and match up the responses. Ids run 0 to MAX_REQUEST_ID, so both formats
+# echo the same id; anything else is rejected as a bad request id.
+
+import struct
+
+
+# Error codes
+OK = 0
+UNKNOWN_COMMAND = 1
+BAD_ARGUMENT = 2
+OUT_OF_RANGE = 3
+NOT_READY = 4
+FAILED = 5
+TOO_LONG = 6        # Command line longer than the receive buffer, dropped unread
+
+NO_REQUEST_ID = 0xFFFF          # Binary id field of a response to a command without one
+MAX_REQUEST_ID = NO_REQUEST_ID - 1
+
+
+# Raised by command handlers to fail a command with a specific error code
+class CommandError(Exception):
+
+    def __init__(self, code, message=''):
+        super().__init__(message)
+        self.code = code
+
+
+class ResponseWriter:
+
+    SYNC = 0xA5
+    TYPE_RESPONSE = 0x52    # 'R'
+    FORMAT = '<BBHBf'
+
+    def __init__(self, uart):
+        self.uart = uart
+        self.buffer = bytearray(struct.calcsize(self.FORMAT))
+        self.nan = float('nan')
+
+    def send(self, request_id, code, value=None, binary=False):
+        if binary:
+            struct.pack_into(self.FORMAT, self.buffer, 0, self.SYNC, self.TYPE_RESPONSE,
+                             NO_REQUEST_ID if request_id is None else request_id & 0xFFFF,
+                             code, self.nan if value is None else value)
+            self.uart.write(self.buffer)
+        else:
+            status = 'A' if code == OK else 'N'
+            rid = '' if request_id is None else request_id
+            echo = '' if value is None else value
+            self.uart.write(f'R:{rid},{status},{code},{echo}\n')
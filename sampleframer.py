@@ -0,0 +1,78 @@
+# sampleframer.py
+#
+# Packs batches of samples into fixed size binary frames for the BLE UART
+#
+# Frame layout (little endian):
+#   Header - sync (u8), frame type (u8), sequence (u16), base timestamp ms (u32), sample count (u8)
+#   Sample - ms since base timestamp (u16), raw HX711 count (i32), filtered value (f32)
+
+import struct
+from ticks import ticks_ms, ticks_diff
+
+
+class SampleFramer:
+
+    SYNC = 0xA5
+    TYPE_SAMPLES = 0x53     # 'S'
+
+    HEADER_FORMAT = '<BBHIB'
+    SAMPLE_FORMAT = '<Hif'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    SAMPLE_SIZE = struct.calcsize(SAMPLE_FORMAT)
+
+    MAX_SAMPLES = 16        # Upper bound for samples per frame (sizes the preallocated buffer)
+
+    def __init__(self, samples_per_frame=8, interval_ms=30):
+        self.buffer = bytearray(self.HEADER_SIZE + self.MAX_SAMPLES*self.SAMPLE_SIZE)
+        self.view = memoryview(self.buffer)
+
+        self.enabled = False
+        self.samples_per_frame = samples_per_frame
+        self.interval_ms = interval_ms      # Flush period, normally the connection interval
+
+        self.sequence = 0
+        self.count = 0
+        self.base_time = 0
+        self.last_flush = ticks_ms()
+
+    def enable(self, samples_per_frame):
+        self.samples_per_frame = max(1, min(samples_per_frame, self.MAX_SAMPLES))
+        self.count = 0
+        self.enabled = True
+
+    def disable(self):
+        self.count = 0
+        self.enabled = False
+
+    def set_interval(self, interval_ms):
+        self.interval_ms = interval_ms
+
+    # Add a sample to the current frame. Returns True when the frame is full and should be flushed
+    def add(self, raw, value):
+        now = ticks_ms()
+        if self.count == 0:
+            self.base_time = now
+
+        offset = self.HEADER_SIZE + self.count*self.SAMPLE_SIZE
+        struct.pack_into(self.SAMPLE_FORMAT, self.buffer, offset, ticks_diff(now, self.base_time) & 0xFFFF, raw, value)
+        self.count += 1
+
+        return self.count >= self.samples_per_frame
+
+    # Check if a partial frame has waited a full interval
+    def is_due(self):
+        return self.count > 0 and ticks_diff(ticks_ms(), self.last_flush) >= self.interval_ms
+
+    # Finalize the current frame. Returns a view of the packed bytes, or None if there is nothing to send
+    def flush(self):
+        self.last_flush = ticks_ms()
+        if self.count == 0:
+            return None
+
+        struct.pack_into(self.HEADER_FORMAT, self.buffer, 0, self.SYNC, self.TYPE_SAMPLES, self.sequence, self.base_time, self.count)
+        size = self.HEADER_SIZE + self.count*self.SAMPLE_SIZE
+
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.count = 0
+
+        return self.view[:size]
@@ -0,0 +1,167 @@
+# samplehistory.py
+#
+# Fixed capacity ring buffer of recent samples with O(1) windowed statistics
+#
+# Raw counts, filtered values and timestamps live in preallocated arrays. Sum, sum of squares,
+# min and max over the window are maintained incrementally as samples are pushed and evicted,
+# so nothing is rescanned per sample.
+#
+# The sum of squares is a float (the squares outgrow small ints), so keeping it per sample
+# allocates on the device. With set_running_sumsq(False) it isn't kept and variance() scans the
+# window when asked instead, which leaves push() allocation free for the fixed point filter.
+
+import math
+from array import array
+
+
+class SampleHistory:
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+
+        self.raw = array('l', [0]*capacity)         # Raw HX711 counts
+        self.filtered = array('f', [0.0]*capacity)  # Filter output at the time of the sample
+        self.times = array('l', [0]*capacity)       # ticks_ms timestamps
+
+        self.head = 0       # Next slot to write
+        self.count = 0
+
+        # Running sums are kept relative to a reference count so the squares stay small.
+        # The reference is moved to the window mean (and the sums rebuilt) once per lap of the ring,
+        # which also stops float rounding error from accumulating.
+        self.ref = 0
+        self.sum = 0
+        self.sumsq = 0.0
+        self.running_sumsq = True
+        self.rebase_countdown = capacity
+
+        # Monotonic deques of ring slots for sliding min/max
+        self.minq = array('H', [0]*capacity)
+        self.maxq = array('H', [0]*capacity)
+        self.minHead = 0
+        self.minLen = 0
+        self.maxHead = 0
+        self.maxLen = 0
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.sum = 0
+        self.sumsq = 0.0
+        self.minLen = 0
+        self.maxLen = 0
+        self.rebase_countdown = self.capacity
+
+    def push(self, timestamp, raw, filtered):
+        capacity = self.capacity
+        slot = self.head
+
+        if self.count == capacity:
+            # Evict the oldest sample, which lives in the slot we're about to overwrite
+            old = self.raw[slot] - self.ref
+            self.sum -= old
+            if self.running_sumsq:
+                self.sumsq -= float(old)*old
+
+            if self.minq[self.minHead] == slot:
+                self.minHead = (self.minHead + 1) % capacity
+                self.minLen -= 1
+            if self.maxq[self.maxHead] == slot:
+                self.maxHead = (self.maxHead + 1) % capacity
+                self.maxLen -= 1
+        else:
+            if self.count == 0:
+                self.ref = raw
+            self.count += 1
+
+        self.raw[slot] = raw
+        self.filtered[slot] = filtered
+        self.times[slot] = timestamp
+
+        d = raw - self.ref
+        self.sum += d
+        if self.running_sumsq:
+            self.sumsq += float(d)*d
+
+        # Drop anything from the back of the deques that can no longer be the min/max
+        minq = self.minq
+        while self.minLen and self.raw[minq[(self.minHead + self.minLen - 1) % capacity]] >= raw:
+            self.minLen -= 1
+        minq[(self.minHead + self.minLen) % capacity] = slot
+        self.minLen += 1
+
+        maxq = self.maxq
+        while self.maxLen and self.raw[maxq[(self.maxHead + self.maxLen - 1) % capacity]] <= raw:
+            self.maxLen -= 1
+        maxq[(self.maxHead + self.maxLen) % capacity] = slot
+        self.maxLen += 1
+
+        self.head = (slot + 1) % capacity
+
+        self.rebase_countdown -= 1
+        if self.rebase_countdown <= 0:
+            self.rebase()
+
+    # Move the reference to the current window mean and rebuild the sums. O(capacity), once per lap
+    def rebase(self):
+        self.rebase_countdown = self.capacity
+        if self.count == 0:
+            return
+
+        self.ref += self.sum // self.count
+        total = 0
+        for i in range(self.count):
+            total += self.raw[(self.head - 1 - i) % self.capacity] - self.ref
+        self.sum = total
+        if self.running_sumsq:
+            self.sumsq = self.window_sumsq()
+
+    # Keep the sum of squares per sample (O(1) variance), or only work it out in variance()
+    def set_running_sumsq(self, enabled):
+        self.running_sumsq = enabled
+        self.sumsq = self.window_sumsq() if enabled else 0.0
+
+    # Sum of squares of the window relative to ref, O(capacity)
+    def window_sumsq(self):
+        total = 0.0
+        for i in range(self.count):
+            d = self.raw[(self.head - 1 - i) % self.capacity] - self.ref
+            total += float(d)*d
+        return total
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.ref + self.sum/self.count
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        m = self.sum/self.count
+        sumsq = self.sumsq if self.running_sumsq else self.window_sumsq()
+        return max(sumsq/self.count - m*m, 0.0)
+
+    def stddev(self):
+        return math.sqrt(self.variance())
+
+    def min(self):
+        if self.count == 0:
+            return 0
+        return self.raw[self.minq[self.minHead]]
+
+    def max(self):
+        if self.count == 0:
+            return 0
+        return self.raw[self.maxq[self.maxHead]]
+
+    def range(self):
+        return self.max() - self.min()
+
+    def latest_time(self):
+        return self.times[(self.head - 1) % self.capacity]
+
+    # Zero copy view of the history for bulk export. Returns (oldest slot, count, raw, filtered, times);
+    # samples run from the oldest slot forward and wrap at capacity.
+    def snapshot(self):
+        oldest = (self.head - self.count) % self.capacity
+        return oldest, self.count, memoryview(self.raw), memoryview(self.filtered), memoryview(self.times)
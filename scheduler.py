@@ -0,0 +1,106 @@
+# scheduler.py
+#
+# Cooperative periodic task scheduler for the main loop
+#
+# Each task is a plain function with a period. Tasks are checked in priority order and only the
+# first due task runs per pass, so a high priority task (sensor acquisition) never waits behind
+# more than one lower priority one. When nothing is due the scheduler sleeps until the earliest
+# deadline instead of spinning.
+#
+# Event driven tasks set their own next run from inside the callback with sleep(), and whatever
+# gives them new work brings them forward with wake().
+
+import time
+
+from ticks import ticks_ms, ticks_add, ticks_diff
+
+
+class Task:
+
+    def __init__(self, name, callback, period_ms, priority):
+        self.name = name
+        self.callback = callback
+        self.period_ms = period_ms
+        self.priority = priority
+        self.enabled = True
+
+        self.next_run = ticks_ms()
+
+        # Statistics
+        self.runs = 0
+        self.max_lateness = 0       # Worst case ms between the deadline and the task actually running
+
+    def set_period(self, period_ms):
+        self.period_ms = period_ms
+
+    # Next run in delay_ms rather than a period from now
+    def sleep(self, delay_ms):
+        self.next_run = ticks_add(ticks_ms(), delay_ms)
+
+    # Run on the next pass
+    def wake(self):
+        self.next_run = ticks_ms()
+
+    def reset_stats(self):
+        self.runs = 0
+        self.max_lateness = 0
+
+
+class Scheduler:
+
+    def __init__(self):
+        self.tasks = []
+        self.idle_ms = 0        # Total time spent sleeping
+
+    # Add a task. Higher priority tasks are checked first
+    def add_task(self, name, callback, period_ms, priority=0):
+        task = Task(name, callback, period_ms, priority)
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: -t.priority)
+        return task
+
+    # Run the highest priority task that is due. If none are due, sleep until the next deadline
+    def run_once(self):
+        now = ticks_ms()
+        wait = None
+
+        for task in self.tasks:
+            if not task.enabled:
+                continue
+
+            lateness = ticks_diff(now, task.next_run)
+            if lateness >= 0:
+                if lateness > task.max_lateness:
+                    task.max_lateness = lateness
+                task.runs += 1
+
+                # Schedule from the deadline to hold the period, but don't try to catch up missed runs
+                if lateness < task.period_ms:
+                    task.next_run = ticks_add(task.next_run, task.period_ms)
+                else:
+                    task.next_run = ticks_add(now, task.period_ms)
+
+                task.callback()
+                return
+
+            if wait is None or -lateness < wait:
+                wait = -lateness
+
+        if wait:
+            self.idle_ms += wait
+            time.sleep(wait/1000)
+
+    def run(self):
+        while True:
+            self.run_once()
+
+    def reset_stats(self):
+        self.idle_ms = 0
+        for task in self.tasks:
+            task.reset_stats()
+
+    # Write T:<name>,<runs>,<max lateness ms>,<period ms> per task, then TI:<idle ms>
+    def report(self, write):
+        for task in self.tasks:
+            write(f'T:{task.name},{task.runs},{task.max_lateness},{task.period_ms}\n')
+        write(f'TI:{self.idle_ms}\n')
@@ -0,0 +1,144 @@
+# sequencer.py
+#
+# Multi step waveform patterns for the vibration motor and the NeoPixel
+#
+# A pattern is a list of (duration ms, level %, crossfade ms) steps played repeats times (0 loops
+# until stopped). During the first crossfade ms of a step the level ramps linearly from the
+# previous step's level. Patterns are uploaded once as text, kept in a small library of numbered
+# slots, and then played on either output by id, so a complex cue is one command:
+#
+#   <repeats>:<ms>/<level>[/<fade ms>]:<ms>/<level>[/<fade ms>]...
+#
+#   e.g. 3:200/100:100/0:300/60/150 - buzz 200ms, pause 100ms, swell to 60% over 150ms and hold, three times
+#
+# Steps are parsed into arrays at upload time. Playing only walks those arrays and calls the
+# output when the level changes.
+
+from array import array
+
+from ticks import ticks_diff, ticks_add
+
+
+PATTERN_SLOTS = 8
+MAX_STEPS = 16
+MAX_REPEATS = 65535
+
+# Longest upload text: 5 digit repeats, then MAX_STEPS steps of ':65535/100/65535'. The command
+# line buffer in code.py is sized to hold this plus '#<request id>:PU<id>:' and the terminator
+MAX_STEP_LENGTH = 16
+MAX_UPLOAD_LENGTH = 5 + MAX_STEPS*MAX_STEP_LENGTH
+
+
+class Pattern:
+
+    def __init__(self, repeats, durations, levels, fades):
+        self.repeats = repeats
+        self.count = len(durations)
+        self.durations = durations      # ms per step
+        self.levels = levels            # 0-100 %
+        self.fades = fades              # Crossfade ms at the start of each step
+
+
+# Parse the upload format above. Raises ValueError on anything malformed
+def parse_pattern(text):
+    fields = text.split(':')
+    repeats = int(fields[0])
+    steps = fields[1:]
+    if not (0 <= repeats <= MAX_REPEATS and 1 <= len(steps) <= MAX_STEPS):
+        raise ValueError('Invalid pattern')
+
+    durations = array('H', [0]*len(steps))
+    levels = array('B', [0]*len(steps))
+    fades = array('H', [0]*len(steps))
+    for i in range(len(steps)):
+        parts = steps[i].split('/')
+        if not (2 <= len(parts) <= 3):
+            raise ValueError('Invalid pattern step')
+        duration = int(parts[0])
+        level = int(parts[1])
+        fade = int(parts[2]) if len(parts) == 3 else 0
+        if not (1 <= duration <= 65535 and 0 <= level <= 100 and 0 <= fade <= duration):
+            raise ValueError('Pattern step out of range')
+        durations[i] = duration
+        levels[i] = level
+        fades[i] = fade
+    return Pattern(repeats, durations, levels, fades)
+
+
+# Numbered pattern slots shared by all players
+class PatternLibrary:
+
+    def __init__(self, slots=PATTERN_SLOTS):
+        self.patterns = [None]*slots
+
+    def store(self, pattern_id, pattern):
+        if not (0 <= pattern_id < len(self.patterns)):
+            raise IndexError('Invalid pattern id')
+        self.patterns[pattern_id] = pattern
+
+    def get(self, pattern_id):
+        if not (0 <= pattern_id < len(self.patterns)):
+            raise IndexError('Invalid pattern id')
+        return self.patterns[pattern_id]
+
+
+# Plays one pattern at a time into output(level), where level is 0-100, or None once playback stops
+class Sequencer:
+
+    def __init__(self, output):
+        self.output = output
+        self.pattern = None
+        self.step = 0
+        self.step_start = 0
+        self.remaining = 0      # Repeats left, counting the current one
+        self.from_level = 0     # Level the current step fades from
+        self.level = -1         # Last level sent to the output
+
+    @property
+    def playing(self):
+        return self.pattern is not None
+
+    def play(self, pattern, now):
+        self.pattern = pattern
+        self.step = 0
+        self.step_start = now
+        self.remaining = pattern.repeats
+        self.from_level = max(self.level, 0)
+        self.update(now)
+
+    def stop(self):
+        if self.pattern is not None:
+            self.pattern = None
+            self.level = -1
+            self.output(None)
+
+    # Call regularly with ticks_ms(). Steps forward and sends the level if it changed
+    def update(self, now):
+        pattern = self.pattern
+        if pattern is None:
+            return
+
+        elapsed = ticks_diff(now, self.step_start)
+        durations = pattern.durations
+        while elapsed >= durations[self.step]:
+            duration = durations[self.step]
+            elapsed -= duration
+            self.step_start = ticks_add(self.step_start, duration)
+            self.from_level = pattern.levels[self.step]
+            self.step += 1
+            if self.step == pattern.count:
+                self.step = 0
+                if pattern.repeats:
+                    self.remaining -= 1
+                    if self.remaining == 0:
+                        self.stop()
+                        return
+
+        level = pattern.levels[self.step]
+        fade = pattern.fades[self.step]
+        if elapsed < fade:
+            level = self.from_level + (level - self.from_level)*elapsed//fade
+
+        if level != self.level:
+            self.level = level
+            self.output(level)
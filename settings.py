@@ -1,40 +1,290 @@
 # settings.py
 #
 #   Non-Volatile Memory / Settings Manager
+#
+#   Settings are cached in RAM. Setters only mark the cache dirty, and the dirty cache is written
+#   out as one record after a short delay, so bursts of changes (repeated TARE/CAL) cost one write.
+#   Commands acknowledge once a change is cached; a power off inside the delay loses it.
+#
+#   Every nvm write erases and rewrites the whole 4KB flash page it lands in, so slots within one
+#   page all wear together. The ring therefore alternates between the two pages of the 8KB nvm
+#   region: slot n is in page n % 2, and each page takes every other commit. Each record is
+#     magic (u8), format version (u8), sequence (u16), payload length (u16), payload, CRC16 (u16)
+#   and the payload is a list of (field id (u8), length (u8), data) entries, so new fields can be
+#   added without moving existing ones. At boot each page's slots are read in one go and the valid
+#   record with the newest sequence number wins.
 
 
-import sys
 from microcontroller import nvm
+from array import array
 import struct
 
+from ticks import ticks_ms, ticks_diff
+
+
+# Field ids - never reuse or renumber these
+FIELD_CI = 1            # Connection interval in ms (u8)
+FIELD_TARE = 2          # Zero point in raw counts (f32)
+FIELD_SCALE = 3         # Unit scale factor (f32)
+FIELD_CAL_TABLE = 4     # Multi point calibration, (counts, load) f32 pairs (raw bytes)
+FIELD_RECORD = 5        # Offline recording armed (u8)
+FIELD_CHANNEL_TARE = 6  # Zero point per load cell in raw counts, f32 each (raw bytes)
+
+
+# CRC-16/CCITT-FALSE, one table lookup per byte
+def _crc16_table():
+    table = array('H', [0]*256)
+    for n in range(256):
+        crc = n << 8
+        for bit in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[n] = crc
+    return table
+
+CRC16_TABLE = _crc16_table()
+
+
+def crc16(data, length):
+    table = CRC16_TABLE
+    crc = 0xFFFF
+    for i in range(length):
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ data[i]]
+    return crc
+
+
+class SettingsStore:
+
+    MAGIC = 0x5A
+    VERSION = 1
+
+    HEADER_FORMAT = '<BBHH'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    CRC_SIZE = 2
+
+    PAGE_SIZE = 4096        # Flash erase unit. nvm starts on a page boundary
+    PAGE_COUNT = 2
+    REGION_START = 16       # Offset of the slots in each page. Leaves the original fixed layout (bytes 0-8) untouched
+    SLOT_SIZE = 160
+    PAGE_SLOTS = 8          # Page 0 keeps the single page ring's slots where they were
+
+    COMMIT_DELAY_MS = 2000  # Changes are held this long so repeated writes coalesce into one page erase
+
+    # Field id: (struct format, default). Formats of None are stored as raw bytes
+    FIELDS = {
+        FIELD_CI: ('<B', 28),        # 28ms - Actually rounds up to 30 when set, but setting 30 results in 45
+        FIELD_TARE: ('<f', 0.0),
+        FIELD_SCALE: ('<f', 1.0),
+        FIELD_CAL_TABLE: (None, b''),
+        FIELD_RECORD: ('<B', 0),
+        FIELD_CHANNEL_TARE: (None, b''),
+    }
+
+    def __init__(self):
+        self.page_count = max(1, min(self.PAGE_COUNT, len(nvm)//self.PAGE_SIZE))
+        self.page_slots = min(self.PAGE_SLOTS, (min(len(nvm), self.PAGE_SIZE) - self.REGION_START)//self.SLOT_SIZE)
+        self.slot_count = self.page_count*self.page_slots
+        self.record = bytearray(self.SLOT_SIZE)
+
+        self.values = {}
+        self.slot = -1          # Slot holding the newest record
+        self.sequence = 0
+        self.dirty = False
+        self.dirty_since = 0
+        self.commits = 0
+
+        self.load()
+
+    # nvm offset of a ring slot. Consecutive slots are in alternate pages
+    def slot_offset(self, slot):
+        return (slot % self.page_count)*self.PAGE_SIZE + self.REGION_START + (slot//self.page_count)*self.SLOT_SIZE
+
+    def load(self):
+        # One bulk read of each page's slots
+        size = self.page_slots*self.SLOT_SIZE
+        regions = [nvm[self.slot_offset(page):self.slot_offset(page) + size] for page in range(self.page_count)]
+
+        best = -1
+        for slot in range(self.slot_count):
+            region = regions[slot % self.page_count]
+            offset = (slot//self.page_count)*self.SLOT_SIZE
+            magic, version, sequence, length = struct.unpack_from(self.HEADER_FORMAT, region, offset)
+            if magic != self.MAGIC or length > self.SLOT_SIZE - self.HEADER_SIZE - self.CRC_SIZE:
+                continue
+
+            end = offset + self.HEADER_SIZE + length
+            record = memoryview(region)[offset:end]
+            if crc16(record, len(record)) != struct.unpack_from('<H', region, end)[0]:
+                continue
+
+            # Newest wins, allowing for the 16 bit sequence wrapping
+            if best < 0 or ((sequence - self.sequence) & 0xFFFF) < 0x8000:
+                best = slot
+                self.sequence = sequence
+
+        if best < 0:
+            self.migrate_legacy()
+            return
+
+        self.slot = best
+        region = regions[best % self.page_count]
+        offset = (best//self.page_count)*self.SLOT_SIZE
+        length = struct.unpack_from(self.HEADER_FORMAT, region, offset)[3]
+        self.parse(region, offset + self.HEADER_SIZE, length)
+
+    def parse(self, data, offset, length):
+        end = offset + length
+        while offset + 2 <= end:
+            field = data[offset]
+            size = data[offset + 1]
+            offset += 2
+            spec = self.FIELDS.get(field)
+            if spec is None or spec[0] is None:
+                # Raw bytes, including fields from newer firmware we don't know about (kept so they survive a rewrite)
+                self.values[field] = bytes(data[offset:offset + size])
+            elif size == struct.calcsize(spec[0]):
+                self.values[field] = struct.unpack_from(spec[0], data, offset)[0]
+            offset += size
+
+    # No valid record yet - pick up values stored by the original fixed layout
+    def migrate_legacy(self):
+        ci = nvm[Settings.OFFSET_CI]
+        if ci != 0xFF:
+            self.values[FIELD_CI] = ci
+
+        [tare] = struct.unpack("<f", nvm[Settings.OFFSET_ZERO:Settings.OFFSET_SCALE])
+        if tare == tare:        # Not NaN (erased nvm)
+            self.values[FIELD_TARE] = tare
+
+        [scale] = struct.unpack("<f", nvm[Settings.OFFSET_SCALE:Settings.OFFSET_END])
+        if scale == scale and scale != 0.0:
+            self.values[FIELD_SCALE] = scale
+
+        if self.values:
+            self.mark_dirty()
+
+    def get(self, field):
+        value = self.values.get(field)
+        if value is None:
+            return self.FIELDS[field][1]
+        return value
+
+    def set(self, field, value):
+        if self.values.get(field) != value:
+            self.values[field] = value
+            self.mark_dirty()
+
+    def mark_dirty(self):
+        if not self.dirty:
+            self.dirty = True
+            self.dirty_since = ticks_ms()
+
+    # Call regularly. Writes the cache once changes have settled for COMMIT_DELAY_MS
+    def service(self):
+        if self.dirty and ticks_diff(ticks_ms(), self.dirty_since) >= self.COMMIT_DELAY_MS:
+            self.commit()
+
+    # Write the cache to the next slot in the ring right away (one erase, of the other page to last time)
+    def commit(self):
+        record = self.record
+        offset = self.HEADER_SIZE
+        for field in self.values:
+            value = self.values[field]
+            spec = self.FIELDS.get(field)
+            if spec is None or spec[0] is None:
+                size = len(value)
+            else:
+                size = struct.calcsize(spec[0])
+
+            if offset + 2 + size > self.SLOT_SIZE - self.CRC_SIZE:
+                raise RuntimeError("Settings record is full")
+
+            record[offset] = field
+            record[offset + 1] = size
+            if spec is None or spec[0] is None:
+                record[offset + 2:offset + 2 + size] = value
+            else:
+                struct.pack_into(spec[0], record, offset + 2, value)
+            offset += 2 + size
+
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        struct.pack_into(self.HEADER_FORMAT, record, 0, self.MAGIC, self.VERSION, self.sequence, offset - self.HEADER_SIZE)
+        struct.pack_into('<H', record, offset, crc16(record, offset))
+        offset += self.CRC_SIZE
+
+        self.slot = (self.slot + 1) % self.slot_count
+        start = self.slot_offset(self.slot)
+        nvm[start:start + offset] = record[:offset]
+
+        self.dirty = False
+        self.commits += 1
+
+
+# Shared by every Settings instance so they all see the same cache
+_store = None
+
 
 class Settings:
 
+    # Original fixed layout, only read to migrate old units
     OFFSET_CI = 0       # Connection Interval Byte Offset (1 bytes)
     OFFSET_ZERO = 1     # Zero Point Calibration (4 bytes)
     OFFSET_SCALE = 5    # Unit Scale Factor Calibration (8 bytes)
 
     OFFSET_END = 9
 
+    DEFAULT_CI = SettingsStore.FIELDS[FIELD_CI][1]
+
+    def __init__(self):
+        global _store
+        if _store is None:
+            _store = SettingsStore()
+        self.store = _store
+
+    # Commit pending changes once they have settled. Call from the main loop
+    def service(self):
+        self.store.service()
+
+    # Commit pending changes now
+    def flush(self):
+        if self.store.dirty:
+            self.store.commit()
+
     def get_connectionInterval(self):
-        return int.from_bytes(nvm[self.OFFSET_CI:self.OFFSET_ZERO],sys.byteorder)
+        return self.store.get(FIELD_CI)
 
     def set_connectionInterval(self,interval):
         if (interval <= 255):
-            nvm[self.OFFSET_CI:self.OFFSET_ZERO] = interval.to_bytes(1,sys.byteorder)
+            self.store.set(FIELD_CI, interval)
 
     def get_tare(self):
-        [x] = struct.unpack("f",nvm[self.OFFSET_ZERO:self.OFFSET_SCALE])
-        return x
+        return self.store.get(FIELD_TARE)
 
     def set_tare(self,offset):
-        nvm[self.OFFSET_ZERO:self.OFFSET_SCALE] = struct.pack("f",offset)
+        self.store.set(FIELD_TARE, offset)
 
     def get_calibration(self):
-        [x] = struct.unpack("f",nvm[self.OFFSET_SCALE:self.OFFSET_END])
-        return x
+        return self.store.get(FIELD_SCALE)
 
     def set_calibration(self,offset):
-        nvm[self.OFFSET_SCALE:self.OFFSET_END] = struct.pack("f",offset)
+        self.store.set(FIELD_SCALE, offset)
+
+    def get_calibration_table(self):
+        return self.store.get(FIELD_CAL_TABLE)
+
+    def set_calibration_table(self,data):
+        self.store.set(FIELD_CAL_TABLE, data)
+
+    def get_channel_tares(self):
+        return self.store.get(FIELD_CHANNEL_TARE)
+
+    def set_channel_tares(self,data):
+        self.store.set(FIELD_CHANNEL_TARE, data)
 
+    def get_recording(self):
+        return self.store.get(FIELD_RECORD) != 0
 
+    def set_recording(self,enabled):
+        self.store.set(FIELD_RECORD, int(enabled))
@@ -0,0 +1,57 @@
+# adafruit_ble
+#
+# Simulated BLE radio. Connection state follows simhw.central, which the host side drives
+
+import simhw
+
+
+class Connection:
+
+    def __init__(self, central):
+        self.central = central
+
+    @property
+    def connected(self):
+        return self.central.connected
+
+    # The stack rounds requests up to a multiple of 1.25ms, as the real controller does
+    @property
+    def connection_interval(self):
+        return self.central.connection_interval
+
+    @connection_interval.setter
+    def connection_interval(self, value):
+        units = -(-int(value*100)//125)
+        self.central.connection_interval = max(units, 6)*1.25
+
+    def disconnect(self):
+        self.central.disconnect()
+
+
+class BLERadio:
+
+    def __init__(self):
+        self.advertising = False
+        self.advertisement = None
+
+    def start_advertising(self, advertisement, scan_response=None, interval=0.1, timeout=None):
+        if self.advertising:
+            raise RuntimeError('Already advertising')
+        self.advertising = True
+        self.advertisement = advertisement
+
+    def stop_advertising(self):
+        self.advertising = False
+
+    @property
+    def connected(self):
+        # Connecting stops advertising, as on the device
+        if simhw.central.connected:
+            self.advertising = False
+        return simhw.central.connected
+
+    @property
+    def connections(self):
+        if simhw.central.connected:
+            return (Connection(simhw.central),)
+        return ()
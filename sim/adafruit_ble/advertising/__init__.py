@@ -0,0 +1,9 @@
+# adafruit_ble.advertising
+#
+# Simulated advertisement base class
+
+
+class Advertisement:
+
+    def __str__(self):
+        return f'<{type(self).__name__}>'
@@ -0,0 +1,15 @@
+# adafruit_ble.advertising.standard
+#
+# Simulated standard advertisements
+
+from adafruit_ble.advertising import Advertisement
+
+
+class ProvideServicesAdvertisement(Advertisement):
+
+    def __init__(self, *services):
+        self.services = services
+
+    def __str__(self):
+        names = ' '.join(type(s).__name__ for s in self.services)
+        return f'<ProvideServicesAdvertisement services=<{names}> >'
@@ -0,0 +1,7 @@
+# adafruit_ble.services
+#
+# Simulated service base class
+
+
+class Service:
+    pass
@@ -0,0 +1,55 @@
+# adafruit_ble.services.nordic
+#
+# Simulated Nordic UART service, looped back to simhw.central
+
+import simhw
+from adafruit_ble.services import Service
+
+
+class UARTService(Service):
+
+    def __init__(self, buffer_size=64):
+        self.buffer_size = buffer_size
+
+    @property
+    def in_waiting(self):
+        return min(len(simhw.central.to_device), self.buffer_size)
+
+    def read(self, nbytes=None):
+        central = simhw.central
+        if nbytes is None:
+            nbytes = len(central.to_device)
+        nbytes = min(nbytes, self.in_waiting)
+        if nbytes == 0:
+            return None
+        data = bytes(central.to_device[:nbytes])
+        del central.to_device[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        if nbytes is None:
+            nbytes = len(buf)
+        data = self.read(nbytes)
+        if not data:
+            return 0
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        central = simhw.central
+        end = central.to_device.find(b'\n')
+        if end < 0:
+            return b''
+        return self.read(end + 1)
+
+    def reset_input_buffer(self):
+        simhw.central.to_device = bytearray()
+
+    def write(self, buf):
+        central = simhw.central
+        if not central.connected:
+            return
+        if isinstance(buf, str):
+            buf = buf.encode()
+        central.writes += 1
+        central.received += buf
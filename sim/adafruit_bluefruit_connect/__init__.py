@@ -0,0 +1,3 @@
+# adafruit_bluefruit_connect
+#
+# Simulated Bluefruit Connect packet library (imported by the firmware, not otherwise used)
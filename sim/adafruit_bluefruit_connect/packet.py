@@ -0,0 +1,10 @@
+# adafruit_bluefruit_connect.packet
+#
+# Simulated Bluefruit Connect packet base class
+
+
+class Packet:
+
+    @classmethod
+    def from_stream(cls, stream):
+        return None
@@ -0,0 +1,11 @@
+# board.py
+#
+# Simulated Feather nRF52840 Express pins
+
+import simhw
+
+for _name in ('A0', 'A1', 'A2', 'A3', 'A4', 'A5', 'D2', 'D5', 'D6', 'D9', 'D10', 'D11', 'D12', 'D13',
+              'NEOPIXEL', 'SWITCH', 'RED_LED', 'BLUE_LED', 'SCK', 'MOSI', 'MISO', 'SCL', 'SDA', 'TX', 'RX'):
+    globals()[_name] = simhw.pin(_name)
+
+LED = RED_LED
@@ -0,0 +1,39 @@
+# microcontroller.py
+#
+# Simulated nvm. Backed by the file at simhw.nvm_path if set, otherwise a fresh erased store
+
+import simhw
+
+
+class NVM:
+
+    def __init__(self, path, size):
+        self.path = path
+        self.data = bytearray(b'\xff'*size)
+        self.writes = 0
+
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    stored = f.read(size)
+                self.data[:len(stored)] = stored
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice) and len(range(*index.indices(len(self.data)))) != len(value):
+            raise ValueError('Slice and value sizes must match')
+        self.data[index] = value
+        self.writes += 1
+        if self.path is not None:
+            with open(self.path, 'wb') as f:
+                f.write(self.data)
+
+
+nvm = NVM(simhw.nvm_path, simhw.nvm_size)
@@ -0,0 +1,38 @@
+# neopixel.py
+#
+# Simulated NeoPixel strip that records every transfer to the LEDs
+
+import simhw
+
+
+class NeoPixel:
+
+    def __init__(self, pin, n, *, bpp=3, brightness=1.0, auto_write=True, pixel_order=None):
+        self.pin = pin
+        self.n = n
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self.pixels = [(0, 0, 0)]*n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = tuple(color)
+        if self.auto_write:
+            self.show()
+
+    def fill(self, color):
+        self.pixels = [tuple(color)]*self.n
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        simhw.outputs.pixel_writes += 1
+        simhw.outputs.pixels.append((simhw.now(), tuple(self.pixels)))
+
+    def deinit(self):
+        pass
@@ -0,0 +1,29 @@
+# pwmio.py
+#
+# Simulated PWM output that records every duty cycle write
+
+import simhw
+
+
+class PWMOut:
+
+    def __init__(self, pin, *, duty_cycle=0, frequency=500, variable_frequency=False):
+        self.pin = pin
+        self.frequency = frequency
+        self._duty_cycle = duty_cycle
+
+    @property
+    def duty_cycle(self):
+        return self._duty_cycle
+
+    @duty_cycle.setter
+    def duty_cycle(self, value):
+        if not 0 <= value <= 65535:
+            raise ValueError('Duty cycle must be between 0 and 65535')
+        simhw.outputs.pwm_writes += 1
+        if value != self._duty_cycle:
+            simhw.outputs.pwm.append((simhw.now(), self.pin.name, value))
+        self._duty_cycle = value
+
+    def deinit(self):
+        pass
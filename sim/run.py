@@ -0,0 +1,258 @@
+# run.py
+#
+# Run the unmodified firmware (code.py) on the host against the simulated hardware
+#
+#   python sim/run.py --duration 10 --waveform reps:20 --command 2:BIN8 --command 3:TARE
+#
+# run_firmware() does the same from Python and returns a SimResult for benchmarks and checks.
+
+import argparse
+import importlib
+import os
+import runpy
+import struct
+import sys
+import tempfile
+import time
+
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIM_DIR)
+
+
+# Split the bytes the firmware sent into text lines and binary frames
+def decode_stream(data):
+    from sampleframer import SampleFramer
+    from responses import ResponseWriter
+    from perfstats import PerfStats
+    from repanalyzer import RepAnalyzer
+    import recorder
+    import deltaframer
+
+    deltas = deltaframer.DeltaDecoder()
+
+    lines = []
+    frames = []
+    i = 0
+    n = len(data)
+    while i < n:
+        if data[i] == SampleFramer.SYNC and i + 1 < n:
+            kind = data[i + 1]
+            if kind == SampleFramer.TYPE_SAMPLES:
+                if i + SampleFramer.HEADER_SIZE > n:
+                    break
+                sync, kind, seq, base, count = struct.unpack_from(SampleFramer.HEADER_FORMAT, data, i)
+                size = SampleFramer.HEADER_SIZE + count*SampleFramer.SAMPLE_SIZE
+                if i + size > n:
+                    break
+                samples = [struct.unpack_from(SampleFramer.SAMPLE_FORMAT, data, i + SampleFramer.HEADER_SIZE + k*SampleFramer.SAMPLE_SIZE)
+                           for k in range(count)]
+                frames.append(('S', seq, base, samples))
+                i += size
+                continue
+            if kind == ResponseWriter.TYPE_RESPONSE:
+                size = struct.calcsize(ResponseWriter.FORMAT)
+                if i + size > n:
+                    break
+                frames.append(('R',) + struct.unpack_from(ResponseWriter.FORMAT, data, i)[2:])
+                i += size
+                continue
+            if kind in (deltaframer.TYPE_KEYFRAME, deltaframer.TYPE_DELTAS):
+                size = deltas.frame_size(data, i)
+                if size is None:
+                    break
+                frames.append((chr(kind), deltas.decode_frame(data, i)))
+                i += size
+                continue
+            if kind == recorder.TYPE_LOG:
+                if i + recorder.CHUNK_SIZE > n:
+                    break
+                sync, kind, count, index, base = struct.unpack_from(recorder.HEADER_FORMAT, data, i)
+                samples = [struct.unpack_from(recorder.SAMPLE_FORMAT, data, i + recorder.HEADER_SIZE + k*recorder.SAMPLE_SIZE)
+                           for k in range(count)]
+                frames.append(('L', index, base, samples))
+                i += recorder.CHUNK_SIZE
+                continue
+            if kind == RepAnalyzer.TYPE_REP:
+                size = struct.calcsize(RepAnalyzer.FORMAT)
+                if i + size > n:
+                    break
+                frames.append(('P',) + struct.unpack_from(RepAnalyzer.FORMAT, data, i)[2:])
+                i += size
+                continue
+            if kind == PerfStats.TYPE_STATS:
+                header = struct.calcsize(PerfStats.HEADER_FORMAT)
+                phase = struct.calcsize(PerfStats.PHASE_FORMAT)
+                if i + header > n:
+                    break
+                values = struct.unpack_from(PerfStats.HEADER_FORMAT, data, i)[2:]
+                size = header + values[-1]*phase
+                if i + size > n:
+                    break
+                phases = [struct.unpack_from(PerfStats.PHASE_FORMAT, data, i + header + k*phase) for k in range(values[-1])]
+                frames.append(('I', values[:-1], phases))
+                i += size
+                continue
+
+        end = data.find(b'\n', i)
+        if end < 0:
+            break
+        lines.append(data[i:end].decode('utf-8', 'replace'))
+        i = end + 1
+    return lines, frames
+
+
+class SimResult:
+
+    def __init__(self, simhw, duration, wall):
+        self.duration = duration
+        self.wall = wall
+        self.central = simhw.central
+        self.outputs = simhw.outputs
+        self.hx711 = list(simhw.hx711)
+        self.namespace = None       # Firmware globals at the end of the run
+
+        self.received = bytes(simhw.central.received)
+        self.lines, self.frames = decode_stream(self.received)
+
+    def samples(self):
+        values = [float(line[2:]) for line in self.lines if line.startswith('D:')]
+        for frame in self.frames:
+            if frame[0] == 'S':
+                values += [s[2] for s in frame[3]]
+            elif frame[0] in 'KD':
+                values += [s[2] for s in frame[1]]
+        return values
+
+    def summaries(self):
+        return [line for line in self.lines if line.startswith('P:')] + [f for f in self.frames if f[0] == 'P']
+
+    def responses(self):
+        return [line for line in self.lines if line.startswith('R:')] + [f for f in self.frames if f[0] == 'R']
+
+    def summary(self):
+        samples = len(self.samples())
+        conversions = sum(m.reads for m in self.hx711)
+        print(f'virtual time: {self.duration:.2f}s, wall time: {self.wall:.2f}s ({self.duration/max(self.wall, 1e-9):.1f}x)')
+        print(f'HX711 reads: {conversions}, samples sent: {samples} ({samples/max(self.duration, 1e-9):.1f}/s)')
+        print(f'UART writes: {self.central.writes}, bytes: {len(self.received)}, responses: {len(self.responses())}')
+        print(f'PWM duty writes: {self.outputs.pwm_writes} ({len(self.outputs.pwm)} changes), NeoPixel transfers: {self.outputs.pixel_writes}')
+
+
+# Drop firmware and simulation modules so every run starts from power on
+def _fresh_modules():
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None) or ''
+        if path.startswith(REPO_DIR) and name != __name__:
+            del sys.modules[name]
+
+    if SIM_DIR not in sys.path:
+        sys.path.insert(0, SIM_DIR)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(1, REPO_DIR)
+    return importlib.import_module('simhw')
+
+
+# Run code.py for duration virtual seconds.
+#   setup(simhw) - called before the firmware starts to attach models and schedule events
+#   speed/step_us - see simhw.SimClock
+#   connect_at - when the simulated central connects (None to stay disconnected)
+#   commands - list of (time s, command) sent over the UART
+#   fs_dir - directory standing in for the CIRCUITPY drive (a fresh temporary one if None)
+def run_firmware(duration, setup=None, speed=20.0, step_us=None, connect_at=0.5, commands=(),
+                 nvm_path=None, quiet=True, hx711=None, fs_dir=None):
+    if fs_dir is None:
+        with tempfile.TemporaryDirectory() as fs_dir:
+            return run_firmware(duration, setup, speed, step_us, connect_at, commands, nvm_path, quiet, hx711, fs_dir)
+
+    simhw = _fresh_modules()
+    simhw.nvm_path = nvm_path
+    simhw.clock = simhw.SimClock(speed=speed, step_ns=None if step_us is None else int(step_us*1000))
+
+    simhw.attach_hx711(**(hx711 or {}))
+
+    if connect_at is not None:
+        simhw.clock.at(connect_at, simhw.central.connect)
+    for at, command in commands:
+        simhw.clock.at(at, lambda command=command: simhw.central.send(command + '\n'))
+    if setup is not None:
+        setup(simhw)
+
+    simhw.clock.stop_after(duration)
+    simhw.clock.install()
+
+    cwd = os.getcwd()
+    os.chdir(fs_dir)
+    stdout = sys.stdout
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+    namespace = None
+    start = time.perf_counter()
+    try:
+        namespace = runpy.run_path(os.path.join(REPO_DIR, 'code.py'), run_name='__main__')
+    except simhw.SimulationEnd:
+        # runpy doesn't hand back globals when the script raises, fish them out of the traceback
+        tb = sys.exc_info()[2]
+        while tb.tb_next is not None:
+            if tb.tb_frame.f_code.co_filename.endswith('code.py') and tb.tb_frame.f_code.co_name == '<module>':
+                namespace = tb.tb_frame.f_globals
+            tb = tb.tb_next
+    finally:
+        wall = time.perf_counter() - start
+        simhw.clock.uninstall()
+        os.chdir(cwd)
+        if quiet:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    result = SimResult(simhw, simhw.clock.peek_ns()/1e9, wall)
+    result.namespace = namespace
+    return result
+
+
+# waveform spec: constant:<load> | steps:<a>,<b>,...@<period> | reps:<peak>
+def parse_waveform(simhw, spec):
+    kind, _, args = spec.partition(':')
+    if kind == 'constant':
+        return simhw.constant(float(args or 0))
+    if kind == 'steps':
+        levels, _, period = args.partition('@')
+        return simhw.steps([float(v) for v in levels.split(',')], float(period or 1))
+    if kind == 'reps':
+        return simhw.reps(float(args or 20))
+    raise ValueError(f'Unknown waveform {spec}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run code.py against simulated hardware')
+    parser.add_argument('--duration', type=float, default=5.0, help='virtual seconds to run')
+    parser.add_argument('--speed', type=float, default=20.0, help='virtual seconds per wall second while busy')
+    parser.add_argument('--step-us', type=float, default=None, help='deterministic clock: microseconds per clock read')
+    parser.add_argument('--waveform', default='constant:0', help='constant:<load>, steps:<a>,<b>@<period> or reps:<peak>')
+    parser.add_argument('--rate', type=int, default=80, help='HX711 samples per second')
+    parser.add_argument('--noise', type=float, default=20.0, help='HX711 noise in counts (std dev)')
+    parser.add_argument('--spike-rate', type=float, default=0.0, help='probability of a spike per conversion')
+    parser.add_argument('--nvm', default=None, help='file backing nvm')
+    parser.add_argument('--connect-at', type=float, default=0.5, help='when the central connects')
+    parser.add_argument('--command', action='append', default=[], help='<time>:<command> to send, repeatable')
+    parser.add_argument('--verbose', action='store_true', help='show firmware console output')
+    args = parser.parse_args()
+
+    commands = []
+    for spec in args.command:
+        at, _, command = spec.partition(':')
+        commands.append((float(at), command))
+
+    def setup(simhw):
+        simhw.hx711[0].set_load(parse_waveform(simhw, args.waveform))
+
+    result = run_firmware(args.duration, setup=setup, speed=args.speed, step_us=args.step_us,
+                          connect_at=args.connect_at, commands=commands, nvm_path=args.nvm,
+                          quiet=not args.verbose,
+                          hx711={'rate': args.rate, 'noise': args.noise, 'spike_rate': args.spike_rate})
+    result.summary()
+
+
+if __name__ == '__main__':
+    main()
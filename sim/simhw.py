@@ -0,0 +1,347 @@
+# simhw.py
+#
+# Shared state for the host simulation: virtual clock, pins and hardware models
+#
+# The stand-in modules in this directory (board, digitalio, pwmio, neopixel, microcontroller,
+# adafruit_ble) all talk to the objects here, so a test or benchmark can set up the load
+# waveform, drive the BLE central and inspect what the firmware did.
+
+import math
+import random
+import time
+
+
+# Raised from the clock when the simulated run is over. Not an Exception, so firmware
+# error handling can't swallow it.
+class SimulationEnd(BaseException):
+    pass
+
+
+# --- CLOCK ---
+
+class SimClock:
+
+    # speed - virtual seconds per wall second while the firmware is busy. time.sleep() never
+    #         really sleeps, it just moves virtual time forward.
+    # step_ns - if set, time is fully deterministic: every clock read advances by step_ns
+    #           instead of following the wall clock.
+    def __init__(self, speed=10.0, step_ns=None):
+        self.speed = speed
+        self.step_ns = step_ns
+
+        self.offset_ns = 0
+        self.virtual_ns = 0
+        self.wall_start = time.perf_counter_ns()
+
+        self.stop_ns = None
+        self.events = []        # (time ns, callback), sorted
+
+        self.real_monotonic_ns = time.monotonic_ns
+        self.real_sleep = time.sleep
+
+    # Virtual time without advancing it (used by the hardware models)
+    def peek_ns(self):
+        if self.step_ns is not None:
+            return self.virtual_ns
+        return int((time.perf_counter_ns() - self.wall_start)*self.speed) + self.offset_ns
+
+    def monotonic_ns(self):
+        if self.step_ns is not None:
+            self.virtual_ns += self.step_ns
+        now = self.peek_ns()
+        self.run_events(now)
+        return now
+
+    def monotonic(self):
+        return self.monotonic_ns()/1e9
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            if self.step_ns is not None:
+                self.virtual_ns += int(seconds*1e9)
+            else:
+                self.offset_ns += int(seconds*1e9)
+        self.run_events(self.peek_ns())
+
+    # Run callback once virtual time reaches at (seconds)
+    def at(self, seconds, callback):
+        self.events.append((int(seconds*1e9), callback))
+        self.events.sort(key=lambda e: e[0])
+
+    def stop_after(self, seconds):
+        self.stop_ns = int(seconds*1e9)
+
+    def run_events(self, now):
+        while self.events and self.events[0][0] <= now:
+            callback = self.events.pop(0)[1]
+            callback()
+        if self.stop_ns is not None and now >= self.stop_ns:
+            raise SimulationEnd()
+
+    # Route the time module through this clock. Firmware modules call time.monotonic() etc. at
+    # call time, so patching the module is enough.
+    def install(self):
+        time.monotonic = self.monotonic
+        time.monotonic_ns = self.monotonic_ns
+        time.sleep = self.sleep
+
+    def uninstall(self):
+        time.monotonic = lambda: self.real_monotonic_ns()/1e9
+        time.monotonic_ns = self.real_monotonic_ns
+        time.sleep = self.real_sleep
+
+
+clock = SimClock()
+
+
+def now():
+    return clock.peek_ns()/1e9
+
+
+# --- PINS ---
+
+class SimPin:
+
+    def __init__(self, name):
+        self.name = name
+        self.level = True       # Floating inputs read high (pull ups)
+        self.models = []        # Hardware models attached to this pin. The first one drives it when read
+        self.writes = 0
+
+    def read(self):
+        if self.models:
+            return self.models[0].read_pin(self)
+        return self.level
+
+    def write(self, value):
+        self.writes += 1
+        self.level = value
+        for model in self.models:
+            model.write_pin(self, value)
+
+    def __repr__(self):
+        return f'board.{self.name}'
+
+
+pins = {}
+
+
+def pin(name):
+    if name not in pins:
+        pins[name] = SimPin(name)
+    return pins[name]
+
+
+# --- LOAD WAVEFORMS --- Functions of time (s) returning load in calibrated units
+
+def constant(load):
+    return lambda t: load
+
+
+# Load alternating between levels every period seconds
+def steps(levels, period):
+    return lambda t: levels[int(t/period) % len(levels)]
+
+
+# Repetitions: rest, smooth pull up to peak held for hold seconds, release
+def reps(peak, rise=0.5, hold=1.0, fall=0.5, rest=2.0, start=1.0):
+    cycle = rise + hold + fall + rest
+
+    def load(t):
+        if t < start:
+            return 0.0
+        t = (t - start) % cycle
+        if t < rise:
+            return peak*0.5*(1 - math.cos(math.pi*t/rise))
+        t -= rise
+        if t < hold:
+            return peak
+        t -= hold
+        if t < fall:
+            return peak*0.5*(1 + math.cos(math.pi*t/fall))
+        return 0.0
+    return load
+
+
+# --- HX711 MODEL ---
+
+class HX711Model:
+
+    # Bit accurate DOUT/PD_SCK model. Conversions complete every 1/rate seconds while powered.
+    # The value for each conversion is offset + load(t)*counts_per_unit + gaussian noise, with
+    # optional single sample spikes, as a 24 bit two's complement number shifted out MSB first.
+    # The number of clock pulses after the 24 data bits picks the gain for the next conversion.
+    def __init__(self, dout, pd_sck, power=None, rate=80, load=None, offset=8000,
+                 counts_per_unit=1000.0, noise=20.0, spike_rate=0.0, spike_size=200000, seed=1):
+        self.dout = dout
+        self.pd_sck = pd_sck
+        self.power = power
+        self.period_ns = int(1e9/rate)
+        self.load = load or constant(0.0)
+        self.offset = offset
+        self.counts_per_unit = counts_per_unit
+        self.noise = noise
+        self.spike_rate = spike_rate
+        self.spike_size = spike_size
+        self.random = random.Random(seed)
+
+        self.gain_pulses = 1    # Channel A, gain 128
+        self.shifting = False
+        self.pulses = 0
+        self.word = 0
+        self.bit = True
+        self.ready_ns = 0       # Time the current conversion completes
+        self.unplugged = False
+
+        self.conversions = 0
+        self.reads = 0
+
+        for p in (dout, pd_sck, power):
+            if p is not None:
+                p.models.append(self)
+
+    def powered(self):
+        return not self.unplugged and (self.power is None or self.power.level)
+
+    def set_load(self, load):
+        self.load = load
+
+    def gain_scale(self):
+        # Channel A 128 is the reference, A 64 halves it, channel B (32) is a quarter
+        return {1: 1.0, 3: 0.5, 2: 0.25}.get(self.gain_pulses, 1.0)
+
+    def conversion_value(self, t):
+        value = self.offset + self.load(t)*self.counts_per_unit
+        value *= self.gain_scale()
+        if self.noise:
+            value += self.random.gauss(0.0, self.noise)
+        if self.spike_rate and self.random.random() < self.spike_rate:
+            value += self.random.choice((-1, 1))*self.spike_size
+        value = int(value)
+        return max(-0x800000, min(0x7FFFFF, value)) & 0xFFFFFF
+
+    # The shift is over once the gain pulses are done and the next conversion is due
+    def finish_if_due(self, now):
+        if self.shifting and self.pulses >= 25 and now >= self.ready_ns:
+            self.shifting = False
+
+    def read_pin(self, p):
+        if p is self.dout:
+            if not self.powered():
+                return True
+            now = clock.peek_ns()
+            self.finish_if_due(now)
+            if self.shifting:
+                return self.bit
+            return now < self.ready_ns
+        return p.level
+
+    def write_pin(self, p, value):
+        if p is self.power:
+            if value:
+                self.ready_ns = clock.peek_ns() + self.period_ns
+            self.shifting = False
+            return
+
+        if p is not self.pd_sck or not self.powered():
+            return
+
+        if value:
+            # Rising edge
+            now = clock.peek_ns()
+            self.finish_if_due(now)
+            if not self.shifting:
+                if now < self.ready_ns:
+                    return      # Clocking before DRDY does nothing
+                self.shifting = True
+                self.pulses = 0
+                self.word = self.conversion_value(now/1e9)
+                self.conversions += 1
+
+            self.pulses += 1
+            if self.pulses <= 24:
+                self.bit = bool((self.word >> (24 - self.pulses)) & 1)
+            else:
+                # DOUT goes high after the 24th bit until the next conversion
+                self.bit = True
+                self.gain_pulses = min(self.pulses - 24, 3)
+                if self.pulses == 25:
+                    self.reads += 1
+                    # Next conversion completes one period after this one was read
+                    self.ready_ns = max(self.ready_ns + self.period_ns, now + self.period_ns//2)
+
+
+hx711 = []
+
+
+def attach_hx711(dout='D9', pd_sck='D10', power='D5', **kwargs):
+    model = HX711Model(pin(dout), pin(pd_sck), pin(power) if power else None, **kwargs)
+    hx711.append(model)
+    return model
+
+
+# --- RECORDERS ---
+
+class OutputLog:
+
+    def __init__(self):
+        self.pwm = []           # (time s, pin, duty cycle) for every duty cycle change
+        self.pwm_writes = 0
+        self.pixels = []        # (time s, colours) for every NeoPixel transfer
+        self.pixel_writes = 0
+
+    def clear(self):
+        self.__init__()
+
+
+outputs = OutputLog()
+
+
+# --- BLE ---
+
+class BLECentral:
+
+    # Host side of the simulated link. The firmware's UARTService writes land in received;
+    # send() queues bytes for the firmware to read.
+    def __init__(self):
+        self.connected = False
+        self.connection_interval = 30.0
+        self.to_device = bytearray()
+        self.received = bytearray()
+        self.writes = 0         # uart.write calls from the firmware
+        self.connects = 0
+
+    def connect(self):
+        self.connected = True
+        self.connects += 1
+
+    def disconnect(self):
+        self.connected = False
+        self.to_device = bytearray()
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.to_device += data
+
+    def take_received(self):
+        data = bytes(self.received)
+        self.received = bytearray()
+        return data
+
+
+central = BLECentral()
+
+
+# --- NVM ---
+
+nvm_path = None     # File backing microcontroller.nvm, None for a fresh erased store every run
+nvm_size = 8192
+
+
+def reset():
+    global outputs, central
+    pins.clear()
+    hx711.clear()
+    outputs = OutputLog()
+    central = BLECentral()
@@ -0,0 +1,26 @@
+# ticks.py
+#
+# Millisecond tick counter that stays within small-int range
+
+import time
+
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+# supervisor.ticks_ms() doesn't allocate, monotonic_ns() returns a long int
+try:
+    from supervisor import ticks_ms
+except ImportError:
+    def ticks_ms():
+        return (time.monotonic_ns() // 1000000) & TICKS_MAX
+
+
+# Signed difference between two tick values (ticks1 - ticks2), wrap safe
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & TICKS_MAX
+    return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
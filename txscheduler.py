@@ -0,0 +1,230 @@
+# txscheduler.py
+#
+# Connection interval paced output for the BLE UART
+#
+# Everything the firmware sends is queued here instead of going straight to uart.write, and once
+# per connection interval flush() gathers up to one event's worth of it (mtu bytes x packets per
+# event) into a single write. Two queues feed it:
+#   control - responses, reports, log lines and log download chunks. Never dropped: producers that
+#             can wait check room() first (back-pressure), and a write that doesn't fit flushes
+#             early instead, which is counted as a stall.
+#   stream  - samples and frames. When full the oldest whole message is dropped, so a slow link
+#             loses old samples rather than holding up the main loop. Counted as drops.
+# Control goes first in each flush. A message longer than the space left in an event continues in
+# the next one, and is finished before anything else is sent so messages never interleave.
+#
+# Queues are preallocated rings, queueing copies bytes and allocates nothing beyond encoding text.
+
+from array import array
+
+from ticks import ticks_ms, ticks_diff
+
+
+class MessageQueue:
+
+    def __init__(self, size, slots):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.size = size
+        self.start = 0          # Ring offset of the oldest byte
+        self.used = 0
+
+        # Message lengths, oldest first
+        self.lengths = array('H', [0]*slots)
+        self.slots = slots
+        self.first = 0
+        self.messages = 0
+        self.head_sent = 0      # Bytes of the oldest message already sent
+
+        self.peak = 0           # Most bytes queued at once
+
+    def free(self):
+        if self.messages >= self.slots:
+            return 0
+        return self.size - self.used
+
+    def clear(self):
+        self.start = 0
+        self.used = 0
+        self.first = 0
+        self.messages = 0
+        self.head_sent = 0
+
+    # Queue data, which must fit in free()
+    def put(self, data):
+        n = len(data)
+        end = (self.start + self.used) % self.size
+        if end + n <= self.size:
+            self.buffer[end:end + n] = data
+        else:
+            split = self.size - end
+            data = memoryview(data)
+            self.buffer[end:] = data[:split]
+            self.buffer[:n - split] = data[split:]
+        self.used += n
+        if self.used > self.peak:
+            self.peak = self.used
+
+        self.lengths[(self.first + self.messages) % self.slots] = n
+        self.messages += 1
+
+    # Drop the oldest message that hasn't started going out. Returns True if one was dropped
+    def drop_oldest(self):
+        if self.messages == 0 or (self.head_sent and self.messages == 1):
+            return False
+        if not self.head_sent:
+            n = self.lengths[self.first]
+            self.start = (self.start + n) % self.size
+            self.used -= n
+            self.pop()
+            return True
+
+        # The oldest is partly sent: drop the one after it and move the rest of the oldest up
+        second = (self.first + 1) % self.slots
+        n = self.lengths[second]
+        buffer = self.buffer
+        size = self.size
+        start = self.start
+        for i in range(self.lengths[self.first] - self.head_sent - 1, -1, -1):
+            buffer[(start + n + i) % size] = buffer[(start + i) % size]
+        self.start = (start + n) % size
+        self.used -= n
+        self.lengths[second] = self.lengths[self.first]
+        self.first = second
+        self.messages -= 1
+        return True
+
+    def pop(self):
+        self.first = (self.first + 1) % self.slots
+        self.messages -= 1
+        self.head_sent = 0
+
+    # Take the rest of a partly sent oldest message, so nothing lands in the middle of it
+    def finish(self, out, offset, limit):
+        if not self.head_sent:
+            return offset
+        return self.take(out, offset, min(limit, offset + self.lengths[self.first] - self.head_sent))
+
+    # Move queued bytes into out from offset up to limit. Returns the new offset
+    def take(self, out, offset, limit):
+        while offset < limit and self.messages:
+            n = min(self.lengths[self.first] - self.head_sent, limit - offset, self.size - self.start)
+            out[offset:offset + n] = self.view[self.start:self.start + n]
+            offset += n
+            self.start = (self.start + n) % self.size
+            self.used -= n
+            self.head_sent += n
+            if self.head_sent == self.lengths[self.first]:
+                self.pop()
+        return offset
+
+
+class TxScheduler:
+
+    DEFAULT_MTU = 20        # Notification payload at the default ATT MTU
+    MAX_MTU = 244           # With data length extension
+    DEFAULT_PACKETS = 4     # Notifications per connection event
+    MAX_PACKETS = 8
+    MAX_BURST = 512         # Most bytes sent in one flush
+
+    def __init__(self, uart, control_size=1024, stream_size=1024):
+        self.uart = uart
+        self.control = MessageQueue(control_size, 32)
+        self.stream = MessageQueue(stream_size, 64)
+        self.out = bytearray(self.MAX_BURST)
+        self.out_view = memoryview(self.out)
+
+        self.mtu = self.DEFAULT_MTU
+        self.packets = self.DEFAULT_PACKETS
+        self.budget = self.mtu*self.packets
+
+        # Counters
+        self.sent = 0           # Bytes written to the UART
+        self.flushes = 0
+        self.stalls = 0         # Control writes that had to flush early
+        self.dropped = 0        # Stream messages dropped
+        self.rate = 0           # Bytes/s over the last full second
+        self.window_start = ticks_ms()
+        self.window_bytes = 0
+
+    def configure(self, mtu, packets):
+        if not (self.DEFAULT_MTU <= mtu <= self.MAX_MTU and 1 <= packets <= self.MAX_PACKETS):
+            raise ValueError('MTU or packets per event out of range')
+        self.mtu = mtu
+        self.packets = packets
+        self.budget = min(mtu*packets, self.MAX_BURST)
+
+    def reset_stats(self):
+        self.stalls = 0
+        self.dropped = 0
+        self.control.peak = 0
+        self.stream.peak = 0
+
+    # Drop everything queued, the link is gone
+    def clear(self):
+        self.control.clear()
+        self.stream.clear()
+
+    # Space for control messages, for producers that can wait
+    def room(self):
+        return self.control.free()
+
+    def pending(self):
+        return self.control.messages + self.stream.messages
+
+    # Queue a control message (text or bytes). Same signature as uart.write
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        if n > self.control.size:
+            # Can never fit, send what's queued then write it straight out
+            while self.control.messages or self.stream.head_sent:
+                self.stall()
+            self.uart.write(data)
+            self.count_sent(n)
+            return
+        while self.control.free() < n:
+            self.stall()
+        self.control.put(data)
+
+    # Queue a stream message, dropping the oldest ones if there's no room
+    def write_stream(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        stream = self.stream
+        if n > stream.size:
+            self.dropped += 1
+            return
+        while stream.free() < n:
+            if stream.drop_oldest():
+                self.dropped += 1
+            else:
+                self.stall()
+        stream.put(data)
+
+    def stall(self):
+        self.stalls += 1
+        self.flush()
+
+    # Send up to one connection event's worth, control messages first
+    def flush(self):
+        n = self.stream.finish(self.out, 0, self.budget)
+        n = self.control.take(self.out, n, self.budget)
+        n = self.stream.take(self.out, n, self.budget)
+        if n:
+            self.uart.write(self.out_view[:n])
+            self.flushes += 1
+        self.count_sent(n)
+
+    # Byte counters, and the rate once a second has passed
+    def count_sent(self, n):
+        self.sent += n
+        self.window_bytes += n
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self.window_start)
+        if elapsed >= 1000:
+            self.rate = self.window_bytes*1000//elapsed
+            self.window_start = now
+            self.window_bytes = 0